@@ -1,5 +1,8 @@
-import json
 import argparse
+import numpy as np
+import impress_exact_structs as ies
+import json_columns
+import live_time
 
 #%matplotlib tk
 
@@ -8,14 +11,37 @@ def dead_time_sum():
         description='Files to sum dead time')
     p.add_argument(
         'files', nargs='+',
-        help='Name of Json files to get dead time of')
+        help='Name of Json files (or columnar directories) to get dead time of')
+    p.add_argument(
+        '--live', action='store_true',
+        help='also print live time, corrected rate and pileup ratio per channel')
     args = p.parse_args()
 
     for i in range(len(args.files)):
         current_selected = args.files[i]
-        with open(current_selected, 'r') as f:
-            data = json.loads(f.read())
-        print(sum(data['dead_time']['value']) / float(10**6))
+        # Only the columns needed get parsed, from JSON or columnar output
+        columns = live_time.FRAME_COLUMNS if args.live else ('dead_time',)
+        data = json_columns.load(current_selected, columns)
+        total = float(data['dead_time']['value'].sum())
+        print(total / float(10**6))
+
+        if args.live:
+            frames = live_time.frames_from_columns(data)
+            corrected = live_time.correct_frames(frames)
+            for ch, name in enumerate(ies.HAFX_CHANNELS):
+                sel = frames['ch'] == ch
+                if not sel.any():
+                    continue
+                live = corrected['live_time'][sel].sum()
+                real = corrected['real_time'][sel].sum()
+                evts = frames['num_evts'][sel].sum(dtype=np.float64)
+                triggers = frames['num_triggers'][sel].sum(dtype=np.float64)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    print(
+                        f'  {name}: live {live:.3f} s of {real:.3f} s,'
+                        f' corrected rate {evts / live:.1f}/s,'
+                        f' pileup ratio {(triggers - evts) / triggers:.3f}'
+                    )
 
 if __name__ == '__main__':
     dead_time_sum()
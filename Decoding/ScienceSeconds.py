@@ -1,19 +1,11 @@
 import argparse
 import datetime as dt
-import json
 import gzip
 import numpy as np
+import fast_json
 import helpers as hp
 import constants as umncon
 
-# Monkeypatch JSON to output only 2 decmials
-# https://stackoverflow.com/a/69056325
-class RoundingFloat(float):
-    __repr__ = staticmethod(lambda x: format(x, '.2f'))
-
-json.encoder.c_make_encoder = None
-json.encoder.float = RoundingFloat
-
 
 def decode_health():
     p = argparse.ArgumentParser(
@@ -57,7 +49,7 @@ def decode_health():
     final_data['processed_data'] = processed_data
     final_data['raw_data'] = collapsed
     with open(args.output_fn, 'w') as f:
-        json.dump(final_data, f, indent=1)
+        fast_json.dump(final_data, f, indent=1)
 
 
 def decode_x123_sci():
@@ -125,7 +117,7 @@ def decode_hafx_debug_hist():
         'histograms': [d['registers'] for d in decoded]
     }
     with open(args.output_fn, 'w') as f:
-        json.dump(out, f, indent=1)
+        fast_json.dump(out, f, indent=1)
 
 
 def get_proper_timedelta(file_name):
@@ -1,18 +1,48 @@
 import argparse
-import datetime as dt
-import json
+import base64
+import contextlib
 import gzip
 import numpy as np
+import columnar
+import fast_json
+import health_stats
+import incremental
 import helpers as hp
-import constants as umncon
+import impress_exact_structs as ies
+import parallel_load
+import frame_times as ft
 
-# Monkeypatch JSON to output only 2 decmials
-# https://stackoverflow.com/a/69056325
-class RoundingFloat(float):
-    __repr__ = staticmethod(lambda x: format(x, '.2f'))
+OUTPUT_FORMATS = ('json', 'columnar')
+# Wide enough for every `hp.get_data_format` result
+DATA_FORMAT_DTYPE = 'U16'
 
-json.encoder.c_make_encoder = None
-json.encoder.float = RoundingFloat
+
+def add_format_argument(p: argparse.ArgumentParser):
+    p.add_argument(
+        '--format', choices=OUTPUT_FORMATS, default='json',
+        help='write JSON, or a columnar directory of .npy files (see `columnar`)')
+    p.add_argument(
+        '--incremental', action='store_true',
+        help='only decode files which are new or grew since the last run,'
+             ' appending to the columnar output (see `incremental`)')
+
+
+def parse_format_args(p: argparse.ArgumentParser) -> argparse.Namespace:
+    args = p.parse_args()
+    if args.incremental and args.format != 'columnar':
+        p.error('--incremental needs --format columnar')
+    return args
+
+
+@contextlib.contextmanager
+def open_column_writer(output_fn: str, format_: str, attrs: dict[str, object], append: bool=False):
+    ''' Something to `write` batches of columns to, in either output format '''
+    if format_ == 'columnar':
+        with columnar.ColumnarWriter(output_fn, attrs, append) as writer:
+            yield writer
+    else:
+        with open(output_fn, 'w') as f, fast_json.ColumnWriter(f) as writer:
+            yield writer
 
 
 def decode_health():
@@ -24,43 +54,60 @@ def decode_health():
     p.add_argument(
         'output_fn',
         help='output file name to write JSON')
-    args = p.parse_args()
-
-    health_data = []
-    for fn in args.health_files:
-        health_data += hp.read_det_health(fn, gzip.open)
+    add_format_argument(p)
+    args = parse_format_args(p)
+    if args.format == 'columnar':
+        decode_health_columnar(args)
+        return
 
-    jsonified = [hd.to_json() for hd in health_data]
-    jsonified.sort(key=lambda e: e['timestamp'])
-    collapsed = collapse_health(jsonified)
+    health = np.concatenate(list(hp.iter_det_health_array(args.health_files, gzip.open)))
+    health = health[np.argsort(health['timestamp'], kind='stable')]
+    columns = ies.DetectorHealth.batch_to_json(health)
 
-    processed_data = {}
-    processed_data['start_time'] = collapsed['timestamp'][0]
-    
-    for i in ['c1', 'm1', 'm5', 'x1']:
-        processed_data[i] = {}
-        for j in ['arm_temp', 'sipm_temp', 'sipm_operating_voltage']:
-            processed_data[i][j] = (cur_proc := {})
-            cur_data = collapsed[i][j]['value']
+    # Same key order as `collapse_health`
+    timestamps = columns.pop('timestamp')
+    collapsed = columns | {'timestamp': timestamps}
 
-            cur_proc['avg'] = np.mean(cur_data)
-            cur_proc['min'] = min(cur_data)
-            cur_proc['max'] = max(cur_data)
-
-    processed_data['x123'] = (x123_proc := {})
-    for j in ['board_temp', 'det_high_voltage', 'det_temp']:
-        x123_proc[j] = (cur_proc := {})
-        cur_data = collapsed['x123'][j]['value']
-
-        cur_proc['avg'] = np.mean(cur_data)
-        cur_proc['min'] = min(cur_data)
-        cur_proc['max'] = max(cur_data)
+    stats = health_stats.HealthStats()
+    stats.update(health)
+    processed_data = stats.summary()
 
     final_data = {}
     final_data['processed_data'] = processed_data
     final_data['raw_data'] = collapsed
     with open(args.output_fn, 'w') as f:
-        json.dump(final_data, f, indent=1)
+        fast_json.dump(final_data, f, indent=1)
+
+
+def decode_health_columnar(args: argparse.Namespace):
+    '''
+    Raw health columns, with the running summary stats
+    kept in the manifest (attrs['stats']) so an incremental
+    run only has to fold in the new records.
+    '''
+    with columnar.ColumnarWriter(args.output_fn, {'product': 'det_health'}, args.incremental) as writer:
+        watermark = incremental.Watermark(writer.attrs.get('sources'))
+        stats = (
+            health_stats.HealthStats.from_state(writer.attrs['stats'])
+            if 'stats' in writer.attrs else health_stats.HealthStats()
+        )
+
+        new = []
+        for fn, st, done, health in incremental.read_pending(
+            watermark.pending(args.health_files),
+            lambda fn: hp.read_det_health_array(fn, gzip.open)
+        ):
+            new.append(health[done:])
+            watermark.mark(fn, st, len(health))
+
+        if new:
+            health = np.concatenate(new)
+            health = health[np.argsort(health['timestamp'], kind='stable')]
+            writer.write(ies.DetectorHealth.batch_to_json(health))
+            stats.update(health)
+
+        writer.attrs['sources'] = watermark.to_json()
+        writer.attrs['stats'] = stats.state()
 
 
 def decode_x123_sci():
@@ -72,16 +119,53 @@ def decode_x123_sci():
     p.add_argument(
         'output_fn',
         help='output file name to write JSON')
-    args = p.parse_args()
+    add_format_argument(p)
+    args = parse_format_args(p)
+    if args.format == 'columnar':
+        decode_x123_sci_columnar(args)
+        return
 
-    x123_data = []
+    json_out = []
     for fn in args.x123_files:
-        x123_data += hp.read_x123_sci(fn, gzip.open)
-
-    json_out = [xd.to_json() for xd in x123_data]
+        x123_data = hp.read_x123_sci_array(fn, gzip.open)
+        # Same layout as `X123NominalSpectrumStatus.to_json`
+        for timestamp, size, histogram, status in zip(
+            x123_data['timestamp'].tolist(),
+            x123_data['spectrum_size'].tolist(),
+            x123_data['histogram'].tolist(),
+            x123_data['status']
+        ):
+            json_out.append({
+                'timestamp': timestamp,
+                'histogram': histogram[:size],
+                'status_b64': base64.b64encode(status.tobytes()).decode('utf-8'),
+            })
     json_out.sort(key=lambda e: e['timestamp'])
     with open(args.output_fn, 'w') as f:
-        json.dump(json_out, f, indent=1)
+        fast_json.dump(json_out, f, indent=1)
+
+def decode_x123_sci_columnar(args: argparse.Namespace):
+    ''' X123 science columns, with raw status bytes instead of base64 '''
+    with columnar.ColumnarWriter(args.output_fn, {'product': 'x123_sci'}, args.incremental) as writer:
+        watermark = incremental.Watermark(writer.attrs.get('sources'))
+        for fn, st, done, x123_data in incremental.read_pending(
+            watermark.pending(args.x123_files),
+            lambda fn: hp.read_x123_sci_array(fn, gzip.open)
+        ):
+            histogram = x123_data['histogram'][done:]
+            # Narrower spectra get zero-padded to what's already there
+            width = (writer.row_shape('histogram') or histogram.shape[1:])[0]
+            if histogram.shape[1] < width:
+                histogram = np.pad(histogram, ((0, 0), (0, width - histogram.shape[1])))
+            writer.write({
+                'timestamp': x123_data['timestamp'][done:],
+                'spectrum_size': x123_data['spectrum_size'][done:],
+                'histogram': histogram,
+                'status': x123_data['status'][done:],
+            })
+            watermark.mark(fn, st, len(x123_data['timestamp']))
+        writer.attrs['sources'] = watermark.to_json()
+
 
 def decode_x123_debug():
     p = argparse.ArgumentParser(
@@ -94,13 +178,13 @@ def decode_x123_debug():
         help='output file name to write JSON')
     args = p.parse_args()
 
-    x123_data = []
-    for fn in args.x123_files:
-        x123_data += hp.read_x123_debug(fn, gzip.open)
-
-    json_out = [xd.decode() for xd in x123_data]
+    json_out = [
+        xd.decode()
+        for batch in hp.iter_x123_debug(args.x123_files, gzip.open)
+        for xd in batch
+    ]
     with open(args.output_fn, 'w') as f:
-        json.dump(json_out, f, indent=1)
+        fast_json.dump(json_out, f, indent=1)
 
 
 def decode_hafx_debug_hist():
@@ -114,11 +198,11 @@ def decode_hafx_debug_hist():
         help='output file name to write JSON')
     args = p.parse_args()
 
-    data = []
-    for fn in args.files:
-        data += hp.read_hafx_debug(fn, gzip.open)
-    
-    decoded = [d.decode() for d in data]
+    decoded = [
+        d.decode()
+        for batch in hp.iter_hafx_debug(args.files, gzip.open)
+        for d in batch
+    ]
     if any(d['type'] != 'histogram' for d in decoded):
         raise ValueError(
             "Cannot decode debug other than histograms,"
@@ -129,44 +213,7 @@ def decode_hafx_debug_hist():
         'histograms': [d['registers'] for d in decoded]
     }
     with open(args.output_fn, 'w') as f:
-        json.dump(out, f, indent=1)
-
-
-def get_proper_timedelta(file_name):
-    '''
-    Rebinned science data will have different time deltas between events.
-    This is because if we sum along the time axis, the counts in the
-    spectrogram can be considered to be bounded by wider time edges.
-
-    Make this a function so that we can update it if we change the rebinning scheme down the line.
-    '''
-    # File name format is: IDENT_DATE_#.extension
-    identifier, date_str, _ = file_name.split('_')
-    date = dt.datetime.strptime(date_str, umncon.DATE_FMT)
-    slice_width = dt.timedelta(seconds= 1/32 ) 
-
-    # if 'time' in identifier:
-    #     # Add more revisions as appropriate
-    #     if date >= umncon.FIRST_REVISION:
-    #         return umncon.FIRST_NUM_TIMES_REBIN * slice_width
-    return slice_width
-
-
-def get_data_format(fn: str) -> str:
-    '''
-    Depending on the file naming convention used by the rebinner,
-    we can either be dealing with:
-        - "raw" aka full-resolution data
-        - rebinned across time
-        - rebinned across energy
-        - rebinneda cross time and energy
-    '''
-    possibilities = ('time+energy', 'time', 'energy')
-    for p in possibilities:
-        if fn.startswith(p): return p
-
-    # No rebinning has happened; return something useful
-    return 'full_resolution'
+        fast_json.dump(out, f, indent=1)
 
 
 def decode_hafx_sci():
@@ -187,65 +234,64 @@ def decode_hafx_sci():
     p.add_argument(
         'output_fn',
         help='output file name to write JSON')
-    args = p.parse_args()
+    parallel_load.add_pool_arguments(p)
+    add_format_argument(p)
+    args = parse_format_args(p)
+
+    # Columns get written out a batch at a time,
+    # so memory doesn't grow with the number of files
+    with open_column_writer(args.output_fn, args.format, {'product': 'hafx_sci'}, args.incremental) as writer:
+        # Only columnar output remembers anything between runs
+        state = writer.attrs if args.format == 'columnar' else {}
+        watermark = incremental.Watermark(state.get('sources'))
+        pending = watermark.pending(args.files)
+        # Frames before the first anchor in a batch use the last one seen
+        prior_anchor = state.get('prior_anchor', 0)
+
+        if args.incremental:
+            # One at a time, so a file still being written can be left for later
+            loaded = incremental.read_pending(
+                pending, lambda fn: hp.read_hafx_sci_array(fn, gzip.open))
+        else:
+            # Files get decompressed in parallel and memory-mapped
+            hafx_arrays = parallel_load.load_hafx_sci(
+                [fn for fn, *_ in pending], gzip.open, args.workers, args.chunksize)
+            loaded = (
+                (fn, st, done, hafx_data)
+                for (fn, st, done), hafx_data in zip(pending, hafx_arrays)
+            )
+
+        for fn, st, done, hafx_data in loaded:
+            slice_width = hp.get_proper_timedelta(fn)
+            data_format = hp.get_data_format(fn)
+            # Only one batch of raw records is paged in at a time
+            for start in range(done, len(hafx_data), hp.BATCH_SIZE):
+                cur_data = hafx_data[start:start + hp.BATCH_SIZE]
+                time_anchor = cur_data['time_anchor']
+                times = ft.frame_times(
+                    time_anchor, cur_data['buffer_number'], slice_width, prior_anchor)
+
+                columns = ies.NominalHafx.batch_to_json(cur_data)
+                columns.pop('time_anchor')
+                columns['timestamp'] = {
+                    'unit': 'N/A',
+                    # Columnar output keeps the datetime64s
+                    'value': times if args.format == 'columnar' else ft.isoformat(times)
+                }
+                columns['datatype'] = {
+                    'unit': 'N/A',
+                    'value': np.full(len(cur_data), data_format, dtype=DATA_FORMAT_DTYPE)
+                }
+                writer.write(columns)
 
-    hafx_data = []
-    time_deltas = []
-    data_type = []
-    for fn in args.files:
-        hafx_data += (cur_data := hp.read_hafx_sci(fn, gzip.open))
-        # Give as many timedeltas and data formats
-        # as there are data points per file,
-        # so that we can easily align them later
-
-        #this sucks and it always 4 seconds for some reason
-        time_deltas += ([get_proper_timedelta(fn)] * len(cur_data))
-        data_type += [get_data_format(fn)] * len(cur_data)
-    
-
-    jsonified = [hd.to_json() for hd in hafx_data]
-    # from_timestamp = lambda ts: dt.datetime.fromtimestamp(ts, tz=dt.timezone.utc)
-    # recent = from_timestamp(hafx_data[0].time_anchor)
-    # times = [recent]
-    # idx = 1
-    # for hd in hafx_data[1:]:
-    #     if hd.time_anchor != 0:
-    #         recent = from_timestamp(hd.time_anchor)
-    #     times.append(recent + dt.timedelta(seconds=((idx % 32) / 32)))
-    #     jsonified[idx]['time_anchor']['value'] = times[idx].isoformat()
-    #     jsonified[idx]['time_anchor']['unit'] = 'N/A'
-    #     idx += 1
-    # jsonified[0]['time_anchor']['value'] = dt.datetime.fromtimestamp(jsonified[0]['time_anchor']['value'], dt.timezone.utc).isoformat()
-    # # "time bins" are 1 larger than the # of histograms we get
-    # #times.append(times[-1] + dt.timedelta(seconds=1/32))
-
-
-
-
-    #Default value: start of UNIX epoch
-    utc_time = dt.datetime.fromtimestamp(0, dt.timezone.utc)
-    for i, json_dat in enumerate(jsonified):
-        frame_num = json_dat['buffer_number']['value']
-        step = time_deltas[i]
-        anchor = int(json_dat.pop('time_anchor')['value'])
-
-        if anchor != 0:
-            utc_time = dt.datetime.fromtimestamp(anchor, dt.timezone.utc)
-        json_dat['timestamp'] = {
-            'value': (utc_time + (frame_num % 32) * step).isoformat() + 'Z',
-            'unit': 'N/A'
-        }
-        type_ = data_type[i]
-        json_dat['datatype'] = {
-            'value': type_,
-            'unit': 'N/A'
-        }
-    
-
-    #jsonified.sort(key=lambda e: e['time_anchor']['value'])
-    collapsed = collapse_json(jsonified)
-    with open(args.output_fn, 'w') as f:
-        json.dump(collapsed, f)
+                set_anchors = time_anchor[time_anchor != 0]
+                if set_anchors.size:
+                    prior_anchor = int(set_anchors[-1])
+            watermark.mark(fn, st, len(hafx_data))
+
+        if args.format == 'columnar':
+            writer.attrs['sources'] = watermark.to_json()
+            writer.attrs['prior_anchor'] = prior_anchor
 
 
 def collapse_json(data: list[dict[str, object]]):
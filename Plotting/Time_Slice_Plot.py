@@ -8,31 +8,182 @@ Two plots are generated:
 The 2048-to-123 Bridgeport bin mapping is undone
 so the histogram ADC bins line up with the "normal"
 Bridgeport bins.
+
+With --follow, the folder is watched and both plots
+update live as new time slices get written.
+With --ring as well, frames come from a shared memory ring
+which `ingest --ring` fills instead.
 '''
 
 import argparse
+import datetime as dt
 import gzip
 import os
+import time
 
 import matplotlib.pyplot as plt
 import numpy as np
 
 import plotting
-import helpers, constants
+import helpers, constants, parallel_load, frame_times
+import follow
+import shared_ring
+import impress_exact_structs as ies
+
+
+class LiveSpectrogram:
+    '''
+    Counts from the last `window` seconds in 1/32 s slots,
+    kept in a ring buffer which new frames get added into,
+    plus the spectrum summed over everything seen.
+    '''
+    def __init__(self, window: float):
+        self.slot_ns = frame_times.to_ns(frame_times.SLICE_WIDTH)
+        self.num_slots = round(window * frame_times.NS_PER_SECOND / self.slot_ns)
+        self.counts = np.zeros((self.num_slots, ies.NUM_HG_BINS), dtype=np.float64)
+        self.spectrum = np.zeros(ies.NUM_HG_BINS, dtype=np.float64)
+        # Newest slot number (time / slot width) seen so far
+        self.head = None
+        # Last time anchor of each file, for frames before the next one
+        self.prior_anchor = {}
+
+    def add(self, fn: str, data: np.ndarray, slice_width: dt.timedelta | None=None):
+        ''' `fn` says how wide the slices are, unless `slice_width` does '''
+        times = frame_times.frame_times_ns(
+            data['time_anchor'], data['buffer_number'],
+            slice_width or helpers.get_proper_timedelta(fn), self.prior_anchor.get(fn, 0)
+        )
+        anchors = data['time_anchor'][data['time_anchor'] != 0]
+        if anchors.size:
+            self.prior_anchor[fn] = int(anchors[-1])
+
+        histograms = data['histogram']
+        self.spectrum += histograms.sum(axis=0)
+
+        slots = times // self.slot_ns
+        newest = int(slots.max())
+        if self.head is None:
+            self.head = newest
+        elif newest > self.head:
+            # Clear out the slots which the window moves onto
+            steps = min(newest - self.head, self.num_slots)
+            self.counts[(self.head + 1 + np.arange(steps)) % self.num_slots] = 0
+            self.head = newest
+
+        recent = slots > self.head - self.num_slots
+        np.add.at(self.counts, slots[recent] % self.num_slots, histograms[recent])
+
+    def image(self) -> np.ndarray:
+        ''' Counts oldest to newest, shaped (slots, bins) '''
+        return np.roll(self.counts, -((self.head + 1) % self.num_slots), axis=0)
+
+    def newest_time(self) -> np.datetime64:
+        return np.datetime64(self.head * self.slot_ns, 'ns')
+
+
+class RingSource:
+    ''' New frames from a shared memory ring, looking like `follow.Follower` '''
+    def __init__(self, name: str):
+        self.ring = shared_ring.FrameRing.attach(name)
+        self.seq = 0
+
+    def poll(self, timeout: float) -> list[tuple[str, np.ndarray]]:
+        self.ring.wait(self.seq, timeout)
+        new, self.seq, _ = self.ring.read_since(self.seq)
+        return [(self.ring.name, new)] if len(new) else []
+
+    def close(self):
+        self.ring.close()
+
+
+def follow_folder(args: argparse.Namespace):
+    slice_width = None
+    if args.ring:
+        fol = RingSource(args.ring)
+        # Only full resolution time slices go in the ring
+        slice_width = frame_times.SLICE_WIDTH
+    else:
+        fol = follow.Follower(
+            args.data_folder, ies.NOMINAL_HAFX_DTYPE,
+            prefix='hafx-time-slice', poll=args.poll
+        )
+    live = LiveSpectrogram(args.window)
+    adc_bins = helpers.reverse_bridgeport_mapping(constants.BRIDGEPORT_EDGES)
+
+    fig, (spec_ax, sum_ax) = plt.subplots(2, 1, layout='constrained')
+    time_edges = np.linspace(-args.window, 0, live.num_slots + 1)
+    pcm = spec_ax.pcolormesh(time_edges, adc_bins, live.image().T, cmap='plasma')
+    spec_ax.set(
+        xlabel='Seconds before newest data',
+        ylabel='Normal Bridgeport ADC bin',
+        title='Counts spectrogram'
+    )
+    newest_label = spec_ax.text(0.01, 0.95, '', transform=spec_ax.transAxes, va='top', color='white')
+    stairs = sum_ax.stairs(live.spectrum, adc_bins)
+    sum_ax.set(
+        xlabel='Bridgeport ADC bin',
+        ylabel='Counts',
+        title='IMPRESS spectrum'
+    )
+    # Only these get redrawn on every update
+    blit = plotting.BlitManager(fig.canvas, [pcm, stairs, newest_label])
+
+    plt.show(block=False)
+    last_update = 0
+    while plt.fignum_exists(fig.number):
+        for fn, new in fol.poll(timeout=0.05):
+            live.add(fn, new, slice_width)
+
+        if live.head is None or time.monotonic() - last_update < args.interval:
+            fig.canvas.flush_events()
+            continue
+        last_update = time.monotonic()
+
+        image = live.image()
+        pcm.set_array(image.T)
+        pcm.set_clim(0, max(image.max(), 1))
+        stairs.set_data(live.spectrum)
+        newest_label.set_text(f'{live.newest_time()} UTC')
+        if live.spectrum.max() > sum_ax.get_ylim()[1]:
+            # Axis limits are part of the background, so redraw it all
+            sum_ax.set_ylim(0, 1.5 * live.spectrum.max())
+            fig.canvas.draw()
+        blit.update()
+    fol.close()
+
 
 def main():
     p = argparse.ArgumentParser(
         description='Take in a folder of IMPRESS data and produce some nice plots')
     p.add_argument('data_folder', help='folder containing .bin.gz IMPRESS "Level0" files')
+    parallel_load.add_pool_arguments(p)
+    p.add_argument('--follow', action='store_true', help='keep watching the folder and update the plots live')
+    p.add_argument('--window', type=float, default=60, help='seconds of data in the live spectrogram')
+    p.add_argument('--interval', type=float, default=0.25, help='seconds between live plot updates')
+    p.add_argument('--ring', metavar='NAME', help='with --follow, read frames from this shared memory ring')
+    p.add_argument('--poll', action='store_true', help='poll the folder instead of using inotify')
 
     args = p.parse_args()
+    if args.ring and not args.follow:
+        p.error('--ring only works with --follow')
+    if args.follow:
+        follow_folder(args)
+        return
 
-    data = []
-    files = os.listdir(args.data_folder)
-    for fn in sorted(files):
-        if not (fn.startswith('hafx-time-slice')):
-            continue
-        data += helpers.read_hafx_sci(f'{args.data_folder}/{fn}', gzip.open)
+    files = [
+        f'{args.data_folder}/{fn}'
+        for fn in sorted(os.listdir(args.data_folder))
+        if fn.startswith('hafx-time-slice')
+    ]
+    # Memory-mapped, so only the concatenated copy takes up memory
+    per_file = list(parallel_load.load_hafx_sci(files, gzip.open, args.workers, args.chunksize))
+    data = np.concatenate(per_file)
+    slice_widths = frame_times.slice_widths_ns(
+        [helpers.get_proper_timedelta(fn) for fn in files],
+        [len(d) for d in per_file]
+    )
+    # Lets the decompressed files go
+    del per_file
     # counts_spectrogram = [
     #     hd.histogram for hd in data
     # ]
@@ -41,13 +192,12 @@ def main():
     #         print(counts_spectrogram[j][i])
     fig, ax = plt.subplots(layout='constrained')
     _, _, pcm = plotting.plot_raw_time_slice_spectrogram(
-        data, fig, ax
-        # If you used unusual ADC bin mapping you can pass it in here
+        data, fig, ax,
+        slice_width=slice_widths
+        # If you used unusual ADC bin mapping you can pass it in here (adc_bins=...)
     )
 
-    spectrum = np.array([
-        hd.histogram for hd in data
-    ]).sum(axis=0)
+    spectrum = data['histogram'].sum(axis=0)
     adc_bins = helpers.reverse_bridgeport_mapping(
         constants.BRIDGEPORT_EDGES
     )
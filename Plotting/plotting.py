@@ -1,35 +1,37 @@
-import datetime
 import numpy as np
 import matplotlib.pyplot as plt
 
 import impress_exact_structs as ies
 import helpers
+import frame_times
 from constants import BRIDGEPORT_EDGES
 
 
 def plot_raw_time_slice_spectrogram(
-        data: list[ies.NominalHafx],
+        data: np.ndarray | list[ies.NominalHafx],
         fig=None,
         ax=None,
-        adc_bins=BRIDGEPORT_EDGES
+        adc_bins=BRIDGEPORT_EDGES,
+        slice_width=frame_times.SLICE_WIDTH
     ):
-    counts_spectrogram = np.array([
-        hd.histogram for hd in data
-    ])
+    '''
+    `slice_width` is one timedelta, or per-frame widths in ns
+    from `frame_times.slice_widths_ns` if files were rebinned differently.
+    '''
+    if not isinstance(data, np.ndarray):
+        data = np.concatenate([
+            np.frombuffer(bytes(hd), dtype=ies.NOMINAL_HAFX_DTYPE)
+            for hd in data
+        ])
+    counts_spectrogram = data['histogram']
 
     # Construct the timestamps from the given data points
-    from_timestamp = lambda ts: datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
-    recent = from_timestamp(data[0].time_anchor)
-    times = [recent]
-    idx = 1
-    for hd in data[1:]:
-        if hd.time_anchor != 0:
-            recent = from_timestamp(hd.time_anchor)
-        times.append(recent + datetime.timedelta(seconds=((idx % 32) / 32)))
-        idx += 1
-
+    times = frame_times.frame_times(
+        data['time_anchor'], data['buffer_number'], slice_width
+    )
     # "time bins" are 1 larger than the # of histograms we get
-    times.append(times[-1] + datetime.timedelta(seconds=1/32))
+    last_width = np.atleast_1d(frame_times.to_ns(slice_width))[-1]
+    times = np.append(times, times[-1] + np.timedelta64(int(last_width), 'ns'))
 
     fig = fig or plt.gcf()
     ax = ax or plt.gca()
@@ -50,4 +52,38 @@ def plot_raw_time_slice_spectrogram(
         title='Counts spectrogram'
     )
 
-    return fig, ax, pcm 
\ No newline at end of file
+    return fig, ax, pcm 
+
+
+class BlitManager:
+    '''
+    Redraw a few artists over a cached background instead of
+    redrawing the whole figure (see matplotlib's blitting tutorial).
+    Anything other than `artists` which changes needs a full
+    `canvas.draw()`, which also refreshes the background.
+    '''
+    def __init__(self, canvas, artists):
+        self.canvas = canvas
+        self.artists = list(artists)
+        self.background = None
+        for a in self.artists:
+            a.set_animated(True)
+        canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, _event):
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for a in self.artists:
+            self.canvas.figure.draw_artist(a)
+
+    def update(self):
+        if self.background is None:
+            # Draws everything and grabs the background
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_artists()
+            self.canvas.blit(self.canvas.figure.bbox)
+        self.canvas.flush_events()
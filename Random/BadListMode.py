@@ -1,6 +1,5 @@
 import argparse
 import os
-import json
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -8,79 +7,33 @@ import matplotlib.ticker as ticker
 import datetime
 import plotting
 import helpers, constants
+import frame_times
+import json_columns
+import flare_detect
 
 def check_for_events(data):
-    # for timestamps
-    event_start = ''
-    event_end = ''
-    event_array = []
-    loop_start = 0
-    # get bkg_avg so we can confirm events are happening
-    bkg_avg = get_bkg_avg(data)
-    print(bkg_avg)
-    print()
-
-    # need to to not start an event immediately
-    event_polarity = False
-
-    for i in range(len(data['histogram']['value'])):
-
-        # current total counts of this frames histogram
-
-        current = sum(data['histogram']['value'][i])
-
-        
-        # event start
-        # checks if the counts in any bin are much higher than the average of the first ~3 seconds (totally cheating)
-        if ( current > (bkg_avg * 4) ) and event_start == '':
-            if event_polarity == False:
-                event_polarity = True
-            event_start = data['timestamp']['value'][i]
-            loop_start = i
-            event_array.append(event_start)
-
-        # Event end
-        # Event polarity required to it so it doesn't event end on every background frame
-        elif ( current < (bkg_avg * 4) ) and event_end == '':
-            if event_polarity == False:
-                continue
-            event_end = data['timestamp']['value'][i]
-            event_array.append(event_end)
-            print("EVENT START: " + f'{event_start}')
-            print("EVENT END: " + f'{event_end}')
-            total_cts = 0
-            for j in range(loop_start, i):
-                total_cts += sum(data['histogram']['value'][j])
-            print("TOTAL COUNTS: " + f'{total_cts}')
-            print()
-            event_end = ''
-            event_start = ''
-            event_polarity = False
+    '''
+    Find events with `flare_detect` and print them;
+    returns the timestamps [start, end, start, end, ...]
+    '''
+    histograms = data['histogram']['value']
+    timestamps = data['timestamp']['value']
+    events = flare_detect.detect(histograms)
 
-        # Last bin case (can't check next bin to end event if event is happening during the last frame)
-        elif i == (len(data['histogram']['value']) - 1):
-            if event_polarity == False:
-                continue
-            event_end = data['timestamp']['value'][i]
-            event_array.append(event_end)
-            print("EVENT START: " + f'{event_start}')
-            print("EVENT END: " + f'{event_end}')
-            total_cts = 0
-            for j in range(loop_start, i):
-                total_cts += sum(data['histogram']['value'][j])
-            print("TOTAL COUNTS: " + f'{total_cts}')
-            print()
+    event_array = []
+    for start, end, total_cts in zip(events['start'], events['end'], events['counts']):
+        # End at the first frame after the event, or the last frame there is
+        event_start = timestamps[start]
+        event_end = timestamps[min(end, len(timestamps) - 1)]
+        event_array += [event_start, event_end]
+        print("EVENT START: " + f'{event_start}')
+        print("EVENT END: " + f'{event_end}')
+        print("TOTAL COUNTS: " + f'{int(total_cts)}')
+        print()
     print("~~~TOTAL EVENTS~~~")
     print(int(len(event_array)/2))
     return event_array
 
-def get_bkg_avg(data):
-    total = 0
-    for i in range(100):
-        total += sum(data['histogram']['value'][i])
-    average = total / 100
-    return average
-
 
 def main():
     p = argparse.ArgumentParser(
@@ -88,8 +41,11 @@ def main():
     p.add_argument('json_file', help='json file containing IMPRESS data to be analyzed in a manner similar to list mode')
 
     args = p.parse_args()
-    with open(args.json_file, 'r') as f:
-        data = json.loads(f.read())
+    # Just the columns we need, not the whole file
+    data = json_columns.load(args.json_file, ['histogram', 'timestamp'])
+    if np.issubdtype(data['timestamp']['value'].dtype, np.datetime64):
+        # Columnar output; format like the JSON timestamps
+        data['timestamp']['value'] = np.array(frame_times.isoformat(data['timestamp']['value']))
     print(len(data['histogram']['value']))
     #print(len(data['timestamp']['value']))
 
@@ -102,9 +58,7 @@ def main():
             timestamps[i] = timestamps[i][11:end_index]
         else:
             timestamps[i] = timestamps[i][11:19]
-    sums = []
-    for i in range(len(data['histogram']['value']) - 1):
-        sums.append(sum(data['histogram']['value'][i]))
+    sums = data['histogram']['value'][:-1].sum(axis=1)
     event_array = check_for_events(data)
 
     ax.stairs(sums, timestamps)
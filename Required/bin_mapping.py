@@ -0,0 +1,114 @@
+'''
+Tables for undoing the 2048-ADC -> 123-bin Bridgeport mapping.
+
+The edges we send the Bridgeport (e.g. `constants.BRIDGEPORT_EDGES`)
+say which histogram bin (5 through 127) each of 2048 ADC bins gets
+counted in. Bins 0-4 are housekeeping in the IMPRESS firmware, so
+histogram index = mapped bin - 5, and 127 doubles as overflow.
+Each of the 2048 ADC bins covers two "normal" Bridgeport bins (of 4096).
+
+Tables are built once per edge tuple and cached.
+'''
+import functools
+from typing import Sequence
+
+import numpy as np
+
+HOUSEKEEPING_OFFSET = 5
+OVERFLOW_BIN = 127
+NUM_HG_BINS = OVERFLOW_BIN - HOUSEKEEPING_OFFSET + 1
+NUM_ADC_BINS = 2048
+NUM_NORMAL_BINS = 4096
+NORMAL_PER_ADC = NUM_NORMAL_BINS // NUM_ADC_BINS
+
+
+def _readonly(a: np.ndarray) -> np.ndarray:
+    # Cached tables are shared, so nobody gets to modify them
+    a.flags.writeable = False
+    return a
+
+
+@functools.lru_cache
+def _forward_map(edges: tuple[int, ...]) -> np.ndarray:
+    mapped = np.asarray(edges, dtype=np.int64)
+    if mapped.size != NUM_ADC_BINS:
+        raise ValueError(f'Expected {NUM_ADC_BINS} ADC bin mappings, got {mapped.size}')
+    if mapped.min() < HOUSEKEEPING_OFFSET or mapped.max() > OVERFLOW_BIN:
+        raise ValueError(
+            f'ADC bins must map to histogram bins {HOUSEKEEPING_OFFSET} through {OVERFLOW_BIN}')
+    return _readonly(mapped - HOUSEKEEPING_OFFSET)
+
+
+def forward_map(edges: Sequence[int]) -> np.ndarray:
+    ''' Histogram index (0-122) that each of the 2048 ADC bins is counted in '''
+    return _forward_map(tuple(edges))
+
+
+@functools.lru_cache
+def _normal_edges(edges: tuple[int, ...]) -> np.ndarray:
+    fwd = _forward_map(edges)
+    if np.any(np.diff(fwd) < 0):
+        raise ValueError('ADC bin mapping must be non-decreasing to be reversed')
+
+    # First ADC bin counted in each histogram bin; histogram bins
+    # which nothing maps to get zero width at the next bin's left edge
+    left = np.searchsorted(fwd, np.arange(NUM_HG_BINS), side='left')
+    ret = np.append(left, NUM_ADC_BINS) * NORMAL_PER_ADC
+    return _readonly(ret.astype(np.float64))
+
+
+def normal_bin_edges(edges: Sequence[int]) -> np.ndarray:
+    '''
+    The 124 edges of the 123 histogram bins, in units of
+    normal (4096-bin) Bridgeport ADC bins.
+    '''
+    return _normal_edges(tuple(edges))
+
+
+@functools.lru_cache
+def _redistribution(edges: tuple[int, ...], target_edges: tuple[float, ...] | None):
+    # scipy is only needed for projecting, not for the edge tables
+    from scipy import sparse
+
+    src = _normal_edges(edges)
+    dst = (
+        np.arange(NUM_NORMAL_BINS + 1, dtype=np.float64)
+        if target_edges is None else np.asarray(target_edges, dtype=np.float64)
+    )
+
+    # Overlap of every histogram bin with every target bin,
+    # as a fraction of the histogram bin's width
+    lo = np.maximum(src[:-1, None], dst[None, :-1])
+    hi = np.minimum(src[1:, None], dst[None, 1:])
+    overlap = np.clip(hi - lo, 0, None)
+    widths = np.diff(src)[:, None]
+    fraction = np.divide(overlap, widths, out=np.zeros_like(overlap), where=widths > 0)
+    return sparse.csr_matrix(fraction)
+
+
+def redistribution_matrix(
+    edges: Sequence[int],
+    target_edges: Sequence[float] | None=None
+):
+    '''
+    Sparse (123, M) matrix which spreads each histogram bin's counts
+    evenly over the target bins it overlaps. Target edges are in normal
+    Bridgeport bins; by default, the 4096 normal bins themselves.
+    '''
+    return _redistribution(
+        tuple(edges),
+        None if target_edges is None else tuple(float(e) for e in target_edges)
+    )
+
+
+def project(
+    spectrogram: np.ndarray,
+    edges: Sequence[int],
+    target_edges: Sequence[float] | None=None
+) -> np.ndarray:
+    '''
+    Project (N, 123) histograms onto another energy axis
+    with one sparse matrix multiply. Returns (N, M) float counts.
+    '''
+    mat = redistribution_matrix(edges, target_edges)
+    return np.asarray((mat.T @ np.asarray(spectrogram, dtype=np.float64).T).T)
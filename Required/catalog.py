@@ -0,0 +1,267 @@
+'''
+Persistent SQLite catalog of level-zero files.
+
+Finding data used to mean listing a folder, filtering on
+file name prefixes, and then decoding every file to find out
+which times it covers. The catalog records, per file:
+product type, channel, time span, record count and rebinning
+format, plus a coarse time -> record number table, so
+
+    cat = Catalog('impress.sqlite')
+    cat.update('data/')
+    cat.select(start, end, 'hafx_sci', 'c1')
+
+plans a load in milliseconds: it returns just the files and
+record ranges which overlap [start, end).
+Only new or changed files get decoded on `update`.
+'''
+import argparse
+import datetime as dt
+import gzip
+import os
+import sqlite3
+from typing import Callable, Iterable
+
+import numpy as np
+
+import constants
+import gzip_index
+import helpers
+import impress_exact_structs as ies
+
+# One time -> record "mark" per this many seconds of data
+MARK_SECONDS = 60
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    identifier TEXT NOT NULL,
+    product TEXT,
+    channel TEXT,
+    data_format TEXT NOT NULL,
+    file_time REAL NOT NULL,
+    -- UNIX seconds; end is exclusive
+    start_time REAL,
+    end_time REAL,
+    num_records INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_by_time ON files (product, channel, start_time, end_time);
+CREATE TABLE IF NOT EXISTS marks (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    record INTEGER NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS marks_by_time ON marks (file_id, time);
+'''
+
+
+def product_of(identifier: str) -> str | None:
+    ''' Guess which reader a file needs from its identifier '''
+    if 'health' in identifier:
+        return 'det_health'
+    if 'x123' in identifier:
+        return 'x123_debug' if 'debug' in identifier else 'x123_sci'
+    if 'debug' in identifier:
+        return 'hafx_debug'
+    if 'hafx' in identifier or 'time-slice' in identifier:
+        return 'hafx_sci'
+    return None
+
+
+def channel_of(identifier: str) -> str | None:
+    for token in identifier.split('-'):
+        if token in ies.HAFX_CHANNELS:
+            return token
+    return None
+
+
+def _scan_times(fn: str, product: str, open_func: Callable) -> tuple[np.ndarray, str | None]:
+    '''
+    Per-record UNIX times (empty if the product has none)
+    and the channel, if the records say which one it is.
+    '''
+    if product == 'hafx_sci':
+        records = helpers.read_hafx_sci_array(fn, open_func)
+        chans = np.unique(records['ch'])
+        channel = (
+            ies.HAFX_CHANNELS[chans[0]]
+            if chans.size == 1 and chans[0] < len(ies.HAFX_CHANNELS) else None
+        )
+        return gzip_index.record_times(records, product).astype(np.float64), channel
+    if product == 'x123_sci':
+        records = helpers.read_x123_sci_array(fn, open_func)
+        return records['timestamp'].astype(np.float64), 'x123'
+    if product == 'det_health':
+        records = helpers.read_det_health_array(fn, open_func)
+        return records['timestamp'].astype(np.float64), None
+
+    readers = {'x123_debug': helpers.read_x123_debug, 'hafx_debug': helpers.read_hafx_debug}
+    return np.full(len(readers[product](fn, open_func)), np.nan), None
+
+
+def _marks(times: np.ndarray) -> list[tuple[int, float]]:
+    ''' (record, time) at the first record of every MARK_SECONDS window '''
+    valid = np.flatnonzero(times > 0)
+    if valid.size == 0:
+        return []
+    window = np.floor(times[valid] / MARK_SECONDS)
+    firsts = valid[np.concatenate(([True], window[1:] != window[:-1]))]
+    return [(int(r), float(times[r])) for r in firsts]
+
+
+class Catalog:
+    def __init__(self, db_path: str):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(
+        self,
+        folders: str | Iterable[str],
+        open_func: Callable=gzip.open,
+        suffix: str='.bin.gz'
+    ) -> int:
+        '''
+        Add or refresh every `suffix` file under `folders`,
+        and forget files which no longer exist there.
+        Returns the number of files (re)scanned.
+        '''
+        if isinstance(folders, str):
+            folders = [folders]
+
+        seen = set()
+        num_scanned = 0
+        for folder in folders:
+            for root, _, names in os.walk(folder):
+                for name in sorted(names):
+                    if not name.endswith(suffix):
+                        continue
+                    path = os.path.abspath(os.path.join(root, name))
+                    seen.add(path)
+                    num_scanned += self._update_file(path, open_func)
+
+            prefix = os.path.join(os.path.abspath(folder), '')
+            stale = [
+                (file_id,) for file_id, path in
+                self.db.execute(
+                    'SELECT id, path FROM files WHERE substr(path, 1, ?) = ?',
+                    (len(prefix), prefix))
+                if path not in seen
+            ]
+            with self.db:
+                self.db.executemany('DELETE FROM files WHERE id = ?', stale)
+        return num_scanned
+
+    def _update_file(self, path: str, open_func: Callable) -> bool:
+        st = os.stat(path)
+        row = self.db.execute(
+            'SELECT size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+        if row == (st.st_size, st.st_mtime_ns):
+            return False
+
+        try:
+            identifier, file_date, _ = helpers.parse_file_name(path)
+        except ValueError:
+            # Not named like a level-zero file
+            return False
+
+        product = product_of(identifier)
+        try:
+            times, channel = (np.empty(0), None) if product is None else _scan_times(path, product, open_func)
+        except EOFError:
+            # Still being written; leaving its row alone means the next update retries it
+            return False
+        channel = channel_of(identifier) or channel
+        valid = times[times > 0]
+        # Times are whole seconds, so the span runs to the end of the last one
+        start_time, end_time = (float(valid.min()), float(valid.max()) + 1) if valid.size else (None, None)
+
+        with self.db:
+            self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+            file_id = self.db.execute(
+                'INSERT INTO files (path, size, mtime_ns, identifier, product, channel, '
+                'data_format, file_time, start_time, end_time, num_records) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, st.st_size, st.st_mtime_ns, identifier, product, channel,
+                 helpers.get_data_format(path), file_date.timestamp(),
+                 start_time, end_time, int(times.size))
+            ).lastrowid
+            self.db.executemany(
+                'INSERT INTO marks (file_id, record, time) VALUES (?, ?, ?)',
+                [(file_id, r, t) for r, t in _marks(times)]
+            )
+        return True
+
+    def select(
+        self,
+        start: float | dt.datetime,
+        end: float | dt.datetime,
+        product: str | None=None,
+        channel: str | None=None
+    ) -> list[tuple[str, int, int]]:
+        '''
+        Files overlapping [start, end) as (path, first record, stop record),
+        in time order. Record ranges are conservative: they cover at least
+        the requested span, to within MARK_SECONDS at either end.
+        '''
+        if isinstance(start, dt.datetime):
+            start = start.timestamp()
+        if isinstance(end, dt.datetime):
+            end = end.timestamp()
+
+        query = 'SELECT id, path, num_records FROM files WHERE start_time < ? AND end_time > ?'
+        params = [end, start]
+        if product is not None:
+            query += ' AND product = ?'
+            params.append(product)
+        if channel is not None:
+            query += ' AND channel = ?'
+            params.append(channel)
+        query += ' ORDER BY start_time, path'
+
+        ret = []
+        for file_id, path, num_records in self.db.execute(query, params).fetchall():
+            first, = self.db.execute(
+                'SELECT MAX(record) FROM marks WHERE file_id = ? AND time <= ?',
+                (file_id, start)).fetchone()
+            stop, = self.db.execute(
+                'SELECT MIN(record) FROM marks WHERE file_id = ? AND time > ?',
+                (file_id, end)).fetchone()
+            ret.append((
+                path,
+                0 if first is None else first,
+                num_records if stop is None else stop
+            ))
+        return ret
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Catalog IMPRESS level-zero files and find the ones covering a time range')
+    p.add_argument('db', help='SQLite catalog file (created if needed)')
+    p.add_argument('folders', nargs='*', help='folders to (re)scan for .bin.gz files')
+    p.add_argument('--start', help=f'start of the time range, formatted as {constants.DATE_FMT} (UTC)')
+    p.add_argument('--end', help=f'end of the time range, formatted as {constants.DATE_FMT} (UTC)')
+    p.add_argument('--product', help='e.g. hafx_sci, x123_sci, det_health')
+    p.add_argument('--channel', help='e.g. c1, m1, m5, x1')
+    args = p.parse_args()
+
+    cat = Catalog(args.db)
+    if args.folders:
+        print(f'scanned {cat.update(args.folders)} new or changed files')
+
+    if args.start and args.end:
+        to_time = lambda s: dt.datetime.strptime(s, constants.DATE_FMT).replace(tzinfo=dt.timezone.utc)
+        for path, first, stop in cat.select(to_time(args.start), to_time(args.end), args.product, args.channel):
+            print(f'{path} [{first}, {stop})')
+    cat.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+'''
+Columnar binary level-one files, alongside the JSON ones.
+
+A container is a directory holding one `.npy` file per field
+plus a `manifest.json` with the units:
+
+    out.l1/
+        manifest.json
+        dead_time.npy
+        histogram.npy
+        ...
+
+Columns get appended a batch at a time (same input as
+`fast_json.ColumnWriter`), and reading one back is an
+`np.load(..., mmap_mode='r')`: no parsing, and only the
+pages actually touched get read.
+
+    data = columnar.ColumnarFile('out.l1')
+    data['dead_time']['value'].sum()
+
+Nested columns (e.g. health's c1 -> arm_temp) are stored
+flat, with the names joined by '.' ('c1.arm_temp').
+'''
+import json
+import os
+import struct
+from collections.abc import Mapping
+from typing import IO, Any, Iterator
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+# Room left at the start of every .npy for its header,
+# which can only be written once the final length is known
+_HEADER_BYTES = 128
+
+
+def is_columnar(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def _npy_header(dtype: np.dtype, shape: tuple[int, ...]) -> bytes:
+    magic = np.lib.format.magic(1, 0)
+    header_len = _HEADER_BYTES - len(magic) - 2
+    header = repr({
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': shape,
+    })
+    if len(header) >= header_len:
+        raise ValueError(f'.npy header too long for {dtype} {shape}')
+    # Padded with spaces and ended with a newline, like NumPy does
+    header = header.ljust(header_len - 1) + '\n'
+    return magic + struct.pack('<H', header_len) + header.encode('latin1')
+
+
+def _flatten(columns: dict[str, Any], prefix: str='') -> Iterator[tuple[str, str, Any]]:
+    ''' (name, unit, values) for every column, nested ones included '''
+    for k, col in columns.items():
+        name = prefix + k
+        if isinstance(col, dict) and 'value' not in col:
+            yield from _flatten(col, name + '.')
+        elif isinstance(col, dict):
+            yield name, col['unit'], col['value']
+        else:
+            # Bare values, e.g. health's timestamp
+            yield name, 'N/A', col
+
+
+class _Column:
+    def __init__(self, f: IO[bytes], unit: str, dtype: np.dtype, row_shape: tuple[int, ...], length: int):
+        self.f = f
+        self.unit = unit
+        self.dtype = dtype
+        self.row_shape = row_shape
+        self.length = length
+
+    @classmethod
+    def create(cls, path: str, unit: str, values: np.ndarray) -> '_Column':
+        f = open(path, 'wb')
+        f.write(bytes(_HEADER_BYTES))
+        return cls(f, unit, values.dtype, values.shape[1:], 0)
+
+    @classmethod
+    def reopen(cls, path: str, unit: str) -> '_Column':
+        ''' Pick up where a finished column left off '''
+        f = open(path, 'r+b')
+        np.lib.format.read_magic(f)
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        if f.tell() != _HEADER_BYTES:
+            f.close()
+            raise ValueError(f'{path} was not written by ColumnarWriter')
+        # Anything past the recorded length is from a run which never finished
+        f.seek(_HEADER_BYTES + dtype.itemsize * int(np.prod(shape)))
+        f.truncate()
+        return cls(f, unit, dtype, shape[1:], shape[0])
+
+    def append(self, values: np.ndarray):
+        if values.shape[1:] != self.row_shape:
+            raise ValueError(f'Expected rows shaped {self.row_shape}, got {values.shape[1:]}')
+        # e.g. a longer string than the first batch had
+        values = np.ascontiguousarray(values.astype(self.dtype, casting='safe', copy=False))
+        values.tofile(self.f)
+        self.length += len(values)
+
+    def finish(self):
+        self.f.seek(0)
+        self.f.write(_npy_header(self.dtype, (self.length,) + self.row_shape))
+        self.f.close()
+
+
+class ColumnarWriter:
+    '''
+    Write batches of columns
+        {field: {'unit': ..., 'value': array}}
+    into a columnar container directory.
+    The manifest goes in last, so a container
+    without one was never finished.
+
+    With `append`, batches go on the end of an existing
+    container (if there is one), and its attrs carry over.
+    The old manifest stays put until the new one replaces it,
+    so a run which dies part way leaves the container as it was.
+    '''
+    def __init__(self, path: str, attrs: dict[str, Any] | None=None, append: bool=False):
+        self.path = path
+        self.attrs = {}
+        self.columns = {}
+        os.makedirs(path, exist_ok=True)
+
+        if append and is_columnar(path):
+            with open(os.path.join(path, MANIFEST), 'r') as f:
+                manifest = json.load(f)
+            self.attrs = manifest['attrs']
+            for name, col in manifest['columns'].items():
+                self.columns[name] = _Column.reopen(os.path.join(path, col['file']), col['unit'])
+        elif is_columnar(path):
+            os.remove(os.path.join(path, MANIFEST))
+        self.attrs |= attrs or {}
+
+    def __enter__(self) -> 'ColumnarWriter':
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            for col in self.columns.values():
+                col.f.close()
+
+    def write(self, columns: dict[str, Any]):
+        ''' Append a batch; every batch must have the same fields '''
+        flat = list(_flatten(columns))
+        if not self.columns:
+            for name, unit, values in flat:
+                self.columns[name] = _Column.create(self.file_for(name), unit, np.asarray(values))
+        elif [name for name, _, _ in flat] != list(self.columns):
+            raise ValueError('Every batch needs the same fields')
+
+        for name, _, values in flat:
+            self.columns[name].append(np.asarray(values))
+
+    def row_shape(self, name: str) -> tuple[int, ...] | None:
+        ''' Shape of one row of a column, if it has been started '''
+        return self.columns[name].row_shape if name in self.columns else None
+
+    def file_for(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.npy')
+
+    def close(self):
+        for col in self.columns.values():
+            col.finish()
+
+        manifest = {
+            'version': FORMAT_VERSION,
+            'attrs': self.attrs,
+            'columns': {
+                name: {'unit': col.unit, 'file': os.path.basename(self.file_for(name))}
+                for name, col in self.columns.items()
+            },
+        }
+        tmp = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+
+class ColumnarFile(Mapping):
+    '''
+    Read-only view of a columnar container.
+    `data[field]` looks like the JSON layout,
+    {'unit': ..., 'value': array}, but the array is
+    memory-mapped the first time it's asked for.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest['version'] != FORMAT_VERSION:
+            raise ValueError(f'Unsupported columnar format version {self.manifest["version"]}')
+        self.attrs = self.manifest['attrs']
+        self._loaded = {}
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self._loaded:
+            fn = os.path.join(self.path, self.manifest['columns'][name]['file'])
+            self._loaded[name] = np.load(fn, mmap_mode='r')
+        return self._loaded[name]
+
+    def unit(self, name: str) -> str:
+        return self.manifest['columns'][name]['unit']
+
+    def __getitem__(self, name: str) -> dict[str, Any]:
+        if name not in self.manifest['columns']:
+            raise KeyError(name)
+        return {'unit': self.unit(name), 'value': self.column(name)}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.manifest['columns'])
+
+    def __len__(self) -> int:
+        return len(self.manifest['columns'])
@@ -34,6 +34,10 @@ FIRST_BRIDGEPORT_EDGES = tuple(
 )
 
 
+# All revisions, oldest first; each one needs its
+# <REV>_REVISION date and rebinning parameters above
+REVISIONS = ('FIRST',)
+
 # Set revision in use here
 REV = 'FIRST'
 # Variables get selected based on REV
@@ -0,0 +1,209 @@
+'''
+Flag flares (or anything else bright) in HaFX time slices.
+
+Works on the (frames, bins) histogram array of one detector
+channel, or on total counts per frame, all at once:
+
+    events = flare_detect.detect(data['histogram'])
+    events['start'], events['end'], events['counts']
+
+or a batch at a time on live data, where an event gets flagged
+as soon as the frame which makes it count comes in:
+
+    det = flare_detect.FlareDetector()
+    for batch in ...:
+        finished = det.update(batch['histogram'])
+        if det.active is not None:
+            ...
+
+How it decides:
+  - the background of each frame is the mean of the `window`
+    frames ending `gap` frames before it (so the rising edge of a
+    flare doesn't count as background), after dropping frames
+    which were above the start threshold (sigma clipping once);
+  - the noise is the std of those same frames, but at least
+    Poisson (sqrt of the background);
+  - an event is a run of frames above `off_sigma` which has
+    at least one frame above `on_sigma` (hysteresis), and lasts
+    at least `min_frames`.
+Everything is cumulative sums, so a batch costs O(frames + window).
+'''
+import numpy as np
+
+# Frame ranges are [start, end), as frame numbers from the first frame seen
+EVENT_FIELDS = ('start', 'end', 'counts', 'excess', 'peak')
+
+
+def _totals(histograms: np.ndarray) -> np.ndarray:
+    histograms = np.asarray(histograms)
+    if histograms.ndim == 2:
+        return histograms.sum(axis=1, dtype=np.float64)
+    return histograms.astype(np.float64)
+
+
+def _trailing_stats(
+    totals: np.ndarray,
+    use: np.ndarray,
+    window: int,
+    gap: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Mean, std and number of `use`d values among the `window`
+    frames ending `gap` frames before each frame.
+    '''
+    # Take out a typical value first, so squares don't lose precision
+    shift = np.median(totals) if totals.size else 0.
+    x = np.where(use, totals - shift, 0.)
+    n = np.concatenate(([0], np.cumsum(use)))
+    s1 = np.concatenate(([0.], np.cumsum(x)))
+    s2 = np.concatenate(([0.], np.cumsum(x * x)))
+
+    hi = np.clip(np.arange(len(totals)) - gap, 0, None)
+    lo = np.clip(hi - window, 0, None)
+    count = n[hi] - n[lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (s1[hi] - s1[lo]) / count
+        var = (s2[hi] - s2[lo]) / count - mean**2
+    return mean + shift, np.sqrt(np.clip(var, 0, None)), count
+
+
+def _runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    ''' [start, end) of every run of True '''
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _empty_events() -> dict[str, np.ndarray]:
+    return {k: np.zeros(0, dtype=np.int64 if k in ('start', 'end') else np.float64) for k in EVENT_FIELDS}
+
+
+class FlareDetector:
+    def __init__(
+        self,
+        window: int=320,
+        gap: int=32,
+        on_sigma: float=5,
+        off_sigma: float=2,
+        min_frames: int=4
+    ):
+        if off_sigma > on_sigma:
+            raise ValueError('off_sigma has to be at most on_sigma')
+        self.window = window
+        self.gap = gap
+        self.on_sigma = on_sigma
+        self.off_sigma = off_sigma
+        self.min_frames = min_frames
+
+        # Frame number of the next frame
+        self.offset = 0
+        # Last window + gap totals, and whether each one counts as background
+        self.history = np.zeros(0)
+        self.quiet = np.zeros(0, dtype=bool)
+        # Run above off_sigma still going at the end of the last batch
+        self._open = None
+
+    def thresholds(self, totals: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Background, start and end thresholds of `totals`
+        following the history (NaN where there isn't
+        enough background yet), and which frames count
+        as background from here on.
+        '''
+        n_hist = len(self.history)
+        ext = np.concatenate((self.history, totals))
+        # First pass: everything counts
+        use = np.ones(len(ext), dtype=bool)
+        bkg, std, _ = _trailing_stats(ext, use, self.window, self.gap)
+        noise = np.fmax(std, np.sqrt(np.clip(bkg, 0, None)))
+        # Second pass: drop the bright frames
+        use[:n_hist] = self.quiet
+        with np.errstate(invalid='ignore'):
+            use[n_hist:] = ~(ext[n_hist:] > bkg[n_hist:] + self.on_sigma * noise[n_hist:])
+        bkg, std, count = _trailing_stats(ext, use, self.window, self.gap)
+        noise = np.fmax(std, np.sqrt(np.clip(bkg, 0, None)))
+        # Not enough background to go on (e.g. right at the start)
+        bkg[count < max(self.window // 2, 1)] = np.nan
+
+        bkg, noise = bkg[n_hist:], noise[n_hist:]
+        return bkg, bkg + self.on_sigma * noise, bkg + self.off_sigma * noise, use[n_hist:]
+
+    def update(self, histograms: np.ndarray) -> dict[str, np.ndarray]:
+        ''' Add frames; returns events which finished within them '''
+        totals = _totals(histograms)
+        if totals.size == 0:
+            return _empty_events()
+        bkg, on, off, quiet = self.thresholds(totals)
+        with np.errstate(invalid='ignore'):
+            above_on = totals > on
+            above_off = totals > off
+
+        # A run still open from last time is a virtual frame in front of this batch
+        open_ = self._open or {'start': 0, 'counts': 0., 'excess': 0., 'peak': -np.inf, 'on': False}
+        mask = np.concatenate(([self._open is not None], above_off))
+        on_ext = np.concatenate(([open_['on']], above_on))
+        counts_ext = np.concatenate(([open_['counts']], totals))
+        excess_ext = np.concatenate(([open_['excess']], totals - np.nan_to_num(bkg)))
+        peak_ext = np.concatenate(([open_['peak']], totals))
+
+        starts, ends = _runs(mask)
+        ret = {}
+        if starts.size:
+            c_counts = np.concatenate(([0.], np.cumsum(counts_ext)))
+            c_excess = np.concatenate(([0.], np.cumsum(excess_ext)))
+            c_on = np.concatenate(([0], np.cumsum(on_ext)))
+            ret['start'] = np.where(starts == 0, open_['start'], self.offset + starts - 1)
+            ret['end'] = self.offset + ends - 1
+            ret['counts'] = c_counts[ends] - c_counts[starts]
+            ret['excess'] = c_excess[ends] - c_excess[starts]
+            # Max over each run: reduceat on [start, end) pairs, keeping every other one
+            bounds = np.stack((starts, ends), axis=1).ravel()
+            ret['peak'] = np.maximum.reduceat(np.append(peak_ext, -np.inf), bounds)[::2]
+            has_on = (c_on[ends] - c_on[starts]) > 0
+        else:
+            ret = _empty_events()
+            has_on = np.zeros(0, dtype=bool)
+
+        # A run reaching the end of the batch might keep going
+        self._open = None
+        if ends.size and ends[-1] == len(mask):
+            self._open = {k: ret[k][-1] for k in ('start', 'counts', 'excess', 'peak')} | {'on': bool(has_on[-1])}
+            ret = {k: v[:-1] for k, v in ret.items()}
+            has_on = has_on[:-1]
+
+        keep = has_on & (ret['end'] - ret['start'] >= self.min_frames)
+        ret = {k: ret[k][keep] for k in EVENT_FIELDS}
+
+        self.offset += len(totals)
+        keep_hist = self.window + self.gap
+        self.history = np.concatenate((self.history, totals))[-keep_hist:]
+        self.quiet = np.concatenate((self.quiet, quiet))[-keep_hist:]
+        return ret
+
+    @property
+    def active(self) -> dict[str, float] | None:
+        ''' The event going on right now (so far), if there is one '''
+        if self._open is None or not self._open['on']:
+            return None
+        if self.offset - self._open['start'] < self.min_frames:
+            return None
+        return {k: v for k, v in self._open.items() if k != 'on'} | {'end': self.offset}
+
+    def finish(self) -> dict[str, np.ndarray]:
+        ''' No more frames: an event still going ends at the last one '''
+        ev = self.active
+        self._open = None
+        if ev is None:
+            return _empty_events()
+        return {k: np.array([ev[k]], dtype=np.int64 if k in ('start', 'end') else np.float64) for k in EVENT_FIELDS}
+
+
+def detect(histograms: np.ndarray, **kwargs) -> dict[str, np.ndarray]:
+    '''
+    Every event in (frames, bins) histograms (or total counts per frame),
+    as arrays of frame [start, end), counts, background-subtracted
+    counts ('excess') and peak counts per frame.
+    '''
+    det = FlareDetector(**kwargs)
+    events = det.update(histograms)
+    last = det.finish()
+    return {k: np.concatenate((events[k], last[k])) for k in EVENT_FIELDS}
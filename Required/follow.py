@@ -0,0 +1,212 @@
+'''
+Follow a folder of level-zero files while they're being written.
+
+`Follower` watches a folder (inotify on Linux, polling anywhere
+else) and hands back just the records which were added since
+the last look, including ones from .bin.gz files which are
+still being written. Each file keeps its own zlib decompressor,
+so only newly appended compressed bytes ever get inflated.
+
+    fol = Follower('data/', ies.NOMINAL_HAFX_DTYPE, prefix='hafx-time-slice')
+    while True:
+        for fn, records in fol.poll(timeout=0.1):
+            ...
+'''
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+import zlib
+
+import numpy as np
+
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+# struct inotify_event, minus the trailing name
+_INOTIFY_EVENT = struct.Struct('iIII')
+# gzip header and trailer, like `gzip.open` expects
+_GZIP_WBITS = zlib.MAX_WBITS | 16
+
+
+class _Inotify:
+    ''' Names of files in one folder which changed, straight from the kernel '''
+    def __init__(self, folder: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # Raises AttributeError where there's no inotify (not Linux)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'cannot watch {folder}')
+
+    def wait(self, timeout: float) -> set[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+        while ready:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                _, _, _, length = _INOTIFY_EVENT.unpack_from(buf, pos)
+                pos += _INOTIFY_EVENT.size
+                names.add(os.fsdecode(buf[pos:pos + length].rstrip(b'\0')))
+                pos += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller:
+    ''' Same as `_Inotify`, by comparing sizes and mtimes '''
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.seen = {}
+
+    def _scan(self) -> set[str]:
+        changed = set()
+        for entry in os.scandir(self.folder):
+            st = entry.stat()
+            key = (st.st_size, st.st_mtime_ns)
+            if self.seen.get(entry.name) != key:
+                self.seen[entry.name] = key
+                changed.add(entry.name)
+        return changed
+
+    def wait(self, timeout: float) -> set[str]:
+        changed = self._scan()
+        if not changed:
+            time.sleep(timeout)
+        return changed
+
+    def close(self):
+        pass
+
+
+class GzipTail:
+    ''' Decompress a gzip file which is still growing, a piece at a time '''
+    def __init__(self, fn: str):
+        self.fn = fn
+        # Bumped every time the file gets read again from the start
+        self.generation = 0
+        self._inode = None
+        self._restart()
+
+    def _restart(self):
+        self.offset = 0
+        self.generation += 1
+        self._new_member()
+
+    def _new_member(self):
+        self._inflate = zlib.decompressobj(_GZIP_WBITS)
+        self._started = False
+
+    def read_new(self) -> bytes:
+        ''' Whatever can be decompressed from bytes added since the last call '''
+        with open(self.fn, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size < self.offset or st.st_ino != self._inode:
+                # Truncated, or replaced by a new file; start over
+                if self._inode is not None:
+                    self._restart()
+                self._inode = st.st_ino
+            f.seek(self.offset)
+            comp = f.read()
+        self.offset += len(comp)
+
+        out = []
+        while comp:
+            if not self._started:
+                # Zero padding between or after members
+                comp = comp.lstrip(b'\0')
+                self._started = bool(comp)
+                if not comp:
+                    break
+            out.append(self._inflate.decompress(comp))
+            comp = b''
+            if self._inflate.eof:
+                # On to the next member of a multi-member file
+                comp = self._inflate.unused_data
+                self._new_member()
+        return b''.join(out)
+
+
+class RecordTail:
+    ''' Whole new records of `dtype` appended to a growing gzip file '''
+    def __init__(self, fn: str, dtype: np.dtype):
+        self.gz = GzipTail(fn)
+        self.dtype = dtype
+        self._partial = b''
+
+    def read_new(self) -> np.ndarray:
+        generation = self.gz.generation
+        new = self.gz.read_new()
+        if self.gz.generation != generation:
+            # The file was replaced, so the leftover bytes are from the old one
+            self._partial = b''
+        buf = self._partial + new
+        num = len(buf) // self.dtype.itemsize
+        # Hang on to a record which is only partly there
+        self._partial = buf[num * self.dtype.itemsize:]
+        return np.frombuffer(buf, dtype=self.dtype, count=num)
+
+
+class Follower:
+    '''
+    New records from every `prefix*suffix` file in `folder`,
+    starting with everything already there.
+    '''
+    def __init__(
+        self,
+        folder: str,
+        dtype: np.dtype,
+        prefix: str='',
+        suffix: str='.bin.gz',
+        poll: bool=False
+    ):
+        self.folder = folder
+        self.dtype = dtype
+        self.prefix = prefix
+        self.suffix = suffix
+        self.tails = {}
+        self.watcher = None
+        if not poll:
+            try:
+                self.watcher = _Inotify(folder)
+            except (AttributeError, OSError):
+                pass
+        self.watcher = self.watcher or _Poller(folder)
+        self._pending = set(os.listdir(folder))
+
+    def poll(self, timeout: float) -> list[tuple[str, np.ndarray]]:
+        '''
+        Wait up to `timeout` seconds for changes;
+        return (file name, new records) in file name order.
+        '''
+        names = self.watcher.wait(0 if self._pending else timeout) | self._pending
+        self._pending = set()
+
+        ret = []
+        for name in sorted(names):
+            if not (name.startswith(self.prefix) and name.endswith(self.suffix)):
+                continue
+            fn = os.path.join(self.folder, name)
+            if not os.path.exists(fn):
+                continue
+            if name not in self.tails:
+                self.tails[name] = RecordTail(fn, self.dtype)
+            new = self.tails[name].read_new()
+            if len(new):
+                ret.append((fn, new))
+        return ret
+
+    def close(self):
+        self.watcher.close()
@@ -0,0 +1,127 @@
+'''
+Vectorized timestamps for HaFX time slices.
+
+Each frame carries a `buffer_number`, and only some frames carry
+a nonzero `time_anchor` (a whole UNIX second). A frame's time is
+the most recent anchor plus (buffer_number % 32) slice widths,
+where the slice width depends on the file (see
+`helpers.get_proper_timedelta`).
+
+All of this is done on whole arrays in integer nanoseconds,
+so times come out exact (1/32 s = 31.25 ms).
+'''
+import datetime as dt
+from typing import Iterable, Iterator, Sequence
+
+import numpy as np
+
+FRAMES_PER_ANCHOR = 32
+SLICE_WIDTH = dt.timedelta(seconds=1 / FRAMES_PER_ANCHOR)
+NS_PER_SECOND = 10**9
+
+
+def to_ns(width: dt.timedelta | np.ndarray) -> int | np.ndarray:
+    if isinstance(width, dt.timedelta):
+        # timedelta holds microseconds, so 31.25 ms needs a float step
+        return round(width.total_seconds() * NS_PER_SECOND)
+    return np.asarray(width, dtype=np.int64)
+
+
+def forward_fill_anchors(time_anchor: np.ndarray, prior_anchor: int=0) -> np.ndarray:
+    '''
+    Replace every zero anchor with the last nonzero one before it.
+    Frames before the first anchor get `prior_anchor`
+    (default: the UNIX epoch, same as the original decoder).
+    '''
+    anchors = np.concatenate(([prior_anchor], np.asarray(time_anchor, dtype=np.int64)))
+    last_set = np.where(anchors != 0, np.arange(anchors.size), 0)
+    np.maximum.accumulate(last_set, out=last_set)
+    return anchors[last_set][1:]
+
+
+def frame_times_ns(
+    time_anchor: np.ndarray,
+    buffer_number: np.ndarray,
+    slice_width: dt.timedelta | np.ndarray=SLICE_WIDTH,
+    prior_anchor: int=0
+) -> np.ndarray:
+    '''
+    Nanoseconds since the UNIX epoch for the "left" edge of every frame.
+    `slice_width` is either one timedelta or per-frame widths in ns
+    (see `slice_widths_ns`).
+    '''
+    anchors = forward_fill_anchors(time_anchor, prior_anchor)
+    frame_in_second = np.asarray(buffer_number, dtype=np.int64) % FRAMES_PER_ANCHOR
+    return anchors * NS_PER_SECOND + frame_in_second * to_ns(slice_width)
+
+
+def frame_info(
+    records: Iterable[np.ndarray],
+    slice_widths: Iterable[dt.timedelta]
+) -> Iterator[tuple[np.ndarray, np.ndarray, int]]:
+    '''
+    Each file's records with the start times (ns) and slice width (ns)
+    of its frames, given each file's slice width (see
+    `helpers.get_proper_timedelta`). Files have to come in time order:
+    frames before a file's first anchor use the last one before it.
+    '''
+    prior_anchor = 0
+    for data, slice_width in zip(records, slice_widths):
+        width = to_ns(slice_width)
+        yield data, frame_times_ns(data['time_anchor'], data['buffer_number'], width, prior_anchor), width
+        anchors = data['time_anchor'][data['time_anchor'] != 0]
+        if anchors.size:
+            prior_anchor = int(anchors[-1])
+
+
+def frame_times(
+    time_anchor: np.ndarray,
+    buffer_number: np.ndarray,
+    slice_width: dt.timedelta | np.ndarray=SLICE_WIDTH,
+    prior_anchor: int=0
+) -> np.ndarray:
+    ''' Same as `frame_times_ns` but as datetime64[ns] (UTC) '''
+    return frame_times_ns(
+        time_anchor, buffer_number, slice_width, prior_anchor
+    ).view('datetime64[ns]')
+
+
+def frame_times_epoch(
+    time_anchor: np.ndarray,
+    buffer_number: np.ndarray,
+    slice_width: dt.timedelta | np.ndarray=SLICE_WIDTH,
+    prior_anchor: int=0
+) -> np.ndarray:
+    ''' Same as `frame_times_ns` but as float UNIX seconds '''
+    return frame_times_ns(
+        time_anchor, buffer_number, slice_width, prior_anchor
+    ) / NS_PER_SECOND
+
+
+def slice_widths_ns(widths: Sequence[dt.timedelta], counts: Sequence[int]) -> np.ndarray:
+    '''
+    Per-frame slice widths for data concatenated from several files,
+    given each file's width and number of frames.
+    '''
+    return np.repeat(
+        np.array([to_ns(w) for w in widths], dtype=np.int64),
+        np.asarray(counts, dtype=np.int64)
+    )
+
+
+def isoformat(times: np.ndarray) -> list[str]:
+    '''
+    Format datetime64 times the way the decoder always has:
+    `datetime.isoformat()` of a UTC datetime with a 'Z' tacked on.
+    '''
+    strs = np.datetime_as_string(times, unit='us').tolist()
+    # isoformat() leaves off the fraction when it's zero
+    return [
+        (s[:-7] if s.endswith('.000000') else s) + '+00:00Z'
+        for s in strs
+    ]
+
+
+def parse_isoformat(strs: Sequence[str]) -> np.ndarray:
+    ''' Undo `isoformat`, back to datetime64[ns] '''
+    return np.array([s.removesuffix('Z').removesuffix('+00:00') for s in strs], dtype='datetime64[ns]')
@@ -0,0 +1,293 @@
+'''
+Random access into gzipped level-zero files.
+
+`gzip.open` can only seek by inflating everything before the
+target, so pulling five minutes out of an hour-long file means
+decompressing the whole hour. This builds a checkpoint index,
+stored next to the data file, which records where each gzip
+member starts along with the first record (and its time) in it.
+Reads then inflate only the members covering the requested range.
+
+Python's zlib can't report deflate block boundaries, so restart
+points are gzip member boundaries. A file written in one go is a
+single member (so one checkpoint and no speedup); use
+`make_seekable` to rewrite it as many small members. The result is
+still an ordinary gzip file which `gzip.open` reads as before.
+'''
+import argparse
+import bisect
+import gzip
+import json
+import os
+import zlib
+from typing import BinaryIO, Iterator
+
+import numpy as np
+
+import frame_times
+import helpers
+import impress_exact_structs as ies
+
+INDEX_SUFFIX = '.gzidx'
+INDEX_VERSION = 1
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+READ_CHUNK = 2**16
+# Uncompressed bytes per member for `make_seekable`
+DEFAULT_MEMBER_BYTES = 2**20
+PRODUCTS = ('hafx_sci', 'x123_sci')
+
+
+def iter_members(f: BinaryIO, start: int=0) -> Iterator[tuple[int, bytes]]:
+    '''
+    Yield (compressed offset, decompressed bytes) for each gzip member
+    in `f` from byte `start` on. A truncated last member yields
+    whatever could be inflated.
+    '''
+    f.seek(start)
+    pos = member_start = start
+    inflater = zlib.decompressobj(GZIP_WBITS)
+    out = []
+    while (chunk := f.read(READ_CHUNK)):
+        while chunk:
+            try:
+                out.append(inflater.decompress(chunk))
+            except zlib.error:
+                if any(out):
+                    raise
+                # Trailing padding after the last member
+                return
+            if not inflater.eof:
+                pos += len(chunk)
+                break
+            consumed = len(chunk) - len(inflater.unused_data)
+            yield member_start, b''.join(out)
+            pos += consumed
+            member_start = pos
+            chunk = inflater.unused_data
+            inflater = zlib.decompressobj(GZIP_WBITS)
+            out = []
+    if out:
+        yield member_start, b''.join(out)
+
+
+def record_offsets(buf: bytes, product: str) -> np.ndarray:
+    ''' Byte offset of every complete record in a decompressed buffer '''
+    if product == 'hafx_sci':
+        size = ies.NOMINAL_HAFX_DTYPE.itemsize
+        return np.arange(len(buf) // size, dtype=np.int64) * size
+
+    offsets = []
+    for offset, count, spectrum_size in helpers.index_x123_sci(buf):
+        stride = helpers.X123_SCI_HEADER_SIZE + 4 * spectrum_size
+        offsets.append(offset + stride * np.arange(count, dtype=np.int64))
+    return np.concatenate(offsets) if offsets else np.empty(0, dtype=np.int64)
+
+
+def decode_records(buf: bytes, product: str):
+    if product == 'hafx_sci':
+        dtype = ies.NOMINAL_HAFX_DTYPE
+        return np.frombuffer(buf, dtype=dtype, count=len(buf) // dtype.itemsize)
+    return helpers.decode_x123_sci_buffer(buf)
+
+
+def record_times(records, product: str, prior_time: int=0) -> np.ndarray:
+    '''
+    Whole-second UNIX time of each record.
+    HaFX frames only carry a time anchor every so often,
+    so the most recent one is carried forward
+    (`prior_time` covers frames before the first anchor).
+    '''
+    if product == 'x123_sci':
+        return records['timestamp'].astype(np.int64)
+
+    return frame_times.forward_fill_anchors(records['time_anchor'], prior_time)
+
+
+def _slice_records(records, product: str, start: int, stop: int):
+    if product == 'hafx_sci':
+        return records[start:stop]
+    return {k: v[start:stop] for k, v in records.items()}
+
+
+def index_path(fn: str) -> str:
+    return fn + INDEX_SUFFIX
+
+
+def build_index(fn: str, product: str) -> dict:
+    '''
+    Inflate `fn` once and write its checkpoint index next to it.
+    Each checkpoint is
+        [compressed offset, uncompressed offset,
+         first record starting in or after the member,
+         that record's uncompressed offset, that record's time]
+    '''
+    with open(fn, 'rb') as f:
+        members = list(iter_members(f))
+
+    uncompressed_starts = []
+    total = 0
+    for _, data in members:
+        uncompressed_starts.append(total)
+        total += len(data)
+    buf = b''.join(data for _, data in members)
+
+    offsets = record_offsets(buf, product)
+    times = record_times(decode_records(buf, product), product)
+    checkpoints = []
+    for (comp_offset, _), uncomp_offset in zip(members, uncompressed_starts):
+        first = int(np.searchsorted(offsets, uncomp_offset))
+        if first < offsets.size:
+            checkpoints.append([
+                comp_offset, uncomp_offset, first,
+                int(offsets[first]), int(times[first])
+            ])
+
+    st = os.stat(fn)
+    index = {
+        'version': INDEX_VERSION,
+        'product': product,
+        'source_size': st.st_size,
+        'source_mtime_ns': st.st_mtime_ns,
+        'num_records': int(offsets.size),
+        'checkpoints': checkpoints,
+    }
+    with open(index_path(fn), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def load_index(fn: str, product: str) -> dict:
+    ''' Read the index for `fn`, (re)building it if it's missing or stale '''
+    try:
+        with open(index_path(fn), 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return build_index(fn, product)
+
+    st = os.stat(fn)
+    up_to_date = (
+        index.get('version') == INDEX_VERSION
+        and index.get('product') == product
+        and index.get('source_size') == st.st_size
+        and index.get('source_mtime_ns') == st.st_mtime_ns
+    )
+    return index if up_to_date else build_index(fn, product)
+
+
+def _read_checkpoint_span(fn: str, checkpoints: list, first: int, last: int) -> bytes:
+    '''
+    Inflate members from checkpoint `first` through checkpoint `last`,
+    returning bytes starting at the first record of checkpoint `first`.
+    '''
+    comp_offset, uncomp_offset, _, record_offset, _ = checkpoints[first]
+    # Decoding has to run through to the start of the member after `last`
+    # so a record which straddles a member boundary is complete
+    stop_comp = checkpoints[last + 1][0] if last + 1 < len(checkpoints) else None
+
+    out = []
+    with open(fn, 'rb') as f:
+        for member_offset, data in iter_members(f, comp_offset):
+            if stop_comp is not None and member_offset > stop_comp:
+                break
+            out.append(data)
+    return b''.join(out)[record_offset - uncomp_offset:]
+
+
+def read_records(fn: str, product: str, start: int, stop: int | None=None):
+    '''
+    Decode records [start, stop) of `fn`, inflating only what's needed.
+    Returns the same thing as `helpers.read_hafx_sci_array` or
+    `helpers.read_x123_sci_array`.
+    '''
+    index = load_index(fn, product)
+    checkpoints = index['checkpoints']
+    stop = index['num_records'] if stop is None else min(stop, index['num_records'])
+    if not checkpoints or start >= stop:
+        return decode_records(b'', product)
+
+    first_records = [c[2] for c in checkpoints]
+    first = max(bisect.bisect_right(first_records, start) - 1, 0)
+    last = max(bisect.bisect_left(first_records, stop) - 1, first)
+
+    buf = _read_checkpoint_span(fn, checkpoints, first, last)
+    base = checkpoints[first][2]
+    return _slice_records(decode_records(buf, product), product, start - base, stop - base)
+
+
+def read_time_range(fn: str, product: str, start_time: float, end_time: float):
+    '''
+    Decode records whose (whole-second) time t is in [start_time, end_time).
+    Times are UNIX timestamps.
+    '''
+    index = load_index(fn, product)
+    checkpoints = index['checkpoints']
+    if not checkpoints:
+        return decode_records(b'', product)
+
+    times = [c[4] for c in checkpoints]
+    # Several checkpoints can share a second, and records from it
+    # can be in the member before the first of them too
+    first = max(bisect.bisect_left(times, start_time) - 1, 0)
+    last = max(bisect.bisect_left(times, end_time) - 1, first)
+
+    buf = _read_checkpoint_span(fn, checkpoints, first, last)
+    records = decode_records(buf, product)
+    t = record_times(records, product, prior_time=checkpoints[first][4])
+    keep = np.flatnonzero((t >= start_time) & (t < end_time))
+    if keep.size == 0:
+        return _slice_records(records, product, 0, 0)
+    return _slice_records(records, product, int(keep[0]), int(keep[-1]) + 1)
+
+
+def make_seekable(
+    fn: str,
+    out_fn: str,
+    product: str,
+    member_bytes: int=DEFAULT_MEMBER_BYTES
+) -> dict:
+    '''
+    Rewrite `fn` as a series of gzip members of about `member_bytes`
+    (uncompressed) each, split on record boundaries, and index it.
+    '''
+    with gzip.open(fn, 'rb') as f:
+        buf = f.read()
+    offsets = record_offsets(buf, product)
+
+    with open(out_fn, 'wb') as f:
+        start = 0
+        while start < len(buf):
+            target = start + member_bytes
+            # Split at the first record boundary past the target size
+            split = int(np.searchsorted(offsets, target))
+            end = int(offsets[split]) if split < offsets.size else len(buf)
+            f.write(gzip.compress(buf[start:end]))
+            start = end
+    return build_index(out_fn, product)
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Build random-access indices for gzipped level-zero files')
+    p.add_argument('product', choices=PRODUCTS, help='type of data in the files')
+    p.add_argument('files', nargs='+', help='.bin.gz files to index')
+    p.add_argument(
+        '--rewrite', action='store_true',
+        help='rewrite each file in place as many small gzip members first, so it is actually seekable')
+    p.add_argument(
+        '--member-bytes', type=int, default=DEFAULT_MEMBER_BYTES,
+        help='uncompressed bytes per gzip member when rewriting')
+    args = p.parse_args()
+
+    for fn in args.files:
+        if args.rewrite:
+            tmp = fn + '.tmp'
+            make_seekable(fn, tmp, args.product, args.member_bytes)
+            os.replace(tmp, fn)
+            # Index has to match the renamed file's mtime
+            os.remove(tmp + INDEX_SUFFIX)
+        index = build_index(fn, args.product)
+        print(f'{fn}: {index["num_records"]} records, {len(index["checkpoints"])} checkpoints')
+
+
+if __name__ == '__main__':
+    main()
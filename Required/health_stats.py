@@ -0,0 +1,297 @@
+'''
+Running statistics for detector health telemetry.
+
+`HealthStats` takes batches of `DetectorHealth` records
+(structured arrays, e.g. from `helpers.iter_det_health_array`)
+and keeps count/mean/M2/min/max for every channel and field,
+in the same units as the decoded JSON. Stats from separate
+batches, files or worker processes merge exactly
+(Chan et al.'s parallel variance update), so months of health
+data can be summarized in one pass without holding it all:
+
+    stats = HealthStats(window=3600)
+    for batch in helpers.iter_det_health_array(fns, gzip.open):
+        stats.update(batch)
+    stats.summary()            # same as decode_health's processed_data
+    stats.rollup('c1.arm_temp')  # hourly window starts and Moments
+
+Fields are named '<channel>.<field>' like in `columnar`.
+'''
+import argparse
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable
+
+import numpy as np
+
+import fast_json
+import helpers
+import impress_exact_structs as ies
+import parallel_load
+
+CHANNELS = ies.HAFX_CHANNELS + ('x123',)
+# What decode_health's processed_data summarizes
+SUMMARY_FIELDS = {
+    'c1': ('arm_temp', 'sipm_temp', 'sipm_operating_voltage'),
+    'm1': ('arm_temp', 'sipm_temp', 'sipm_operating_voltage'),
+    'm5': ('arm_temp', 'sipm_temp', 'sipm_operating_voltage'),
+    'x1': ('arm_temp', 'sipm_temp', 'sipm_operating_voltage'),
+    'x123': ('board_temp', 'det_high_voltage', 'det_temp'),
+}
+WINDOWS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class Moments:
+    '''
+    count/mean/M2/min/max of some values. Every attribute
+    is an array of the same shape, so one Moments can hold
+    the stats of many windows at once.
+    '''
+    def __init__(self, count, mean, m2, min, max):
+        self.count = np.asarray(count, dtype=np.int64)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.m2 = np.asarray(m2, dtype=np.float64)
+        self.min = np.asarray(min, dtype=np.float64)
+        self.max = np.asarray(max, dtype=np.float64)
+
+    @classmethod
+    def empty(cls, shape: tuple[int, ...]=()) -> 'Moments':
+        return cls(
+            np.zeros(shape), np.zeros(shape), np.zeros(shape),
+            np.full(shape, np.inf), np.full(shape, -np.inf)
+        )
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> 'Moments':
+        if len(values) == 0:
+            return cls.empty()
+        mean = np.mean(values)
+        return cls(len(values), mean, np.sum((values - mean)**2), np.min(values), np.max(values))
+
+    @classmethod
+    def grouped(cls, values: np.ndarray, starts: np.ndarray) -> 'Moments':
+        ''' Moments of each run of values beginning at `starts` (sorted, first one 0) '''
+        count = np.diff(np.append(starts, len(values)))
+        mean = np.add.reduceat(values, starts, dtype=np.float64) / count
+        return cls(
+            count,
+            mean,
+            np.add.reduceat((values - np.repeat(mean, count))**2, starts),
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts)
+        )
+
+    def merge(self, other: 'Moments') -> 'Moments':
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        # Empty stats (count 0) just fall out
+        weight = np.divide(other.count, count, out=np.zeros(count.shape), where=count > 0)
+        return Moments(
+            count,
+            self.mean + delta * weight,
+            self.m2 + other.m2 + delta**2 * self.count * weight,
+            np.minimum(self.min, other.min),
+            np.maximum(self.max, other.max)
+        )
+
+    def scatter(self, index: np.ndarray, size: int) -> 'Moments':
+        ''' Spread these out to positions `index` of `size` (mostly empty) stats '''
+        ret = Moments.empty((size,))
+        for k in ('count', 'mean', 'm2', 'min', 'max'):
+            getattr(ret, k)[index] = getattr(self, k)
+        return ret
+
+    def state(self) -> dict[str, list]:
+        ''' Plain lists and numbers, e.g. to keep in a manifest '''
+        return {k: getattr(self, k).tolist() for k in ('count', 'mean', 'm2', 'min', 'max')}
+
+    @classmethod
+    def from_state(cls, state: dict[str, list]) -> 'Moments':
+        return cls(**state)
+
+    @property
+    def variance(self) -> np.ndarray:
+        return np.divide(self.m2, self.count, out=np.full(self.m2.shape, np.nan), where=self.count > 0)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+    def to_json(self) -> dict[str, object]:
+        return {
+            'count': self.count,
+            'avg': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'std': self.std,
+        }
+
+
+def _merge_windows(
+    a: tuple[np.ndarray, Moments],
+    b: tuple[np.ndarray, Moments]
+) -> tuple[np.ndarray, Moments]:
+    ''' Merge two (window indices, Moments) rollups '''
+    keys = np.union1d(a[0], b[0])
+    return keys, (
+        a[1].scatter(np.searchsorted(keys, a[0]), len(keys))
+        .merge(b[1].scatter(np.searchsorted(keys, b[0]), len(keys)))
+    )
+
+
+class HealthStats:
+    '''
+    Mergeable running stats of DetectorHealth records.
+    With a `window` (in seconds), stats also get rolled up
+    per window of UNIX time.
+    '''
+    def __init__(self, window: int | None=None):
+        self.window = window
+        self.start_time = None
+        self.totals = {}
+        self.windows = {}
+        # So summaries of integer fields come out as integers
+        self.dtypes = {}
+
+    def update(self, health: np.ndarray):
+        ''' Add a batch of DETECTOR_HEALTH_DTYPE records '''
+        if len(health) == 0:
+            return
+        columns = ies.DetectorHealth.batch_to_json(health)
+        first = int(health['timestamp'].min())
+        self.start_time = first if self.start_time is None else min(self.start_time, first)
+
+        if self.window is not None:
+            keys = health['timestamp'].astype(np.int64) // self.window
+            order = np.argsort(keys, kind='stable')
+            keys = keys[order]
+            starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+
+        for ch in CHANNELS:
+            for field, col in columns[ch].items():
+                name = f'{ch}.{field}'
+                values = col['value']
+                self.dtypes[name] = values.dtype
+                self.totals[name] = self.totals.get(name, Moments.empty()).merge(Moments.of(values))
+                if self.window is not None:
+                    batch = (keys[starts], Moments.grouped(values[order], starts))
+                    self.windows[name] = (
+                        _merge_windows(self.windows[name], batch)
+                        if name in self.windows else batch
+                    )
+
+    def merge(self, other: 'HealthStats') -> 'HealthStats':
+        ''' Fold in stats from somewhere else (e.g. another worker) '''
+        if other.window != self.window:
+            raise ValueError('Can only merge stats with the same window')
+        if other.start_time is not None:
+            self.start_time = (
+                other.start_time if self.start_time is None
+                else min(self.start_time, other.start_time)
+            )
+        self.dtypes |= other.dtypes
+        for name, m in other.totals.items():
+            self.totals[name] = self.totals[name].merge(m) if name in self.totals else m
+        for name, w in other.windows.items():
+            self.windows[name] = _merge_windows(self.windows[name], w) if name in self.windows else w
+        return self
+
+    def state(self) -> dict[str, object]:
+        ''' Everything needed to pick up where these stats left off, as plain JSON types '''
+        return {
+            'window': self.window,
+            'start_time': self.start_time,
+            'dtypes': {name: dtype.str for name, dtype in self.dtypes.items()},
+            'totals': {name: m.state() for name, m in self.totals.items()},
+            'windows': {
+                name: {'keys': keys.tolist(), 'moments': m.state()}
+                for name, (keys, m) in self.windows.items()
+            },
+        }
+
+    @classmethod
+    def from_state(cls, state: dict[str, object]) -> 'HealthStats':
+        ret = cls(state['window'])
+        ret.start_time = state['start_time']
+        ret.dtypes = {name: np.dtype(d) for name, d in state['dtypes'].items()}
+        ret.totals = {name: Moments.from_state(m) for name, m in state['totals'].items()}
+        ret.windows = {
+            name: (np.array(w['keys'], dtype=np.int64), Moments.from_state(w['moments']))
+            for name, w in state['windows'].items()
+        }
+        return ret
+
+    def rollup(self, name: str) -> tuple[np.ndarray, Moments]:
+        ''' Window start times (UNIX seconds) and the stats of each window '''
+        if self.window is None:
+            raise ValueError('No window was given to roll up by')
+        keys, moments = self.windows[name]
+        return keys * self.window, moments
+
+    def summary(self) -> dict[str, object]:
+        ''' avg/min/max of the fields decode_health has always summarized '''
+        ret = {'start_time': self.start_time}
+        for ch, fields in SUMMARY_FIELDS.items():
+            ret[ch] = {}
+            for f in fields:
+                m = self.totals[f'{ch}.{f}']
+                dtype = self.dtypes[f'{ch}.{f}']
+                ret[ch][f] = {
+                    'avg': float(m.mean),
+                    'min': m.min.astype(dtype)[()],
+                    'max': m.max.astype(dtype)[()],
+                }
+        return ret
+
+
+def _stats_for_file(fn: str, open_func: Callable, window: int | None) -> HealthStats:
+    stats = HealthStats(window)
+    for batch in helpers.iter_det_health_array([fn], open_func):
+        stats.update(batch)
+    return stats
+
+
+def summarize_files(
+    fns: Iterable[str],
+    open_func: Callable=gzip.open,
+    window: int | None=None,
+    workers: int | None=None,
+    chunksize: int=1
+) -> HealthStats:
+    ''' Stats of every file, worked out in parallel and merged '''
+    fns = list(fns)
+    stats = HealthStats(window)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for s in pool.map(
+            _stats_for_file, fns, [open_func] * len(fns), [window] * len(fns),
+            chunksize=chunksize
+        ):
+            stats.merge(s)
+    return stats
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Summarize health files, optionally rolled up per time window')
+    p.add_argument('health_files', nargs='+', help='health files to summarize')
+    p.add_argument('output_fn', help='output file name to write JSON')
+    p.add_argument(
+        '--window', choices=WINDOWS,
+        help='also give stats of every field per minute/hour/day')
+    parallel_load.add_pool_arguments(p)
+    args = p.parse_args()
+
+    window = WINDOWS.get(args.window)
+    stats = summarize_files(args.health_files, gzip.open, window, args.workers, args.chunksize)
+    out = {'summary': stats.summary()}
+    if window is not None:
+        out['rollups'] = {}
+        for name in stats.windows:
+            starts, moments = stats.rollup(name)
+            out['rollups'][name] = {'window_start': starts} | moments.to_json()
+    with open(args.output_fn, 'w') as f:
+        fast_json.dump(out, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
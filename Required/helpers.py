@@ -1,15 +1,50 @@
 import ctypes
+import datetime as dt
+import functools
+import os
 import struct
+import numpy as np
+import bin_mapping
+import constants
 import impress_exact_structs as ies
-from typing import Any, Callable, IO
+import l0_cache
+from typing import Any, Callable, IO, Iterable, Iterator, Sequence
 
+# Number of records per batch for the `iter_*` readers
+BATCH_SIZE = 4096
 
-def generic_read_binary(
+# Decompressed file cache; off unless enabled via
+# `enable_cache` or the IMPRESS_L0_CACHE environment variable
+_cache = l0_cache.from_environment()
+
+
+def enable_cache(
+    cache_dir: str | None=None,
+    max_bytes: int=l0_cache.DEFAULT_MAX_BYTES
+) -> l0_cache.DecompressedCache:
+    global _cache
+    _cache = l0_cache.DecompressedCache(cache_dir, max_bytes)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    _cache = None
+
+
+def _resolve_source(fn: str, open_func: Callable) -> tuple[str, Callable]:
+    # With the cache on, read the decompressed copy directly
+    if _cache is None:
+        return fn, open_func
+    return _cache.fetch(fn, open_func), open
+
+
+def generic_iter_binary(
     fn: str,
     open_func: Callable,
     function_body: Callable[[IO[bytes]], Any]
-) -> list[Any]: 
-    ret = []
+) -> Iterator[Any]:
+    fn, open_func = _resolve_source(fn, open_func)
     with open_func(fn, 'rb') as f:
         while True:
             try:
@@ -17,19 +52,129 @@ def generic_read_binary(
             except struct.error:
                 break
             if not new_data: break
-            ret.append(new_data)
-    return ret
+            yield new_data
 
 
-def read_binary(fn: str, type_: type, open_func: Callable) -> list:
+def generic_read_binary(
+    fn: str,
+    open_func: Callable,
+    function_body: Callable[[IO[bytes]], Any]
+) -> list[Any]:
+    return list(generic_iter_binary(fn, open_func, function_body))
+
+
+def generic_iter_batches(
+    fns: Iterable[str],
+    open_func: Callable,
+    function_body: Callable[[IO[bytes]], Any],
+    batch_size: int=BATCH_SIZE
+) -> Iterator[list[Any]]:
+    '''
+    Yield lists of `batch_size` records read from `fns` in order.
+    Batches span file boundaries; only the last one may be short.
+    '''
+    batch = []
+    for fn in fns:
+        for record in generic_iter_binary(fn, open_func, function_body):
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _struct_reader(type_: type) -> Callable[[IO[bytes]], Any]:
     sz = ctypes.sizeof(type_)
     def read_elt(f: IO[bytes]):
         d = type_()
         eof = (f.readinto(d) != sz)
         if eof: return None
         return d
+    return read_elt
+
+
+def read_binary(fn: str, type_: type, open_func: Callable) -> list:
+    return generic_read_binary(fn, open_func, _struct_reader(type_))
+
+
+def read_binary_array(fn: str, dtype: np.dtype, open_func: Callable) -> np.ndarray:
+    if _cache is not None:
+        return memmap_records(_cache.fetch(fn, open_func), dtype)
+
+    with open_func(fn, 'rb') as f:
+        buf = f.read()
+    # Trailing partial records get dropped, same as `read_binary`
+    return np.frombuffer(buf, dtype=dtype, count=len(buf) // dtype.itemsize)
+
+
+def memmap_records(path: str, dtype: np.dtype) -> np.ndarray:
+    num_records = os.path.getsize(path) // dtype.itemsize
+    # np.memmap refuses to map empty files
+    if num_records == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(num_records,))
+
+
+def iter_binary_array(
+    fns: Iterable[str],
+    dtype: np.dtype,
+    open_func: Callable,
+    batch_size: int=BATCH_SIZE
+) -> Iterator[np.ndarray]:
+    '''
+    Same as `generic_iter_batches` but yields structured arrays,
+    reading at most one batch worth of bytes at a time.
+    '''
+    pending = []
+    num_pending = 0
+    for fn in fns:
+        for chunk in _iter_array_chunks(fn, dtype, open_func, batch_size):
+            while chunk.size:
+                take = chunk[:batch_size - num_pending]
+                chunk = chunk[take.size:]
+                pending.append(take)
+                num_pending += take.size
+                if num_pending == batch_size:
+                    yield _join_chunks(pending)
+                    pending = []
+                    num_pending = 0
+    if pending:
+        yield _join_chunks(pending)
+
+
+def _iter_array_chunks(
+    fn: str,
+    dtype: np.dtype,
+    open_func: Callable,
+    max_records: int
+) -> Iterator[np.ndarray]:
+    if _cache is not None:
+        # Slices of the memmap; nothing gets read until it's used
+        arr = read_binary_array(fn, dtype, open_func)
+        for start in range(0, arr.size, max_records):
+            yield arr[start:start + max_records]
+        return
+
+    with open_func(fn, 'rb') as f:
+        while (buf := f.read(max_records * dtype.itemsize)):
+            yield np.frombuffer(buf, dtype=dtype, count=len(buf) // dtype.itemsize)
 
-    return generic_read_binary(fn, open_func, read_elt)
+
+def _join_chunks(chunks: list[np.ndarray]) -> np.ndarray:
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+def as_structs(arr: np.ndarray, type_: type) -> ctypes.Array:
+    '''
+    View a structured array as a ctypes array of `type_`
+    so per-record code (e.g. `to_json`) keeps working.
+    Only copies if the array is read-only.
+    '''
+    array_type = type_ * len(arr)
+    if arr.flags.writeable and arr.flags.c_contiguous:
+        return array_type.from_buffer(arr)
+    return array_type.from_buffer_copy(np.ascontiguousarray(arr))
 
 
 def read_det_health(fn: str, open_func: Callable) -> list[ies.DetectorHealth]:
@@ -40,34 +185,262 @@ def read_hafx_sci(fn: str, open_func: Callable) -> list[ies.NominalHafx]:
     return read_binary(fn, ies.NominalHafx, open_func)
 
 
+def read_det_health_array(fn: str, open_func: Callable) -> np.ndarray:
+    return read_binary_array(fn, ies.DETECTOR_HEALTH_DTYPE, open_func)
+
+
+def read_hafx_sci_array(fn: str, open_func: Callable) -> np.ndarray:
+    '''
+    Decompress a whole time slice file at once and view it
+    as `ies.NOMINAL_HAFX_DTYPE` records.
+    Columns are views, e.g. `arr['histogram']` has shape (N, 123).
+    '''
+    return read_binary_array(fn, ies.NOMINAL_HAFX_DTYPE, open_func)
+
+
+def _read_x123_sci_elt(f: IO[bytes]) -> ies.X123NominalSpectrumStatus:
+    timestamp, = struct.unpack('<L', f.read(4))
+    status_bytes = f.read(64)
+    spectrum_size, = struct.unpack('<H', f.read(2))
+    spectrum = list(struct.unpack('<' + ('L' * spectrum_size), f.read(4 * spectrum_size)))
+    return ies.X123NominalSpectrumStatus(
+        timestamp, spectrum, status_bytes
+    )
+
+
 def read_x123_sci(fn: str, open_func: Callable) -> list[ies.X123NominalSpectrumStatus]:
-    def read_elt(f: IO[bytes]):
-        timestamp, = struct.unpack('<L', f.read(4))
-        status_bytes = f.read(64)
-        spectrum_size, = struct.unpack('<H', f.read(2))
-        spectrum = list(struct.unpack('<' + ('L' * spectrum_size), f.read(4 * spectrum_size)))
-        return ies.X123NominalSpectrumStatus(
-            timestamp, spectrum, status_bytes
+    return generic_read_binary(fn, open_func, _read_x123_sci_elt)
+
+
+def _read_x123_debug_elt(f: IO[bytes]) -> ies.X123Debug:
+    debug_type, = struct.unpack('<B', f.read(1))
+    size, = struct.unpack('<L', f.read(4))
+    data = f.read(size)
+    return ies.X123Debug(
+        debug_type,
+        data
+    )
+
+
+def reverse_bridgeport_mapping(adc_bins: Sequence[int]) -> np.ndarray:
+    '''
+    Convert the ADC bin map we send to the Bridgeport into
+    the 124 edges of our 123 histogram bins, in "normal"
+    (4096-bin) Bridgeport ADC bins. See `bin_mapping`.
+    '''
+    return bin_mapping.normal_bin_edges(adc_bins)
+
+
+def get_data_format(fn: str) -> str:
+    '''
+    Depending on the file naming convention used by the rebinner,
+    we can either be dealing with:
+        - "raw" aka full-resolution data
+        - rebinned across time
+        - rebinned across energy
+        - rebinneda cross time and energy
+    '''
+    fn = os.path.basename(fn)
+    possibilities = ('time+energy', 'time', 'energy')
+    for p in possibilities:
+        if fn.startswith(p): return p
+
+    # No rebinning has happened; return something useful
+    return 'full_resolution'
+
+
+def get_proper_timedelta(file_name: str) -> dt.timedelta:
+    '''
+    Rebinned science data will have different time deltas between events.
+    This is because if we sum along the time axis, the counts in the
+    spectrogram can be considered to be bounded by wider time edges.
+
+    Make this a function so that we can update it if we change the rebinning scheme down the line.
+    '''
+    _, date, _ = parse_file_name(file_name)
+    slice_width = dt.timedelta(seconds=1 / 32)
+
+    # Check the rebinning prefix rather than the identifier:
+    # "hafx-time-slice" has "time" in it but is full resolution
+    if get_data_format(file_name) in ('time', 'time+energy'):
+        # Add more revisions as appropriate
+        if date >= constants.FIRST_REVISION.replace(tzinfo=dt.timezone.utc):
+            return constants.FIRST_NUM_TIMES_REBIN * slice_width
+
+    return slice_width
+
+
+def parse_file_name(fn: str) -> tuple[str, dt.datetime, int]:
+    '''
+    Level-zero file names look like IDENT_DATE_#.extension,
+    with DATE formatted as `constants.DATE_FMT` in UTC.
+    '''
+    identifier, date_str, rest = os.path.basename(fn).split('_')
+    date = dt.datetime.strptime(date_str, constants.DATE_FMT).replace(tzinfo=dt.timezone.utc)
+    return identifier, date, int(rest.split('.')[0])
+
+
+def time_order(fns: Iterable[str]) -> list[str]:
+    '''
+    Level-zero files sorted by the date and then the sequence
+    number in their names, which is the order frame times
+    need them in (wherever they are on disk).
+    '''
+    return sorted(fns, key=lambda fn: parse_file_name(fn)[1:] + (fn,))
+
+
+# timestamp (4B) + status (64B) + spectrum size (2B)
+X123_SCI_HEADER_SIZE = 70
+_X123_SIZE_OFFSET = 68
+# Max records checked per vectorized pass in `index_x123_sci`
+_X123_PROBE = 4096
+
+
+@functools.lru_cache
+def x123_sci_dtype(spectrum_size: int) -> np.dtype:
+    return np.dtype([
+        ('timestamp', '<u4'),
+        ('status', 'u1', (64,)),
+        ('spectrum_size', '<u2'),
+        ('histogram', '<u4', (spectrum_size,)),
+    ])
+
+
+def index_x123_sci(buf: bytes) -> list[tuple[int, int, int]]:
+    '''
+    First pass over a decompressed X123 science file.
+    Returns runs of back-to-back records which have the same
+    spectrum size, as (byte offset, number of records, spectrum size).
+    The spectrum size basically never changes, so this is
+    usually one run found with a few vectorized comparisons.
+    '''
+    runs = []
+    pos = 0
+    while pos + X123_SCI_HEADER_SIZE <= len(buf):
+        size, = struct.unpack_from('<H', buf, pos + _X123_SIZE_OFFSET)
+        stride = X123_SCI_HEADER_SIZE + 4 * size
+        num_fit = min((len(buf) - pos) // stride, _X123_PROBE)
+        if num_fit == 0:
+            # Truncated last record
+            break
+
+        # Every record's size field, assuming they are all `size` long
+        sizes = np.ndarray(
+            (num_fit,), dtype='<u2', buffer=buf,
+            offset=pos + _X123_SIZE_OFFSET, strides=(stride,)
         )
-    return generic_read_binary(fn, open_func, read_elt)
+        mismatch = np.flatnonzero(sizes != size)
+        count = num_fit if mismatch.size == 0 else int(mismatch[0])
+
+        if runs and runs[-1][2] == size:
+            offset, prev_count, _ = runs[-1]
+            runs[-1] = (offset, prev_count + count, size)
+        else:
+            runs.append((pos, count, size))
+        pos += count * stride
+    return runs
+
+
+def decode_x123_sci_buffer(buf: bytes) -> dict[str, np.ndarray]:
+    '''
+    Second pass: gather every record in `buf` into column arrays.
+        - timestamp: (N,)
+        - status: (N, 64) raw status bytes
+        - spectrum_size: (N,)
+        - histogram: (N, largest spectrum size), zero-padded
+    If every record has the same size the columns are views into `buf`.
+    '''
+    runs = index_x123_sci(buf)
+    views = [
+        np.ndarray((count,), dtype=x123_sci_dtype(size), buffer=buf, offset=offset)
+        for offset, count, size in runs
+    ]
+    if len(views) == 1:
+        return {k: views[0][k] for k in ('timestamp', 'status', 'spectrum_size', 'histogram')}
+
+    num_records = sum(count for _, count, _ in runs)
+    max_size = max((size for *_, size in runs), default=0)
+    ret = {
+        'timestamp': np.empty(num_records, dtype='<u4'),
+        'status': np.empty((num_records, 64), dtype=np.uint8),
+        'spectrum_size': np.empty(num_records, dtype='<u2'),
+        'histogram': np.zeros((num_records, max_size), dtype='<u4'),
+    }
+    row = 0
+    for view, (_, count, size) in zip(views, runs):
+        rows = slice(row, row + count)
+        ret['timestamp'][rows] = view['timestamp']
+        ret['status'][rows] = view['status']
+        ret['spectrum_size'][rows] = size
+        ret['histogram'][rows, :size] = view['histogram']
+        row += count
+    return ret
+
+
+def read_x123_sci_array(fn: str, open_func: Callable) -> dict[str, np.ndarray]:
+    fn, open_func = _resolve_source(fn, open_func)
+    with open_func(fn, 'rb') as f:
+        buf = f.read()
+    return decode_x123_sci_buffer(buf)
 
 
 def read_x123_debug(fn: str, open_func: Callable) -> list[ies.X123Debug]:
-    def read_elt(f: IO[bytes]):
-        debug_type, = struct.unpack('<B', f.read(1))
-        size, = struct.unpack('<L', f.read(4))
-        data = f.read(size)
-        return ies.X123Debug(
-            debug_type,
-            data
-        )
-    return generic_read_binary(fn, open_func, read_elt)
+    return generic_read_binary(fn, open_func, _read_x123_debug_elt)
+
+
+def _read_hafx_debug_elt(f: IO[bytes]) -> ies.HafxDebug:
+    type_, = struct.unpack('<B', f.read(1))
+    sz = struct.calcsize(ies.HafxDebug.DECODE_MAP[type_])
+    bytes_ = f.read(sz)
+    return ies.HafxDebug(type_, bytes_)
 
 
 def read_hafx_debug(fn: str, open_func: Callable) -> list[ies.HafxDebug]:
-    def read_elt(f: IO[bytes]):
-        type_, = struct.unpack('<B', f.read(1))
-        sz = struct.calcsize(ies.HafxDebug.DECODE_MAP[type_])
-        bytes_ = f.read(sz)
-        return ies.HafxDebug(type_, bytes_)
-    return generic_read_binary(fn, open_func, read_elt)
\ No newline at end of file
+    return generic_read_binary(fn, open_func, _read_hafx_debug_elt)
+
+
+# Streaming variants of the readers above.
+# Each takes a sequence of files and yields batches of
+# at most `batch_size` records, so memory stays bounded
+# regardless of how much data is being decoded.
+
+def iter_det_health(
+    fns: Iterable[str], open_func: Callable, batch_size: int=BATCH_SIZE
+) -> Iterator[list[ies.DetectorHealth]]:
+    return generic_iter_batches(fns, open_func, _struct_reader(ies.DetectorHealth), batch_size)
+
+
+def iter_hafx_sci(
+    fns: Iterable[str], open_func: Callable, batch_size: int=BATCH_SIZE
+) -> Iterator[list[ies.NominalHafx]]:
+    return generic_iter_batches(fns, open_func, _struct_reader(ies.NominalHafx), batch_size)
+
+
+def iter_x123_sci(
+    fns: Iterable[str], open_func: Callable, batch_size: int=BATCH_SIZE
+) -> Iterator[list[ies.X123NominalSpectrumStatus]]:
+    return generic_iter_batches(fns, open_func, _read_x123_sci_elt, batch_size)
+
+
+def iter_x123_debug(
+    fns: Iterable[str], open_func: Callable, batch_size: int=BATCH_SIZE
+) -> Iterator[list[ies.X123Debug]]:
+    return generic_iter_batches(fns, open_func, _read_x123_debug_elt, batch_size)
+
+
+def iter_hafx_debug(
+    fns: Iterable[str], open_func: Callable, batch_size: int=BATCH_SIZE
+) -> Iterator[list[ies.HafxDebug]]:
+    return generic_iter_batches(fns, open_func, _read_hafx_debug_elt, batch_size)
+
+
+def iter_det_health_array(
+    fns: Iterable[str], open_func: Callable, batch_size: int=BATCH_SIZE
+) -> Iterator[np.ndarray]:
+    return iter_binary_array(fns, ies.DETECTOR_HEALTH_DTYPE, open_func, batch_size)
+
+
+def iter_hafx_sci_array(
+    fns: Iterable[str], open_func: Callable, batch_size: int=BATCH_SIZE
+) -> Iterator[np.ndarray]:
+    return iter_binary_array(fns, ies.NOMINAL_HAFX_DTYPE, open_func, batch_size)
@@ -2,7 +2,38 @@ import base64
 import ctypes
 import struct
 from datetime import datetime, timedelta
+from typing import Callable
 from astropy import units as u
+import numpy as np
+
+# Unit scale factors for the batch converters, worked out once
+# instead of building a Quantity for every value
+_NS_TO_US = u.ns.to(u.us)
+_25NS_TO_US = u.Unit(25 * u.ns).to(u.us)
+_DEG_C_TO_K = u.deg_C.to(u.K, 0, equivalencies=u.temperature())
+HAFX_CHANNELS = ('c1', 'm1', 'm5', 'x1')
+
+
+def _batch_columns(
+    arr: np.ndarray,
+    units: dict[str, str],
+    converters: dict[str, Callable],
+    default_unit: str | None=None
+) -> dict[str, dict[str, object]]:
+    '''
+    Columns of a structured array laid out like the per-record
+    `to_json` output after collapsing:
+        {field: {'unit': str, 'value': ndarray}}
+    '''
+    return {
+        k: {
+            # Unit first, same as `collapse_json`
+            'unit': units[k] if default_unit is None else units.get(k, default_unit),
+            'value': converters.get(k, lambda x: x)(arr[k])
+        }
+        for k in arr.dtype.names
+    }
+
 
 # Nominal HaFX data class from C++ implemented in Python
 # to make loading/decoding easier
@@ -22,11 +53,13 @@ class NominalHafx(ctypes.Structure):
         ('time_anchor', ctypes.c_uint32),
         ('missed_pps', ctypes.c_bool)
     ]
+    _units = {
+        'dead_time': 'microsecond',
+        'anode_current': 'nanoampere',
+    }
+
     def to_json(self):
-        units = {
-            'dead_time': 'microsecond',
-            'anode_current': 'nanoampere',
-        }
+        units = self._units
         converters = {
             'dead_time': lambda x: ((800 * x) << u.ns).to_value(u.microsecond),
             'anode_current': lambda x: ((25 * x) << u.nanoampere).to_value(u.nanoampere),
@@ -43,6 +76,16 @@ class NominalHafx(ctypes.Structure):
         }
         return ret
 
+    @classmethod
+    def batch_to_json(cls, arr: np.ndarray) -> dict[str, dict[str, object]]:
+        ''' `to_json` for a whole array of NOMINAL_HAFX_DTYPE records, as columns '''
+        converters = {
+            'dead_time': lambda x: (800 * x.astype(np.float64)) * _NS_TO_US,
+            'anode_current': lambda x: 25 * x.astype(np.float64),
+            'ch': lambda x: np.array(HAFX_CHANNELS)[x],
+        }
+        return _batch_columns(arr, cls._units, converters, default_unit='N/A')
+
 class HafxHealth(ctypes.Structure):
     # no struct padding
     _pack_ = 1
@@ -61,17 +104,18 @@ class HafxHealth(ctypes.Structure):
         # clock cycles = 25ns / tick for a 40MHz clockh
         ('real_time', ctypes.c_uint32),
     ]
+    _units = {
+        'arm_temp': 'Kelvin',
+        'sipm_temp': 'Kelvin',
+        'sipm_operating_voltage': 'volt',
+        'sipm_target_voltage': 'volt',
+        'counts': 'count',
+        'dead_time': 'microsecond',
+        'real_time': 'microsecond'
+    }
 
     def to_json(self):
-        units = {
-            'arm_temp': 'Kelvin',
-            'sipm_temp': 'Kelvin',
-            'sipm_operating_voltage': 'volt',
-            'sipm_target_voltage': 'volt',
-            'counts': 'count',
-            'dead_time': 'microsecond',
-            'real_time': 'microsecond'
-        }
+        units = self._units
         converters = {
             'arm_temp': lambda x: (0.01 * x << u.K).to_value(u.Kelvin),
             'sipm_temp': lambda x: (0.01 * x << u.K).to_value(u.Kelvin),
@@ -88,6 +132,19 @@ class HafxHealth(ctypes.Structure):
             for k, _ in self._fields_
         }
 
+    @classmethod
+    def batch_to_json(cls, arr: np.ndarray) -> dict[str, dict[str, object]]:
+        ''' `to_json` for a whole array of HafxHealth records, as columns '''
+        converters = {
+            'arm_temp': lambda x: 0.01 * x,
+            'sipm_temp': lambda x: 0.01 * x,
+            'sipm_operating_voltage': lambda x: 0.01 * x,
+            'sipm_target_voltage': lambda x: 0.01 * x,
+            'dead_time': lambda x: x * _25NS_TO_US,
+            'real_time': lambda x: x * _25NS_TO_US,
+        }
+        return _batch_columns(arr, cls._units, converters)
+
 
 class X123Health(ctypes.Structure):
     _fields_ = [
@@ -106,17 +163,18 @@ class X123Health(ctypes.Structure):
     ]
     # no struct padding
     _pack_ = 1
+    _units = {
+        'board_temp': 'Kelvin',
+        'det_high_voltage': 'volt',
+        'det_temp': 'Kelvin',
+        'fast_counts': 'count',
+        'slow_counts': 'count',
+        'accumulation_time': 'millisecond',
+        'real_time': 'millisecond'
+    }
 
     def to_json(self):
-        units = {
-            'board_temp': 'Kelvin',
-            'det_high_voltage': 'volt',
-            'det_temp': 'Kelvin',
-            'fast_counts': 'count',
-            'slow_counts': 'count',
-            'accumulation_time': 'millisecond',
-            'real_time': 'millisecond'
-        }
+        units = self._units
         converters = {
             'board_temp': lambda x: (x << u.deg_C).to_value(u.Kelvin, equivalencies=u.temperature()),
             'det_high_voltage': lambda x: (0.5*x << u.volt).to_value(u.volt)
@@ -129,6 +187,15 @@ class X123Health(ctypes.Structure):
             for k, _ in self._fields_
         }
 
+    @classmethod
+    def batch_to_json(cls, arr: np.ndarray) -> dict[str, dict[str, object]]:
+        ''' `to_json` for a whole array of X123Health records, as columns '''
+        converters = {
+            'board_temp': lambda x: x + _DEG_C_TO_K,
+            'det_high_voltage': lambda x: 0.5 * x,
+        }
+        return _batch_columns(arr, cls._units, converters)
+
 
 # In case we want to load health data into Python,
 # which we almost certainly do want to,
@@ -149,13 +216,25 @@ class DetectorHealth(ctypes.Structure):
             k: getattr(self, k).to_json() for (k, _) in self._fields_[1:]
         }
 
+    @classmethod
+    def batch_to_json(cls, arr: np.ndarray) -> dict[str, object]:
+        ''' `to_json` for a whole array of DETECTOR_HEALTH_DTYPE records, as columns '''
+        return {'timestamp': arr['timestamp']} | {
+            k: type_.batch_to_json(arr[k]) for (k, type_) in cls._fields_[1:]
+        }
+
 
 class X123NominalSpectrumStatus:
     def __init__(self, timestamp_seconds: int, count_histogram: list[int], status: bytes):
         self.timestamp = timestamp_seconds
         self.histogram = count_histogram
-        # Encode to base64 for easy storage
-        self.status_b64 = base64.b64encode(status).decode('utf-8')
+        self.status = status
+
+    @property
+    def status_b64(self):
+        # Encode to base64 for easy storage,
+        # only once it actually gets stored
+        return base64.b64encode(self.status).decode('utf-8')
 
     def to_json(self):
         return {
@@ -255,4 +334,49 @@ class HafxDebug:
             'type': HafxDebug.TYPE_MAP[self.type],
             'registers': list(struct.unpack(
                 HafxDebug.DECODE_MAP[self.type], self.bytes))
-        }
\ No newline at end of file
+        }
+
+
+# ctypes scalar -> little-endian NumPy equivalent
+_CTYPES_TO_NUMPY = {
+    ctypes.c_bool: '?',
+    ctypes.c_int8: '<i1',
+    ctypes.c_uint8: '<u1',
+    ctypes.c_int16: '<i2',
+    ctypes.c_uint16: '<u2',
+    ctypes.c_int32: '<i4',
+    ctypes.c_uint32: '<u4',
+    ctypes.c_float: '<f4',
+}
+
+
+def _ctype_format(ctype: type):
+    if issubclass(ctype, ctypes.Structure):
+        return struct_dtype(ctype)
+    if issubclass(ctype, ctypes.Array):
+        return np.dtype((_ctype_format(ctype._type_), (ctype._length_,)))
+    return np.dtype(_CTYPES_TO_NUMPY[ctype])
+
+
+def struct_dtype(type_: type) -> np.dtype:
+    '''
+    Build a NumPy structured dtype with the exact same (packed) layout
+    as a ctypes.Structure, so whole files of level-zero data can be
+    viewed as arrays instead of decoded one struct at a time.
+    '''
+    names, formats, offsets = [], [], []
+    for name, ctype in type_._fields_:
+        names.append(name)
+        formats.append(_ctype_format(ctype))
+        offsets.append(getattr(type_, name).offset)
+
+    return np.dtype({
+        'names': names,
+        'formats': formats,
+        'offsets': offsets,
+        'itemsize': ctypes.sizeof(type_),
+    })
+
+
+NOMINAL_HAFX_DTYPE = struct_dtype(NominalHafx)
+DETECTOR_HEALTH_DTYPE = struct_dtype(DetectorHealth)
@@ -0,0 +1,68 @@
+'''
+Decode only what's new since the last run.
+
+A `Watermark` remembers which level-zero files have been
+decoded into a columnar container, and how far:
+    {absolute path: {'size', 'mtime_ns', 'records'}}
+It lives in the container's manifest (attrs['sources']).
+On the next run, files which haven't changed get skipped, and
+files which grew only have their new records decoded, so
+re-running the decoders every few minutes costs as much as
+the data which came down since the last time.
+'''
+import os
+from typing import Any, Callable, Iterable, Iterator
+
+
+class Watermark:
+    def __init__(self, sources: dict[str, dict[str, int]] | None=None):
+        self.sources = dict(sources or {})
+
+    def pending(self, fns: Iterable[str]) -> list[tuple[str, os.stat_result, int]]:
+        '''
+        Files which are new or changed, as
+        (file name, stat taken now, number of records already decoded).
+        '''
+        ret = []
+        for fn in fns:
+            st = os.stat(fn)
+            seen = self.sources.get(os.path.abspath(fn))
+            if seen is None:
+                ret.append((fn, st, 0))
+            elif (st.st_size, st.st_mtime_ns) != (seen['size'], seen['mtime_ns']):
+                if st.st_size < seen['size']:
+                    raise ValueError(
+                        f'{fn} shrank since it was last decoded; decode again without --incremental')
+                ret.append((fn, st, seen['records']))
+        return ret
+
+    def mark(self, fn: str, st: os.stat_result, records: int):
+        '''
+        `records` of `fn` are decoded. Use the stat from before
+        reading, so a file which grows mid-read gets looked at again.
+        '''
+        self.sources[os.path.abspath(fn)] = {
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'records': records,
+        }
+
+    def to_json(self) -> dict[str, dict[str, int]]:
+        return self.sources
+
+
+def read_pending(
+    pending: Iterable[tuple[str, os.stat_result, int]],
+    read: Callable[[str], Any]
+) -> Iterator[tuple[str, os.stat_result, int, Any]]:
+    '''
+    `read` every pending file, as (file name, stat, records already decoded, data).
+    Files whose gzip stream isn't finished yet are left for next time.
+    '''
+    for fn, st, done in pending:
+        try:
+            data = read(fn)
+        except EOFError:
+            print(f'{fn} is still being written; leaving it for next time')
+            continue
+        yield fn, st, done, data
@@ -0,0 +1,459 @@
+'''
+Real-time ingest of IMPRESS records over a local socket.
+
+Senders (the downlink, or the simulators in Sim/) send frames:
+
+    product code (u8) | payload length (u32, little endian) | payload
+
+where the payload is whole records of one product, laid out
+exactly like in level-zero files. Frames come over TCP (a stream
+of them) or UDP (one or more per datagram).
+
+The service gathers payloads into batches, decodes each batch
+at once into arrays (like `helpers.read_*_array`), and fans it
+out to subscribers. Every subscriber has its own bounded queue.
+A subscriber with `drop=False` which falls behind makes the
+service stop reading from TCP senders until it catches up
+(backpressure); one with `drop=True` (e.g. a plot) loses its
+oldest batches instead. UDP can't be slowed down, so datagrams
+which arrive while the service is full get dropped and counted.
+With --ring, HaFX frames also go into a `shared_ring.FrameRing`
+so other processes can read them without decoding them again.
+
+    python ingest.py --tcp 9000 --out ingested/
+    python Simulate_HaFX_Slices.py x 1 60 --send localhost:9000
+'''
+import argparse
+import asyncio
+import collections
+import datetime as dt
+import gzip
+import inspect
+import itertools
+import os
+import signal
+import socket
+import struct
+import time
+from typing import Awaitable, Callable
+
+import numpy as np
+
+import constants
+import health_stats
+import helpers
+import impress_exact_structs as ies
+import shared_ring
+
+PRODUCT_CODES = {'hafx_sci': 1, 'det_health': 2, 'x123_sci': 3}
+PRODUCTS = {code: name for name, code in PRODUCT_CODES.items()}
+# File name identifiers, so `catalog` and the plot scripts recognize them
+FILE_IDENTIFIERS = {
+    'hafx_sci': 'hafx-time-slice-ingest',
+    'det_health': 'health-ingest',
+    'x123_sci': 'x123-sci-ingest',
+}
+_FRAME_HEADER = struct.Struct('<BI')
+# Same amount of data per batch as the file readers
+BATCH_BYTES = helpers.BATCH_SIZE * ies.NOMINAL_HAFX_DTYPE.itemsize
+MAX_DATAGRAM = 65507
+
+
+def encode_frame(product: str, payload: bytes) -> bytes:
+    return _FRAME_HEADER.pack(PRODUCT_CODES[product], len(payload)) + payload
+
+
+def _dtype(product: str) -> np.dtype:
+    return ies.NOMINAL_HAFX_DTYPE if product == 'hafx_sci' else ies.DETECTOR_HEALTH_DTYPE
+
+
+def check_payload(product: str, buf: bytes):
+    ''' Raise ValueError unless `buf` is whole records of `product`, without decoding them '''
+    if product == 'x123_sci':
+        # Only reads the spectrum size of each record
+        runs = helpers.index_x123_sci(buf)
+        whole = sum(count * (helpers.X123_SCI_HEADER_SIZE + 4 * size) for _, count, size in runs)
+    else:
+        whole = len(buf) - len(buf) % _dtype(product).itemsize
+    if whole != len(buf):
+        raise ValueError(f'{product} payload of {len(buf)} bytes is not whole records')
+
+
+def decode_payload(product: str, buf: bytes) -> np.ndarray | dict[str, np.ndarray]:
+    ''' Records of `product` from raw bytes, in the same form as the array readers '''
+    check_payload(product, buf)
+    if product == 'x123_sci':
+        return helpers.decode_x123_sci_buffer(buf)
+    return np.frombuffer(buf, dtype=_dtype(product))
+
+
+class Batch:
+    def __init__(self, product: str, raw: bytes):
+        self.product = product
+        self.raw = raw
+        self.records = decode_payload(product, raw)
+        self.received = time.time()
+
+    def __len__(self) -> int:
+        if isinstance(self.records, dict):
+            return len(self.records['timestamp'])
+        return len(self.records)
+
+
+class Subscription:
+    ''' One subscriber's queue and the task feeding it to the handler '''
+    def __init__(
+        self,
+        handler: Callable[[Batch], Awaitable[None] | None],
+        products: set[str] | None,
+        maxsize: int,
+        drop: bool
+    ):
+        self.handler = handler
+        self.products = products
+        self.drop = drop
+        self.dropped = 0
+        self.errors = 0
+        self.queue = asyncio.Queue(maxsize)
+        self.task = asyncio.create_task(self._run())
+
+    async def put(self, batch: Batch):
+        if self.products is not None and batch.product not in self.products:
+            return
+        if self.drop and self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+        # Waits here when the subscriber is behind
+        await self.queue.put(batch)
+
+    async def _run(self):
+        while True:
+            batch = await self.queue.get()
+            try:
+                ret = self.handler(batch)
+                if inspect.isawaitable(ret):
+                    await ret
+            except Exception as e:
+                # One bad batch shouldn't stop this subscriber for good
+                self.errors += 1
+                print(f'subscriber failed on a {batch.product} batch: {e!r}')
+            finally:
+                self.queue.task_done()
+
+
+class Hub:
+    ''' Fans batches out to every subscriber '''
+    def __init__(self):
+        self.subscriptions = []
+
+    def subscribe(
+        self,
+        handler: Callable[[Batch], Awaitable[None] | None],
+        products: set[str] | None=None,
+        maxsize: int=8,
+        drop: bool=False
+    ) -> Subscription:
+        sub = Subscription(handler, products, maxsize, drop)
+        self.subscriptions.append(sub)
+        return sub
+
+    async def publish(self, batch: Batch):
+        for sub in self.subscriptions:
+            await sub.put(batch)
+
+    async def join(self):
+        ''' Wait until every subscriber has handled everything it was sent '''
+        for sub in self.subscriptions:
+            await sub.queue.join()
+
+    def close(self):
+        for sub in self.subscriptions:
+            sub.task.cancel()
+
+
+class IngestServer:
+    '''
+    Collects frames from any number of senders into per-product
+    batches of about `batch_bytes`, published to `hub` when full
+    or after `flush_interval` seconds, whichever comes first.
+    '''
+    def __init__(self, hub: Hub, batch_bytes: int=BATCH_BYTES, flush_interval: float=0.5):
+        self.hub = hub
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.pending = collections.defaultdict(list)
+        self.pending_bytes = collections.defaultdict(int)
+        self.frames = 0
+        self.bad_frames = 0
+        self.dropped_datagrams = 0
+        self._lock = asyncio.Lock()
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        self._udp_consumer = None
+
+    async def ingest(self, code: int, payload: bytes):
+        if code not in PRODUCTS:
+            raise ValueError(f'Unknown product code {code}')
+        product = PRODUCTS[code]
+        self.frames += 1
+        # Checked one frame at a time, so a bad one can't spoil a whole batch
+        try:
+            check_payload(product, payload)
+        except ValueError as e:
+            self.bad_frames += 1
+            print(f'dropping bad frame: {e}')
+            return
+        self.pending[product].append(payload)
+        self.pending_bytes[product] += len(payload)
+        if self.pending_bytes[product] >= self.batch_bytes:
+            await self.flush(product)
+
+    async def flush(self, product: str | None=None):
+        async with self._lock:
+            for p in [product] if product else list(self.pending):
+                if not self.pending[p]:
+                    continue
+                raw = b''.join(self.pending[p])
+                self.pending[p].clear()
+                self.pending_bytes[p] = 0
+                await self.hub.publish(Batch(p, raw))
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Whatever was pending is gone, but keep flushing
+                print(f'flush failed: {e!r}')
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                code, length = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+                await self.ingest(code, await reader.readexactly(length))
+        except asyncio.IncompleteReadError:
+            # Sender hung up
+            pass
+        except ValueError as e:
+            print(f'dropping connection from {writer.get_extra_info("peername")}: {e}')
+        finally:
+            writer.close()
+
+    async def serve_tcp(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle_tcp, host, port)
+
+    async def serve_udp(self, host: str, port: int, backlog: int=1024) -> asyncio.DatagramTransport:
+        datagrams = asyncio.Queue(backlog)
+        server = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                try:
+                    datagrams.put_nowait(data)
+                except asyncio.QueueFull:
+                    server.dropped_datagrams += 1
+
+        async def consume():
+            while True:
+                data = await datagrams.get()
+                pos = 0
+                try:
+                    while pos < len(data):
+                        code, length = _FRAME_HEADER.unpack_from(data, pos)
+                        pos += _FRAME_HEADER.size
+                        await self.ingest(code, data[pos:pos + length])
+                        pos += length
+                except (struct.error, ValueError) as e:
+                    print(f'dropping bad datagram: {e}')
+
+        self._udp_consumer = asyncio.create_task(consume())
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            Protocol, local_addr=(host, port))
+        return transport
+
+    async def close(self):
+        self._flusher.cancel()
+        if self._udp_consumer is not None:
+            self._udp_consumer.cancel()
+        await self.flush()
+        await self.hub.join()
+
+
+class FileWriter:
+    '''
+    Subscriber which writes records back out as level-zero style
+    .bin.gz files, one file per product every `rotate_seconds`.
+    Files get flushed after every batch so `follow` can read them live.
+    '''
+    def __init__(self, folder: str, rotate_seconds: float=300):
+        self.folder = folder
+        self.rotate_seconds = rotate_seconds
+        self.files = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def _file_for(self, product: str):
+        now = time.time()
+        f, opened = self.files.get(product, (None, 0))
+        if f is None or now - opened >= self.rotate_seconds:
+            if f is not None:
+                f.close()
+            date = dt.datetime.fromtimestamp(now, dt.timezone.utc).strftime(constants.DATE_FMT)
+            # Rotating (or restarting) twice in one second mustn't overwrite a file
+            for num in itertools.count():
+                try:
+                    f = gzip.open(os.path.join(self.folder, f'{FILE_IDENTIFIERS[product]}_{date}_{num}.bin.gz'), 'xb')
+                    break
+                except FileExistsError:
+                    continue
+            self.files[product] = (f, now)
+        return f
+
+    def _write(self, batch: Batch):
+        f = self._file_for(batch.product)
+        f.write(batch.raw)
+        f.flush()
+
+    async def __call__(self, batch: Batch):
+        # Keep file I/O off the event loop
+        await asyncio.to_thread(self._write, batch)
+
+    def close(self):
+        for f, _ in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class LiveStats:
+    ''' Subscriber keeping running health stats and HaFX frame/count totals '''
+    def __init__(self):
+        self.health = health_stats.HealthStats()
+        self.frames = collections.Counter()
+        self.counts = collections.Counter()
+
+    def __call__(self, batch: Batch):
+        if batch.product == 'det_health':
+            self.health.update(batch.records)
+        elif batch.product == 'hafx_sci':
+            recs = batch.records
+            chans, num = np.unique(recs['ch'], return_counts=True)
+            for ch, n in zip(chans.tolist(), num.tolist()):
+                self.frames[ch] += n
+                self.counts[ch] += int(recs['histogram'][recs['ch'] == ch].sum())
+        else:
+            self.frames['x123'] += len(batch)
+
+    def report(self) -> str:
+        names = dict(enumerate(ies.HAFX_CHANNELS))
+        return ', '.join(
+            f'{names.get(ch, ch)}: {n} frames' + (f', {self.counts[ch]} counts' if ch in self.counts else '')
+            for ch, n in sorted(self.frames.items(), key=lambda kv: str(kv[0]))
+        )
+
+
+class PlotFeed:
+    '''
+    Subscriber which keeps the latest few batches for a plot
+    (or anything else running outside the event loop) to `drain`.
+    Subscribe it with drop=True so a slow plot never holds up ingest.
+    '''
+    def __init__(self, maxlen: int=64):
+        self.batches = collections.deque(maxlen=maxlen)
+
+    def __call__(self, batch: Batch):
+        self.batches.append(batch)
+
+    def drain(self) -> list[Batch]:
+        ret = []
+        while self.batches:
+            ret.append(self.batches.popleft())
+        return ret
+
+
+class IngestClient:
+    ''' Blocking sender for scripts like the simulators '''
+    def __init__(self, address: str, udp: bool=False):
+        host, port = address.rsplit(':', 1)
+        self.udp = udp
+        if udp:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((host, int(port)))
+        else:
+            self.sock = socket.create_connection((host, int(port)))
+
+    def send(self, product: str, payload: bytes):
+        frame = encode_frame(product, payload)
+        if self.udp and len(frame) > MAX_DATAGRAM:
+            raise ValueError(f'{len(frame)} byte frame is too big for one datagram')
+        self.sock.sendall(frame)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self) -> 'IngestClient':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+async def serve(args: argparse.Namespace):
+    hub = Hub()
+    stats = LiveStats()
+    hub.subscribe(stats)
+    writer = None
+    if args.out:
+        writer = FileWriter(args.out, args.rotate)
+        hub.subscribe(writer)
+    ring = None
+    if args.ring:
+        # Decoded once here, read by any number of other processes
+        ring = shared_ring.FrameRing.create(args.ring, args.ring_minutes)
+        hub.subscribe(lambda batch: ring.write(batch.records), products={'hafx_sci'})
+
+    server = IngestServer(hub, flush_interval=args.flush_interval)
+    if args.tcp:
+        await server.serve_tcp(args.host, args.tcp)
+    if args.udp:
+        await server.serve_udp(args.host, args.udp)
+    print(f'listening on {args.host} (tcp {args.tcp}, udp {args.udp})')
+    # Clean up (e.g. the shared memory ring) when told to stop, not just on ^C
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    try:
+        while True:
+            await asyncio.sleep(args.report_every)
+            print(f'{server.frames} frames, {server.bad_frames} bad, {server.dropped_datagrams} dropped datagrams; {stats.report()}')
+    finally:
+        await server.close()
+        hub.close()
+        if writer is not None:
+            writer.close()
+        if ring is not None:
+            ring.close()
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Receive IMPRESS records over TCP/UDP, decode them and write them to disk')
+    p.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    p.add_argument('--tcp', type=int, help='TCP port to listen on')
+    p.add_argument('--udp', type=int, help='UDP port to listen on')
+    p.add_argument('--out', help='folder to write .bin.gz files to')
+    p.add_argument('--ring', metavar='NAME', help='also keep recent HaFX frames in a shared memory ring')
+    p.add_argument('--ring-minutes', type=float, default=5, help='minutes of frames the ring holds')
+    p.add_argument('--rotate', type=float, default=300, help='seconds of data per output file')
+    p.add_argument('--flush-interval', type=float, default=0.5, help='most seconds a record waits to be batched')
+    p.add_argument('--report-every', type=float, default=10, help='seconds between status lines')
+    args = p.parse_args()
+    if not (args.tcp or args.udp):
+        p.error('give --tcp and/or --udp')
+
+    try:
+        asyncio.run(serve(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+'''
+Pull a few columns out of decoded JSON files without parsing the rest.
+
+Decoded files use the collapsed layout
+    {field: {"unit": ..., "value": [...]}}
+and most tools only want one or two fields, e.g.
+
+    data = json_columns.read_columns('hafx.json', ['dead_time'])
+    data['dead_time']['value'].sum()
+
+The file is scanned in chunks: fields which weren't asked for are
+skipped by matching brackets (no Python objects get built for them),
+and the ones which were get parsed straight into NumPy arrays.
+Time and memory go with the size of the requested columns.
+
+Nested fields are named with dots, the same as in `columnar`
+(e.g. 'raw_data.c1.arm_temp' in a health file).
+'''
+import json
+import re
+from typing import IO, Any, Iterable
+
+import numpy as np
+
+import columnar
+
+CHUNK_SIZE = 1 << 20
+
+_STRUCTURAL = re.compile(rb'[][{}"]')
+# Everything up to (not including) the closing quote of a string;
+# stops early on a backslash at the end of the buffer
+_STRING_BODY = re.compile(rb'(?:[^"\\]|\\.)*')
+_SCALAR = re.compile(rb'[^,\]}\s]+')
+_WHITESPACE = b' \t\r\n'
+
+
+class _Scanner:
+    ''' Walks JSON text a chunk at a time, skipping or capturing values '''
+    def __init__(self, f: IO[bytes], chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.pos = 0
+        # Pieces of the value being captured, if any
+        self._kept = None
+        self._keep_from = 0
+
+    def _more(self) -> bool:
+        ''' Read another chunk, dropping whatever has been scanned (unless captured) '''
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        if self._kept is not None:
+            self._kept.append(self.buf[self._keep_from:self.pos])
+            self._keep_from = 0
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _need_more(self):
+        if not self._more():
+            raise ValueError('Unexpected end of JSON')
+
+    def peek(self) -> bytes:
+        ''' Next non-whitespace character, without consuming it '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            self._need_more()
+
+    def expect(self, char: bytes):
+        got = self.peek()
+        if got != char:
+            raise ValueError(f'Expected {char!r} in JSON, got {got!r}')
+        self.pos += 1
+
+    def _skip_string(self):
+        # Starts just past the opening quote
+        while True:
+            end = _STRING_BODY.match(self.buf, self.pos).end()
+            if end < len(self.buf) and self.buf[end:end + 1] == b'"':
+                self.pos = end + 1
+                return
+            self.pos = end
+            self._need_more()
+
+    def _skip_container(self):
+        # Starts on the opening bracket
+        depth = 0
+        while True:
+            m = _STRUCTURAL.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                self._need_more()
+                continue
+            self.pos = m.end()
+            c = m.group()
+            if c == b'"':
+                self._skip_string()
+            elif c in b'[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _skip_scalar(self):
+        while True:
+            m = _SCALAR.match(self.buf, self.pos)
+            self.pos = m.end() if m else self.pos
+            # A number might carry on into the next chunk
+            if self.pos < len(self.buf) or not self._more():
+                return
+
+    def skip(self):
+        c = self.peek()
+        if c == b'"':
+            self.pos += 1
+            self._skip_string()
+        elif c in (b'[', b'{'):
+            self._skip_container()
+        else:
+            self._skip_scalar()
+
+    def capture(self) -> bytes:
+        ''' Raw text of the next value '''
+        self.peek()
+        self._kept = []
+        self._keep_from = self.pos
+        self.skip()
+        self._kept.append(self.buf[self._keep_from:self.pos])
+        ret = b''.join(self._kept)
+        self._kept = None
+        return ret
+
+    def items(self):
+        '''
+        Keys of the object starting here, one at a time;
+        the caller must skip or capture each value.
+        '''
+        self.expect(b'{')
+        if self.peek() == b'}':
+            self.pos += 1
+            return
+        while True:
+            key = json.loads(self.capture())
+            self.expect(b':')
+            yield key
+            if self.peek() == b',':
+                self.pos += 1
+                continue
+            self.expect(b'}')
+            return
+
+
+def _parse_numbers(text: bytes) -> np.ndarray:
+    is_float = any(c in text for c in (b'.', b'e', b'E', b'N', b'I'))
+    return np.fromstring(text, dtype=np.float64 if is_float else np.int64, sep=',')
+
+
+def parse_array(raw: bytes) -> np.ndarray:
+    '''
+    JSON array text -> NumPy array. Numbers (and lists of
+    equal-length lists of numbers) skip `json` entirely.
+    '''
+    inner = raw.strip()[1:-1].strip()
+    if not inner:
+        return np.empty(0)
+    if b'"' in inner or inner[:1] in (b't', b'f', b'n', b'{'):
+        return np.array(json.loads(raw))
+    if inner[:1] != b'[':
+        return _parse_numbers(inner)
+
+    rows = inner.count(b'[')
+    flat = _parse_numbers(inner.translate(None, b'[]'))
+    try:
+        return flat.reshape(rows, -1)
+    except ValueError:
+        # Ragged or more deeply nested
+        return np.array(json.loads(raw), dtype=object)
+
+
+def _read_column(scan: _Scanner) -> dict[str, Any]:
+    if scan.peek() == b'[':
+        # Bare list, e.g. health's timestamp
+        return {'unit': 'N/A', 'value': parse_array(scan.capture())}
+
+    col = {}
+    for k in scan.items():
+        raw = scan.capture()
+        col[k] = parse_array(raw) if k == 'value' else json.loads(raw)
+    return col
+
+
+def _walk(scan: _Scanner, wanted: set[str], prefix: str, found: dict[str, Any]):
+    for k in scan.items():
+        name = prefix + k
+        if name in wanted:
+            found[name] = _read_column(scan)
+        elif scan.peek() == b'{' and any(w.startswith(name + '.') for w in wanted):
+            _walk(scan, wanted, name + '.', found)
+        else:
+            scan.skip()
+
+
+def read_columns(
+    fn: str,
+    keys: Iterable[str],
+    chunk_size: int=CHUNK_SIZE
+) -> dict[str, dict[str, Any]]:
+    ''' {key: {'unit': ..., 'value': ndarray}} for just the given keys '''
+    wanted = set(keys)
+    found = {}
+    with open(fn, 'rb') as f:
+        _walk(_Scanner(f, chunk_size), wanted, '', found)
+
+    missing = wanted - found.keys()
+    if missing:
+        raise KeyError(f'{fn} has no {", ".join(sorted(missing))}')
+    return found
+
+
+def load(path: str, keys: Iterable[str]) -> dict[str, dict[str, Any]]:
+    ''' `read_columns`, but for either a JSON file or a columnar directory '''
+    if columnar.is_columnar(path):
+        data = columnar.ColumnarFile(path)
+        return {k: data[k] for k in keys}
+    return read_columns(path, keys)
@@ -0,0 +1,135 @@
+'''
+Opt-in on-disk cache of decompressed level-zero files.
+
+Gunzipping the same .bin.gz files on every plotting/decoding run
+adds up, so the decompressed bytes get stored once as a raw file
+which can be `np.memmap`ed (or just `open`ed) on later runs.
+
+Entries are keyed on the source path, size, and mtime,
+so a file which gets rewritten or grows gets a new entry.
+Each cache directory is capped in size; the least recently
+used entries get evicted first.
+'''
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Callable, Container
+
+# 10 GiB
+DEFAULT_MAX_BYTES = 10 * 2**30
+# Used when caching "beside" the source files
+SIDECAR_DIR = '.l0cache'
+ENTRY_SUFFIX = '.raw'
+COPY_CHUNK = 2**20
+
+
+class DecompressedCache:
+    def __init__(self, cache_dir: str | None=None, max_bytes: int=DEFAULT_MAX_BYTES):
+        '''
+        If `cache_dir` is None, entries go in a hidden
+        directory next to each source file.
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def directory_for(self, fn: str) -> str:
+        if self.cache_dir is not None:
+            return self.cache_dir
+        return os.path.join(os.path.dirname(os.path.abspath(fn)), SIDECAR_DIR)
+
+    def entry_path(self, fn: str) -> str:
+        st = os.stat(fn)
+        key = f'{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}'
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(
+            self.directory_for(fn),
+            f'{os.path.basename(fn)}.{digest}{ENTRY_SUFFIX}'
+        )
+
+    def fetch(self, fn: str, open_func: Callable, evict: bool=True) -> str:
+        '''
+        Return the path to the decompressed copy of `fn`,
+        decompressing it with `open_func` if it isn't cached yet.
+        Pass `evict=False` when filling the cache from several processes
+        at once, then call `evict` when they are done.
+        '''
+        path = self.entry_path(fn)
+        if os.path.exists(path):
+            # Bump mtime so eviction order is least-recently-used
+            os.utime(path)
+            return path
+
+        cache_dir = os.path.dirname(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temp file first so nobody sees a partial entry
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out, open_func(fn, 'rb') as src:
+                shutil.copyfileobj(src, out, COPY_CHUNK)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        if self.cache_dir is None:
+            self._drop_stale(path)
+        if evict:
+            self.evict(cache_dir, keep=(path,))
+        return path
+
+    def _drop_stale(self, path: str):
+        # Older entries for the same source file (different size/mtime)
+        # can never be hit again. Only safe for sidecar directories,
+        # where a base name maps to exactly one source.
+        cache_dir, name = os.path.split(path)
+        source_name = name.rsplit('.', 2)[0]
+        for other in os.listdir(cache_dir):
+            if other == name or not other.endswith(ENTRY_SUFFIX):
+                continue
+            if other.rsplit('.', 2)[0] == source_name:
+                try:
+                    os.remove(os.path.join(cache_dir, other))
+                except FileNotFoundError:
+                    pass
+
+    def evict(self, cache_dir: str, keep: Container[str]=()):
+        ''' Drop least recently used entries, other than `keep`, until under the cap '''
+        entries = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            p = os.path.join(cache_dir, name)
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if p in keep:
+                continue
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def from_environment() -> DecompressedCache | None:
+    '''
+    The cache is off unless IMPRESS_L0_CACHE is set, to either
+    a directory or to "sidecar" to keep entries beside the sources.
+    IMPRESS_L0_CACHE_MAX_BYTES optionally sets the size cap.
+    '''
+    where = os.environ.get('IMPRESS_L0_CACHE')
+    if not where:
+        return None
+    max_bytes = int(os.environ.get('IMPRESS_L0_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+    return DecompressedCache(
+        None if where == 'sidecar' else where,
+        max_bytes
+    )
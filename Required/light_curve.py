@@ -0,0 +1,265 @@
+'''
+Energy-band light curves of HaFX science data, cached on disk.
+
+Bands are [low, high) in histogram bins (0-123), "normal"
+Bridgeport ADC bins (see `bin_mapping`), or keV given a linear
+calibration; each band boundary goes to the nearest histogram
+bin edge. Per channel, every frame's histogram gets summed into
+the bands, then frames into bins of `cadence` seconds, with one
+`np.add.reduceat` along each axis:
+
+    bands = light_curve.band_bins([(0, 10), (10, 40)], unit='bin')
+    curves = light_curve.cached(fns, bands, cadence=1)
+    curves['c1']['time'], curves['c1']['counts']   # (times, bands)
+
+Results are kept in a cache directory as `columnar` containers,
+keyed on the input files (path, size, mtime), the bands and the
+cadence, so asking again for the same light curves costs nothing.
+The cache is capped in size; the least recently used light curves
+get evicted first (like `l0_cache`).
+'''
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Callable, Container, Iterable, Sequence
+
+import numpy as np
+
+import columnar
+import constants
+import fast_json
+import frame_times as ft
+import helpers
+import impress_exact_structs as ies
+import parallel_load
+
+UNITS = ('bin', 'adc', 'kev')
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'impress-light-curves')
+# 1 GiB
+DEFAULT_MAX_BYTES = 2**30
+# Bump when cached products change
+CACHE_VERSION = 1
+
+
+def band_bins(
+    bands: Sequence[tuple[float, float]],
+    unit: str='bin',
+    kev_per_adc: float | None=None,
+    kev_offset: float=0.
+) -> np.ndarray:
+    '''
+    Histogram bin ranges [start, end), shaped (bands, 2),
+    of bands given in `unit`. keV assumes
+        energy = kev_per_adc * normal ADC bin + kev_offset
+    '''
+    if unit not in UNITS:
+        raise ValueError(f'Band units must be one of {UNITS}')
+    if unit == 'bin':
+        edges = np.arange(ies.NUM_HG_BINS + 1, dtype=np.float64)
+    else:
+        edges = helpers.reverse_bridgeport_mapping(constants.BRIDGEPORT_EDGES)
+    if unit == 'kev':
+        if kev_per_adc is None:
+            raise ValueError('keV bands need a calibration (kev_per_adc)')
+        edges = kev_per_adc * edges + kev_offset
+
+    bands = np.asarray(bands, dtype=np.float64).reshape(-1, 2)
+    if np.any(bands[:, 1] < bands[:, 0]):
+        raise ValueError('Bands go from low to high')
+    # Nearest edge; ties (zero-width bins) go to the first one
+    return np.abs(edges[None, None, :] - bands[:, :, None]).argmin(axis=2)
+
+
+def band_counts(histograms: np.ndarray, bins: np.ndarray) -> np.ndarray:
+    ''' (frames, bins) histograms summed into (frames, bands) '''
+    # reduceat over [start, end) pairs, keeping every other sum;
+    # the extra zero column makes `end` = last bin valid
+    padded = np.concatenate((histograms, np.zeros((len(histograms), 1), dtype=histograms.dtype)), axis=1)
+    sums = np.add.reduceat(padded, bins.ravel(), axis=1, dtype=np.int64)[:, ::2]
+    # reduceat gives the start bin for an empty range instead of 0
+    sums[:, bins[:, 0] == bins[:, 1]] = 0
+    return sums
+
+
+def bin_frames(times_ns: np.ndarray, counts: np.ndarray, cadence_ns: int) -> tuple[np.ndarray, np.ndarray]:
+    ''' Occupied time bins (as indices of `cadence_ns`) and the counts in each '''
+    order = np.argsort(times_ns, kind='stable')
+    keys = times_ns[order] // cadence_ns
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    return keys[starts], np.add.reduceat(counts[order], starts, axis=0)
+
+
+def _merge(a: tuple[np.ndarray, np.ndarray], b: tuple[np.ndarray, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    keys = np.union1d(a[0], b[0])
+    counts = np.zeros((len(keys), a[1].shape[1]), dtype=np.int64)
+    counts[np.searchsorted(keys, a[0])] += a[1]
+    counts[np.searchsorted(keys, b[0])] += b[1]
+    return keys, counts
+
+
+def make(
+    fns: Iterable[str],
+    bins: np.ndarray,
+    cadence: float,
+    open_func: Callable=gzip.open,
+    workers: int | None=None,
+    chunksize: int=1
+) -> dict[str, dict[str, np.ndarray]]:
+    '''
+    Light curves of every channel in the files, without the cache.
+    Files get put in time order (`helpers.time_order`) since frames
+    before a file's first anchor are timed from the file before.
+    '''
+    fns = helpers.time_order(fns)
+    cadence_ns = round(cadence * ft.NS_PER_SECOND)
+    hafx = parallel_load.load_hafx_sci(fns, open_func, workers, chunksize)
+
+    binned = {}
+    widths = [helpers.get_proper_timedelta(fn) for fn in fns]
+    for data, times, _ in ft.frame_info(hafx, widths):
+        for ch, name in enumerate(ies.HAFX_CHANNELS):
+            sel = data['ch'] == ch
+            if not sel.any():
+                continue
+            new = bin_frames(times[sel], band_counts(data['histogram'][sel], bins), cadence_ns)
+            binned[name] = _merge(binned[name], new) if name in binned else new
+
+    return {
+        name: {'time': (keys * cadence_ns).view('datetime64[ns]'), 'counts': counts}
+        for name, (keys, counts) in binned.items()
+    }
+
+
+def cache_key(fns: Iterable[str], bins: np.ndarray, cadence: float) -> str:
+    parts = [f'v{CACHE_VERSION}', repr(bins.tolist()), repr(float(cadence))]
+    for fn in sorted(fns):
+        st = os.stat(fn)
+        parts.append(f'{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}')
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:16]
+
+
+def _size(path: str) -> int:
+    return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+
+
+def evict(cache_dir: str, max_bytes: int=DEFAULT_MAX_BYTES, keep: Container[str]=()):
+    ''' Drop least recently used light curves, other than `keep`, until under `max_bytes` '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        p = os.path.join(cache_dir, name)
+        if not columnar.is_columnar(p):
+            continue
+        try:
+            entries.append((os.stat(p).st_mtime, _size(p), p))
+        except FileNotFoundError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        if p in keep:
+            continue
+        shutil.rmtree(p, ignore_errors=True)
+        total -= size
+
+
+def cached(
+    fns: Iterable[str],
+    bins: np.ndarray,
+    cadence: float,
+    cache_dir: str=DEFAULT_CACHE_DIR,
+    open_func: Callable=gzip.open,
+    workers: int | None=None,
+    chunksize: int=1,
+    max_bytes: int=DEFAULT_MAX_BYTES
+) -> dict[str, dict[str, np.ndarray]]:
+    ''' `make`, but reading from / saving to `cache_dir`, kept under `max_bytes` '''
+    fns = helpers.time_order(fns)
+    path = os.path.join(cache_dir, cache_key(fns, bins, cadence))
+    if columnar.is_columnar(path):
+        # Bump mtime so eviction order is least-recently-used
+        os.utime(path)
+        data = columnar.ColumnarFile(path)
+        return {
+            ch: {'time': data.column(f'{ch}.time'), 'counts': data.column(f'{ch}.counts')}
+            for ch in data.attrs['channels']
+        }
+
+    curves = make(fns, bins, cadence, open_func, workers, chunksize)
+    attrs = {
+        'product': 'hafx_light_curve',
+        'bins': bins.tolist(),
+        'cadence': cadence,
+        'channels': list(curves),
+        'sources': [os.path.abspath(fn) for fn in fns],
+    }
+    with columnar.ColumnarWriter(path, attrs) as writer:
+        writer.write({
+            ch: {
+                'time': {'unit': 'N/A', 'value': c['time']},
+                'counts': {'unit': 'count', 'value': c['counts']},
+            }
+            for ch, c in curves.items()
+        })
+    evict(cache_dir, max_bytes, keep=(path,))
+    return curves
+
+
+def _band(s: str) -> tuple[float, float]:
+    low, high = s.split(':')
+    return float(low), float(high)
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Energy-band light curves of HaFX science files, cached between runs')
+    p.add_argument('files', nargs='+', help='HaFX science .bin.gz files')
+    p.add_argument('output_fn', help='output file name to write JSON')
+    p.add_argument(
+        '--bands', nargs='+', type=_band, default=[(0, ies.NUM_HG_BINS)],
+        help='bands as LOW:HIGH (default: everything)')
+    p.add_argument('--unit', choices=UNITS, default='bin', help='units of the bands')
+    p.add_argument('--kev-per-adc', type=float, help='keV per normal ADC bin, for --unit kev')
+    p.add_argument('--kev-offset', type=float, default=0., help='keV at ADC bin 0, for --unit kev')
+    p.add_argument('--cadence', type=float, default=1, help='seconds per light curve bin')
+    p.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where to keep light curves between runs')
+    p.add_argument('--no-cache', action='store_true', help='always work the light curves out again')
+    p.add_argument(
+        '--cache-max-bytes', type=int, default=DEFAULT_MAX_BYTES,
+        help='size the cache gets trimmed to, least recently used first')
+    parallel_load.add_pool_arguments(p)
+    args = p.parse_args()
+
+    try:
+        bins = band_bins(args.bands, args.unit, args.kev_per_adc, args.kev_offset)
+    except ValueError as e:
+        p.error(str(e))
+    if args.no_cache:
+        curves = make(args.files, bins, args.cadence, gzip.open, args.workers, args.chunksize)
+    else:
+        curves = cached(
+            args.files, bins, args.cadence, args.cache_dir,
+            gzip.open, args.workers, args.chunksize, args.cache_max_bytes
+        )
+
+    out = {
+        'bands': {'unit': args.unit, 'value': [list(b) for b in args.bands]},
+        'bins': {'unit': 'N/A', 'value': bins},
+        'cadence': {'unit': 'second', 'value': args.cadence},
+    } | {
+        ch: {
+            'time': {'unit': 'N/A', 'value': ft.isoformat(c['time'])},
+            'counts': {'unit': 'count', 'value': c['counts']},
+        }
+        for ch, c in curves.items()
+    }
+    with open(args.output_fn, 'w') as f:
+        fast_json.dump(out, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+'''
+Dead-time (live-time) corrections for HaFX science data.
+
+Every 32 ms frame has `dead_time` (800 ns ticks), `num_triggers`
+and `num_evts`; from those, per frame:
+    live_time      = slice width - dead time
+    corrected_rate = num_evts / live_time
+    pileup_ratio   = (num_triggers - num_evts) / num_triggers
+and corrected light curves are total events over total live
+time in bins of any cadence:
+
+    frames = live_time.frames_from_records(fn, helpers.read_hafx_sci_array(fn, gzip.open))
+    live_time.correct_frames(frames)['corrected_rate']
+
+    curves = live_time.light_curves(fns, cadence=1)
+    curves.to_json()['c1']['corrected_rate']
+
+Frames can come from level-zero files, decoded JSON, or columnar
+output; `LightCurves` from separate files merge exactly, so files
+get worked on in parallel. Health records' own dead/real times
+(25 ns ticks) are covered by `health_live_time`.
+'''
+import argparse
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable
+
+import numpy as np
+
+import columnar
+import constants
+import fast_json
+import frame_times as ft
+import helpers
+import impress_exact_structs as ies
+import json_columns
+import parallel_load
+
+# See NominalHafx.batch_to_json
+SCI_DEAD_TICK_NS = 800
+# 40 MHz clock cycles
+HEALTH_TICK_NS = 25
+# Columns needed out of decoded output
+FRAME_COLUMNS = ('ch', 'num_evts', 'num_triggers', 'dead_time', 'timestamp', 'datatype')
+_SUMS = ('num_evts', 'num_triggers', 'live_ns', 'real_ns', 'frames')
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    ''' a / b, NaN where b is 0 '''
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    return np.divide(a, b, out=np.full(np.broadcast(a, b).shape, np.nan), where=b > 0)
+
+
+def frames_from_records(fn: str, records: np.ndarray, prior_anchor: int=0) -> dict[str, np.ndarray]:
+    ''' What corrections need, from NOMINAL_HAFX_DTYPE records of level-zero file `fn` '''
+    width = ft.to_ns(helpers.get_proper_timedelta(fn))
+    return {
+        'time_ns': ft.frame_times_ns(records['time_anchor'], records['buffer_number'], width, prior_anchor),
+        'width_ns': np.full(len(records), width, dtype=np.int64),
+        'ch': records['ch'].astype(np.int64),
+        'num_evts': records['num_evts'],
+        'num_triggers': records['num_triggers'],
+        'dead_ns': records['dead_time'].astype(np.int64) * SCI_DEAD_TICK_NS,
+    }
+
+
+def widths_ns(data_format: np.ndarray, times_ns: np.ndarray) -> np.ndarray:
+    '''
+    `helpers.get_proper_timedelta` for decoded frames,
+    going by each frame's time instead of its file's
+    '''
+    width = ft.to_ns(ft.SLICE_WIDTH)
+    revised = np.datetime64(constants.FIRST_REVISION, 'ns').view(np.int64)
+    rebinned = np.isin(data_format, ('time', 'time+energy')) & (times_ns >= revised)
+    return np.where(rebinned, constants.FIRST_NUM_TIMES_REBIN * width, width)
+
+
+def frames_from_columns(data: dict[str, dict[str, Any]]) -> dict[str, np.ndarray]:
+    ''' Same as `frames_from_records`, from decoded JSON or columnar `FRAME_COLUMNS` '''
+    times = data['timestamp']['value']
+    if not np.issubdtype(times.dtype, np.datetime64):
+        times = ft.parse_isoformat(times)
+    times_ns = times.astype('datetime64[ns]').view(np.int64)
+
+    names = data['ch']['value']
+    ch = np.full(len(names), -1, dtype=np.int64)
+    for i, name in enumerate(ies.HAFX_CHANNELS):
+        ch[names == name] = i
+
+    return {
+        'time_ns': times_ns,
+        'width_ns': widths_ns(data['datatype']['value'], times_ns),
+        'ch': ch,
+        'num_evts': data['num_evts']['value'],
+        'num_triggers': data['num_triggers']['value'],
+        # Decoded dead time is in microseconds
+        'dead_ns': np.rint(data['dead_time']['value'] * 1000).astype(np.int64),
+    }
+
+
+def load_frames(fn: str) -> dict[str, np.ndarray]:
+    ''' Frames from a level-zero file, decoded JSON file, or columnar directory '''
+    if columnar.is_columnar(fn) or fn.endswith('.json'):
+        return frames_from_columns(json_columns.load(fn, FRAME_COLUMNS))
+    return frames_from_records(fn, helpers.read_hafx_sci_array(fn, gzip.open))
+
+
+def correct_frames(frames: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    ''' Per-frame live time (s), live fraction, rates (1/s) and pileup ratio '''
+    live_ns = np.clip(frames['width_ns'] - frames['dead_ns'], 0, None)
+    # Counts times 1e9 would overflow uint32
+    evts = frames['num_evts'].astype(np.float64)
+    triggers = frames['num_triggers'].astype(np.float64)
+    return {
+        'real_time': frames['width_ns'] / ft.NS_PER_SECOND,
+        'live_time': live_ns / ft.NS_PER_SECOND,
+        'live_fraction': _divide(live_ns, frames['width_ns']),
+        'rate': _divide(evts * ft.NS_PER_SECOND, frames['width_ns']),
+        'corrected_rate': _divide(evts * ft.NS_PER_SECOND, live_ns),
+        'trigger_rate': _divide(triggers * ft.NS_PER_SECOND, live_ns),
+        'pileup_ratio': _divide(triggers - evts, triggers),
+    }
+
+
+def _merge_bins(
+    a: tuple[np.ndarray, np.ndarray],
+    b: tuple[np.ndarray, np.ndarray]
+) -> tuple[np.ndarray, np.ndarray]:
+    ''' Merge two (bin indices, sums) '''
+    keys = np.union1d(a[0], b[0])
+    sums = np.zeros((len(_SUMS), len(keys)))
+    sums[:, np.searchsorted(keys, a[0])] += a[1]
+    sums[:, np.searchsorted(keys, b[0])] += b[1]
+    return keys, sums
+
+
+class LightCurves:
+    '''
+    Mergeable per-channel sums of events, triggers, live and
+    real time in bins `cadence_ns` long (UNIX time). Frames go in
+    the bin where they start, so a cadence shorter than the frames
+    (e.g. of time-rebinned data) leaves gaps.
+    '''
+    def __init__(self, cadence_ns: int):
+        self.cadence_ns = cadence_ns
+        self.bins = {}
+
+    def add(self, frames: dict[str, np.ndarray]):
+        live_ns = np.clip(frames['width_ns'] - frames['dead_ns'], 0, None)
+        values = np.stack((
+            frames['num_evts'], frames['num_triggers'],
+            live_ns, frames['width_ns'], np.ones(len(live_ns))
+        )).astype(np.float64)
+        keys = frames['time_ns'] // self.cadence_ns
+
+        for ch in np.unique(frames['ch']):
+            if ch < 0:
+                continue
+            sel = frames['ch'] == ch
+            uniq, inverse = np.unique(keys[sel], return_inverse=True)
+            sums = np.stack([np.bincount(inverse, weights=v, minlength=len(uniq)) for v in values[:, sel]])
+            name = ies.HAFX_CHANNELS[ch]
+            self.bins[name] = _merge_bins(self.bins[name], (uniq, sums)) if name in self.bins else (uniq, sums)
+
+    def merge(self, other: 'LightCurves') -> 'LightCurves':
+        if other.cadence_ns != self.cadence_ns:
+            raise ValueError('Can only merge light curves with the same cadence')
+        for name, b in other.bins.items():
+            self.bins[name] = _merge_bins(self.bins[name], b) if name in self.bins else b
+        return self
+
+    def to_json(self) -> dict[str, dict[str, dict[str, Any]]]:
+        ret = {}
+        for name, (keys, sums) in sorted(self.bins.items()):
+            evts, triggers, live_ns, real_ns, frames = sums
+            ret[name] = {
+                'time': {'unit': 'N/A', 'value': ft.isoformat((keys * self.cadence_ns).view('datetime64[ns]'))},
+                'counts': {'unit': 'count', 'value': evts.astype(np.int64)},
+                'frames': {'unit': 'N/A', 'value': frames.astype(np.int64)},
+                'live_time': {'unit': 'second', 'value': live_ns / ft.NS_PER_SECOND},
+                'real_time': {'unit': 'second', 'value': real_ns / ft.NS_PER_SECOND},
+                'rate': {'unit': '1/second', 'value': _divide(evts * ft.NS_PER_SECOND, real_ns)},
+                'corrected_rate': {'unit': '1/second', 'value': _divide(evts * ft.NS_PER_SECOND, live_ns)},
+                'pileup_ratio': {'unit': 'N/A', 'value': _divide(triggers - evts, triggers)},
+            }
+        return ret
+
+
+def health_live_time(health: np.ndarray) -> dict[str, Any]:
+    ''' Live time each DETECTOR_HEALTH_DTYPE record reports, per HaFX channel, in seconds '''
+    ret = {'timestamp': health['timestamp']}
+    for ch in ies.HAFX_CHANNELS:
+        real = health[ch]['real_time'].astype(np.int64) * HEALTH_TICK_NS
+        live = np.clip(real - health[ch]['dead_time'].astype(np.int64) * HEALTH_TICK_NS, 0, None)
+        ret[ch] = {
+            'live_time': live / ft.NS_PER_SECOND,
+            'real_time': real / ft.NS_PER_SECOND,
+            'live_fraction': _divide(live, real),
+        }
+    return ret
+
+
+def _is_decoded(fn: str) -> bool:
+    return columnar.is_columnar(fn) or fn.endswith('.json')
+
+
+def _curves_for_file(fn: str, cadence_ns: int) -> tuple[LightCurves, dict[str, np.ndarray] | None, int]:
+    '''
+    Light curves of one file. For level-zero files, also the frames
+    before its first time anchor (timed from anchor 0) and its last
+    anchor: those frames' times depend on the file before it.
+    '''
+    curves = LightCurves(cadence_ns)
+    if _is_decoded(fn):
+        # Times were already worked out when decoding
+        curves.add(load_frames(fn))
+        return curves, None, 0
+
+    records = helpers.read_hafx_sci_array(fn, gzip.open)
+    frames = frames_from_records(fn, records)
+    anchored = np.logical_or.accumulate(records['time_anchor'] != 0)
+    curves.add({k: v[anchored] for k, v in frames.items()})
+    anchors = records['time_anchor'][records['time_anchor'] != 0]
+    leading = {k: v[~anchored] for k, v in frames.items()}
+    return curves, leading, int(anchors[-1]) if anchors.size else 0
+
+
+def light_curves(
+    fns: Iterable[str],
+    cadence: float=1,
+    workers: int | None=None,
+    chunksize: int=1
+) -> LightCurves:
+    '''
+    Live-time corrected light curves of every file at `cadence` seconds,
+    worked out in parallel. Level-zero files get put in time order so
+    frames before a file's first anchor use the last anchor of the one
+    before, like `decode_hafx_sci`; ones with no anchor before them at
+    all have no time, so they get left out.
+    '''
+    fns = list(fns)
+    fns = [fn for fn in fns if _is_decoded(fn)] + helpers.time_order(fn for fn in fns if not _is_decoded(fn))
+    cadence_ns = round(cadence * ft.NS_PER_SECOND)
+    curves = LightCurves(cadence_ns)
+    prior_anchor = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for c, leading, last_anchor in pool.map(_curves_for_file, fns, [cadence_ns] * len(fns), chunksize=chunksize):
+            curves.merge(c)
+            if leading is not None and prior_anchor:
+                curves.add(leading | {'time_ns': leading['time_ns'] + prior_anchor * ft.NS_PER_SECOND})
+            prior_anchor = last_anchor or prior_anchor
+    return curves
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Live-time corrected HaFX light curves from level-zero, JSON or columnar files')
+    p.add_argument('files', nargs='+', help='HaFX science files (.bin.gz, .json or columnar directories)')
+    p.add_argument('output_fn', help='output file name to write JSON')
+    p.add_argument('--cadence', type=float, default=1, help='seconds per light curve bin')
+    p.add_argument('--health', nargs='+', default=[], help='health files to add per-record live fractions from')
+    parallel_load.add_pool_arguments(p)
+    args = p.parse_args()
+
+    curves = light_curves(args.files, args.cadence, args.workers, args.chunksize)
+    out = {'cadence': {'unit': 'second', 'value': args.cadence}, 'light_curves': curves.to_json()}
+    if args.health:
+        health = np.concatenate(list(parallel_load.load_det_health(args.health, gzip.open, args.workers, args.chunksize)))
+        health = health[np.argsort(health['timestamp'], kind='stable')]
+        live = health_live_time(health)
+        out['health_live_fraction'] = {'timestamp': live['timestamp']} | {
+            ch: live[ch]['live_fraction'] for ch in ies.HAFX_CHANNELS
+        }
+    with open(args.output_fn, 'w') as f:
+        fast_json.dump(out, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
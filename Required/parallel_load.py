@@ -0,0 +1,129 @@
+'''
+Decompress and load whole folders of level-zero files
+using a pool of worker processes.
+
+Workers decompress into the `l0_cache` configured in `helpers`
+and only send back the cached file paths. Without one, they
+decompress into a temporary directory which goes away when
+loading is done, and every file gets deleted as soon as the
+next one is asked for. The parent memory-maps each one, so no
+records get pickled between processes.
+Results always come back in the same order as the input files,
+and only a few files ahead of the one being read are on disk.
+'''
+import argparse
+import collections
+import contextlib
+import itertools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+
+import helpers
+import impress_exact_structs as ies
+import l0_cache
+
+# Chunks decompressed ahead of the reader, per worker
+CHUNKS_AHEAD = 2
+
+
+def _decompress_chunk(cache: l0_cache.DecompressedCache, open_func: Callable, fns: list[str]) -> list[str]:
+    # Evicting is left to the parent so workers can't
+    # delete each other's entries before they get mapped
+    return [cache.fetch(fn, open_func, evict=False) for fn in fns]
+
+
+def decompress_files(
+    fns: Iterable[str],
+    open_func: Callable,
+    workers: int | None=None,
+    chunksize: int=1
+) -> Iterator[str]:
+    '''
+    Decompress `fns` in parallel; yield paths to the
+    decompressed copies in the same order as `fns`.
+    Without a cache, each copy is deleted once the next one
+    is asked for (already open or mapped files stay readable).
+    '''
+    fns = list(fns)
+    # A file listed more than once only gets deleted after its last use
+    uses = collections.Counter(fns)
+    chunks = iter([fns[i:i + chunksize] for i in range(0, len(fns), chunksize)])
+    ahead = CHUNKS_AHEAD * (workers or os.cpu_count() or 1)
+
+    temporary = helpers._cache is None
+    with tempfile.TemporaryDirectory(prefix='impress-l0-') if temporary else contextlib.nullcontext() as tmp:
+        cache = l0_cache.DecompressedCache(tmp) if temporary else helpers._cache
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            running = collections.deque(
+                (c, pool.submit(_decompress_chunk, cache, open_func, c))
+                for c in itertools.islice(chunks, ahead)
+            )
+            while running:
+                chunk, future = running.popleft()
+                paths = future.result()
+                for c in itertools.islice(chunks, 1):
+                    running.append((c, pool.submit(_decompress_chunk, cache, open_func, c)))
+                for fn, path in zip(chunk, paths):
+                    yield path
+                    uses[fn] -= 1
+                    if temporary and not uses[fn]:
+                        os.remove(path)
+                if not temporary:
+                    # Not the entries still to be handed out
+                    ahead_paths = {cache.entry_path(fn) for c, _ in running for fn in c}
+                    for cache_dir in set(os.path.dirname(p) for p in paths):
+                        cache.evict(cache_dir, keep=ahead_paths)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+
+def load_records(
+    fns: Iterable[str],
+    dtype: np.dtype,
+    open_func: Callable,
+    workers: int | None=None,
+    chunksize: int=1
+) -> Iterator[np.ndarray]:
+    '''
+    One read-only memmap of `dtype` records per file in `fns`,
+    in order. Without a cache, a file only takes up disk space
+    until its memmap gets dropped, so copy anything kept around.
+    '''
+    for path in decompress_files(fns, open_func, workers, chunksize):
+        # Mapped files stay readable on POSIX even if they get deleted
+        yield helpers.memmap_records(path, dtype)
+
+
+def load_hafx_sci(
+    fns: Iterable[str],
+    open_func: Callable,
+    workers: int | None=None,
+    chunksize: int=1
+) -> Iterator[np.ndarray]:
+    return load_records(fns, ies.NOMINAL_HAFX_DTYPE, open_func, workers, chunksize)
+
+
+def load_det_health(
+    fns: Iterable[str],
+    open_func: Callable,
+    workers: int | None=None,
+    chunksize: int=1
+) -> Iterator[np.ndarray]:
+    return load_records(fns, ies.DETECTOR_HEALTH_DTYPE, open_func, workers, chunksize)
+
+
+def add_pool_arguments(p: argparse.ArgumentParser):
+    '''
+    Add --workers and --chunksize options to a script's parser.
+    '''
+    p.add_argument(
+        '--workers', type=int, default=None,
+        help='number of decompression processes (default: number of CPUs)')
+    p.add_argument(
+        '--chunksize', type=int, default=1,
+        help='number of files handed to a worker at a time')
@@ -0,0 +1,248 @@
+'''
+Staged read -> decompress -> decode pipeline for gzipped level-zero files.
+
+`gzip.open` does disk reads, inflation and (via the caller)
+struct parsing all on one thread, so I/O and CPU never overlap.
+Here a reader thread pulls compressed chunks off disk and an
+inflate thread runs zlib (which releases the GIL), with bounded
+queues in between. Decoding happens in whichever thread reads
+from the returned file object, so any `helpers.read_*` function
+can use it by passing `PipelinedOpener().open` as its `open_func`:
+
+    opener = PipelinedOpener()
+    data = helpers.read_hafx_sci(fn, opener.open)
+    print(opener.report())
+'''
+import argparse
+import io
+import queue
+import threading
+import time
+import zlib
+
+# Expect a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+CHUNK_SIZE = 2**20
+QUEUE_DEPTH = 8
+STAGES = ('read', 'inflate', 'decode')
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        # Bytes handed to the next stage
+        self.bytes_out = 0
+        # Seconds spent working vs. waiting on a queue
+        self.busy = 0.0
+        self.blocked = 0.0
+
+    def throughput(self) -> float:
+        ''' Bytes per second of busy time '''
+        return self.bytes_out / self.busy if self.busy else float('inf')
+
+    def __str__(self):
+        return (
+            f'{self.name:>8}: {self.bytes_out / 2**20:10.1f} MiB out, '
+            f'{self.throughput() / 2**20:10.1f} MiB/s busy, '
+            f'{self.busy:8.2f} s busy, {self.blocked:8.2f} s blocked'
+        )
+
+
+class PipelinedGzipReader(io.RawIOBase):
+    def __init__(
+        self,
+        fn: str,
+        stats: dict[str, StageStats],
+        chunk_size: int=CHUNK_SIZE,
+        queue_depth: int=QUEUE_DEPTH
+    ):
+        self.stats = stats
+        self._stop = threading.Event()
+        self._compressed = queue.Queue(queue_depth)
+        self._inflated = queue.Queue(queue_depth)
+        self._leftover = memoryview(b'')
+        self._eof = False
+        self._opened_at = time.perf_counter()
+        self._decode_blocked = 0.0
+
+        self._threads = [
+            threading.Thread(target=self._read_stage, args=(fn, chunk_size), daemon=True),
+            threading.Thread(target=self._inflate_stage, daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _put(self, q: queue.Queue, item, stats: StageStats) -> bool:
+        start = time.perf_counter()
+        # Time out periodically so a closed reader doesn't strand the threads
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats.blocked += time.perf_counter() - start
+        return not self._stop.is_set()
+
+    def _get(self, q: queue.Queue, stats: StageStats):
+        start = time.perf_counter()
+        item = _DONE
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        stats.blocked += time.perf_counter() - start
+        return item
+
+    def _read_stage(self, fn: str, chunk_size: int):
+        stats = self.stats['read']
+        try:
+            with open(fn, 'rb') as f:
+                while True:
+                    start = time.perf_counter()
+                    chunk = f.read(chunk_size)
+                    stats.busy += time.perf_counter() - start
+                    if not chunk:
+                        break
+                    stats.bytes_out += len(chunk)
+                    if not self._put(self._compressed, chunk, stats):
+                        return
+        except BaseException as e:
+            self._put(self._compressed, _Failure(e), stats)
+            return
+        self._put(self._compressed, _DONE, stats)
+
+    def _inflate_stage(self):
+        stats = self.stats['inflate']
+        inflater = zlib.decompressobj(GZIP_WBITS)
+        while True:
+            chunk = self._get(self._compressed, stats)
+            if chunk is _DONE or isinstance(chunk, _Failure):
+                # A truncated last member (e.g. a file still being written)
+                # just ends the stream, so complete records still get decoded
+                self._put(self._inflated, chunk, stats)
+                return
+
+            start = time.perf_counter()
+            out = []
+            try:
+                while chunk:
+                    out.append(inflater.decompress(chunk))
+                    chunk = b''
+                    if inflater.eof:
+                        # gzip files may have several members back to back
+                        chunk = inflater.unused_data
+                        inflater = zlib.decompressobj(GZIP_WBITS)
+            except zlib.error as e:
+                self._put(self._inflated, _Failure(e), stats)
+                return
+            data = b''.join(out)
+            stats.busy += time.perf_counter() - start
+
+            if data:
+                stats.bytes_out += len(data)
+                if not self._put(self._inflated, data, stats):
+                    return
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        stats = self.stats['decode']
+        while not self._leftover:
+            if self._eof:
+                return 0
+            start = time.perf_counter()
+            item = self._inflated.get()
+            waited = time.perf_counter() - start
+            stats.blocked += waited
+            self._decode_blocked += waited
+            if item is _DONE:
+                self._eof = True
+                return 0
+            if isinstance(item, _Failure):
+                self._eof = True
+                raise item.exc
+            self._leftover = memoryview(item)
+
+        # Destination may be e.g. a ctypes struct
+        dest = memoryview(b).cast('B')
+        n = min(len(dest), len(self._leftover))
+        dest[:n] = self._leftover[:n]
+        self._leftover = self._leftover[n:]
+        stats.bytes_out += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            for t in self._threads:
+                t.join()
+            # Any time not spent waiting on the inflate stage was decoding
+            elapsed = time.perf_counter() - self._opened_at
+            self.stats['decode'].busy += elapsed - self._decode_blocked
+        super().close()
+
+
+class PipelinedOpener:
+    '''
+    Drop-in `open_func` for the `helpers` readers.
+    Stage statistics accumulate across every file it opens.
+    '''
+    def __init__(self, chunk_size: int=CHUNK_SIZE, queue_depth: int=QUEUE_DEPTH):
+        self.chunk_size = chunk_size
+        self.queue_depth = queue_depth
+        self.stats = {name: StageStats(name) for name in STAGES}
+
+    def open(self, fn: str, mode: str='rb') -> io.BufferedReader:
+        if mode != 'rb':
+            raise ValueError(f'Pipelined files can only be opened as "rb", not "{mode}"')
+        return io.BufferedReader(PipelinedGzipReader(
+            fn, self.stats, self.chunk_size, self.queue_depth
+        ))
+
+    def bottleneck(self) -> str:
+        ''' The stage which spent the most time working '''
+        return max(self.stats.values(), key=lambda s: s.busy).name
+
+    def report(self) -> str:
+        return '\n'.join(
+            [str(s) for s in self.stats.values()]
+            + [f'bottleneck: {self.bottleneck()}']
+        )
+
+
+def main():
+    import helpers
+    readers = {
+        'hafx_sci': helpers.read_hafx_sci,
+        'det_health': helpers.read_det_health,
+        'x123_sci': helpers.read_x123_sci,
+        'x123_debug': helpers.read_x123_debug,
+        'hafx_debug': helpers.read_hafx_debug,
+    }
+    p = argparse.ArgumentParser(
+        description='Decode level-zero files through the pipeline and report stage throughput')
+    p.add_argument('product', choices=readers.keys(), help='type of data in the files')
+    p.add_argument('files', nargs='+', help='.bin.gz files to decode')
+    p.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='compressed bytes per read')
+    p.add_argument('--queue-depth', type=int, default=QUEUE_DEPTH, help='chunks buffered between stages')
+    args = p.parse_args()
+
+    opener = PipelinedOpener(args.chunk_size, args.queue_depth)
+    num_records = sum(len(readers[args.product](fn, opener.open)) for fn in args.files)
+    print(f'{num_records} records')
+    print(opener.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+'''
+2D prefix sums of HaFX histograms, for instant counts queries.
+
+For every UTC day and channel, `build` stores
+    cumsum[i, b] = counts in frames [0, i) and bins [0, b)
+(frames in time order) next to the frame edges `time`, as a
+`columnar` container:
+
+    index/
+        2024-178/c1/   manifest.json, time.npy, cumsum.npy
+        2024-178/m1/
+        ...
+
+so counts in any rectangle of time x energy are four lookups
+into memory-mapped files, however much data there is:
+
+    idx = prefix_index.PrefixIndex('index/')
+    idx.counts('c1', t0, t1, bins=(10, 40))
+    idx.light_curve('c1', edges, bins=(10, 40))
+    idx.spectrum('c1', t0, t1)
+
+Times are anything `np.datetime64` takes. A frame counts as
+inside [t0, t1) if it starts inside it. Everything is int64,
+so a full day of one channel at 32 Hz takes about 2.7 GB on disk;
+queries only touch the pages they look at.
+'''
+import argparse
+import gzip
+import os
+from typing import Callable, Iterable
+
+import numpy as np
+
+import columnar
+import frame_times as ft
+import helpers
+import impress_exact_structs as ies
+import parallel_load
+
+NS_PER_DAY = 86400 * ft.NS_PER_SECOND
+DAY_FMT = '%Y-%j'
+
+
+def _day_name(day: int) -> str:
+    return np.datetime64(int(day), 'D').astype(object).strftime(DAY_FMT)
+
+
+def _to_ns(t) -> np.ndarray:
+    return np.asarray(t, dtype='datetime64[ns]').view(np.int64)
+
+
+def _write_index(path: str, starts: np.ndarray, ends: np.ndarray, histograms: np.ndarray, attrs: dict):
+    ''' One day of one channel, frames already in time order '''
+    num_bins = histograms.shape[1]
+    with columnar.ColumnarWriter(path, attrs) as writer:
+        writer.write({
+            'time': {'unit': 'N/A', 'value': starts[:1].view('datetime64[ns]')},
+            'cumsum': {'unit': 'count', 'value': np.zeros((1, num_bins + 1), dtype=np.int64)},
+        })
+        carry = np.zeros(num_bins + 1, dtype=np.int64)
+        for lo in range(0, len(histograms), helpers.BATCH_SIZE):
+            batch = histograms[lo:lo + helpers.BATCH_SIZE].astype(np.int64)
+            rows = np.zeros((len(batch), num_bins + 1), dtype=np.int64)
+            np.cumsum(batch, axis=1, out=rows[:, 1:])
+            np.cumsum(rows, axis=0, out=rows)
+            rows += carry
+            carry = rows[-1]
+            # Edge i + 1 is where frame i ends: the next start, or its own end for the last one
+            hi = lo + len(batch)
+            edges = np.append(starts[lo + 1:hi + 1], ends[hi - 1]) if hi == len(starts) else starts[lo + 1:hi + 1]
+            writer.write({
+                'time': {'unit': 'N/A', 'value': edges.view('datetime64[ns]')},
+                'cumsum': {'unit': 'count', 'value': rows},
+            })
+
+
+def _days(pending: list[tuple], after: int | None) -> np.ndarray:
+    ''' Days of the pending files in `build` not written yet '''
+    if not pending:
+        return np.zeros(0, dtype=np.int64)
+    days = np.unique(np.concatenate([days for *_, days in pending]))
+    return days if after is None else days[days > after]
+
+
+def _write_day(root: str, day: int, pending: list[tuple]) -> list[str]:
+    ''' Every channel of one day, out of the pending files in `build` '''
+    written = []
+    files = [p for p in pending if day in p[4]]
+    sources = [os.path.abspath(fn) for fn, *_ in files]
+    in_day = [(data, t, width, t // NS_PER_DAY == day) for _, data, t, width, _ in files]
+    for ch, name in enumerate(ies.HAFX_CHANNELS):
+        # Only one day of one channel is in memory at once
+        parts = [(data, t, width, sel & (data['ch'] == ch)) for data, t, width, sel in in_day]
+        starts = np.concatenate([t[sel] for _, t, _, sel in parts])
+        if not starts.size:
+            continue
+        widths = np.concatenate([np.full(sel.sum(), w, dtype=np.int64) for _, _, w, sel in parts])
+        order = np.argsort(starts, kind='stable')
+        histograms = np.concatenate([data['histogram'][sel] for data, _, _, sel in parts])[order]
+        path = os.path.join(root, _day_name(day), name)
+        _write_index(path, starts[order], starts[order] + widths[order], histograms, {
+            'product': 'hafx_prefix_index',
+            'channel': name,
+            'day': _day_name(day),
+            'sources': sources,
+        })
+        written.append(path)
+    return written
+
+
+def build(
+    fns: Iterable[str],
+    root: str,
+    open_func: Callable=gzip.open,
+    workers: int | None=None,
+    chunksize: int=1
+) -> list[str]:
+    '''
+    Index every HaFX science file in `fns` (put in time order by
+    `helpers.time_order`) into `root`, one container per day and channel.
+    Returns the containers written; days which were already
+    indexed get rebuilt from just these files.
+    '''
+    fns = helpers.time_order(fns)
+    hafx = parallel_load.load_hafx_sci(fns, open_func, workers, chunksize)
+
+    written = []
+    # (fn, data, times, width, days) of files with frames in days not written yet
+    pending = []
+    written_through = None
+    widths = [helpers.get_proper_timedelta(fn) for fn in fns]
+    for fn, (data, t, width) in zip(fns, ft.frame_info(hafx, widths)):
+        days = np.unique(t // NS_PER_DAY)
+        if not days.size:
+            continue
+        if written_through is not None and days[0] <= written_through:
+            raise ValueError(f'{fn} has frames in a day already indexed; are the files in time order?')
+        # Files come in time order, so days before this file's first one are complete
+        for day in _days(pending, written_through):
+            if day < days[0]:
+                written += _write_day(root, day, pending)
+                written_through = day
+        # Files with nothing left to write get dropped (unmapped)
+        pending = [p for p in pending if p[4][-1] >= days[0]]
+        pending.append((fn, data, t, width, days))
+
+    for day in _days(pending, written_through):
+        written += _write_day(root, day, pending)
+    return written
+
+
+class PrefixIndex:
+    ''' Counts queries over everything `build` put in `root` '''
+    def __init__(self, root: str):
+        self.root = root
+        self.days = {}
+        for day in sorted(os.listdir(root)):
+            for ch in ies.HAFX_CHANNELS:
+                path = os.path.join(root, day, ch)
+                if columnar.is_columnar(path):
+                    data = columnar.ColumnarFile(path)
+                    self.days.setdefault(ch, []).append(
+                        (data.column('time').view(np.int64), data.column('cumsum'))
+                    )
+
+    def _rectangles(self, ch: str, edges: np.ndarray, bins: tuple[int, int]) -> np.ndarray:
+        ''' Counts between consecutive time edges (ns), in bins [b0, b1) '''
+        b0, b1 = bins
+        ret = np.zeros(max(len(edges) - 1, 0), dtype=np.int64)
+        for times, cs in self.days.get(ch, []):
+            # Edges outside the day land on its first or last row, adding nothing
+            i = np.searchsorted(times[:-1], edges, side='left')
+            ret += (cs[i[1:], b1] - cs[i[:-1], b1]) - (cs[i[1:], b0] - cs[i[:-1], b0])
+        return ret
+
+    def counts(self, ch: str, t0, t1, bins: tuple[int, int]=(0, ies.NUM_HG_BINS)) -> int:
+        ''' Counts in histogram bins [b0, b1) of frames starting in [t0, t1) '''
+        return int(self._rectangles(ch, _to_ns([t0, t1]), bins)[0])
+
+    def light_curve(self, ch: str, edges, bins: tuple[int, int]=(0, ies.NUM_HG_BINS)) -> np.ndarray:
+        ''' Counts in bins [b0, b1) between each pair of time edges '''
+        return self._rectangles(ch, _to_ns(edges), bins)
+
+    def spectrum(self, ch: str, t0, t1) -> np.ndarray:
+        ''' Counts per histogram bin of frames starting in [t0, t1) '''
+        lo, hi = _to_ns([t0, t1])
+        ret = np.zeros(ies.NUM_HG_BINS, dtype=np.int64)
+        for times, cs in self.days.get(ch, []):
+            i0, i1 = np.searchsorted(times[:-1], [lo, hi], side='left')
+            ret += np.diff(cs[i1] - cs[i0])
+        return ret
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Build per-day prefix-sum indexes of HaFX histograms for instant counts queries')
+    p.add_argument('files', nargs='+', help='HaFX science .bin.gz files to index')
+    p.add_argument('root', help='directory to put the indexes in')
+    parallel_load.add_pool_arguments(p)
+    args = p.parse_args()
+
+    for path in build(args.files, args.root, gzip.open, args.workers, args.chunksize):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''
+Reproduce the onboard time/energy rebinning on ground data.
+
+Histograms are (N, 123) arrays, e.g. `arr['histogram']` from
+`helpers.read_hafx_sci_array`. Time rebinning sums every
+`num_times` consecutive frames; energy rebinning sums the
+123 bins between consecutive `energy_edges`.
+Both are single `np.add.reduceat` calls.
+
+Parameters come from the revision table in `constants`,
+picked by date with `revision_for`.
+'''
+import datetime as dt
+from typing import Sequence
+
+import numpy as np
+
+import constants
+
+
+def revision_for(date: dt.datetime) -> str:
+    '''
+    Name of the rebinning revision in effect on `date`
+    (the latest one which started on or before it).
+    Raises ValueError if `date` is before every revision,
+    since no rebinning was done onboard then.
+    '''
+    # Revision dates in `constants` are naive UTC
+    if date.tzinfo is not None:
+        date = date.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    current = None
+    for rev in constants.REVISIONS:
+        if constants.fetcher(rev, '_REVISION') <= date:
+            current = rev
+    if current is None:
+        raise ValueError(f'No rebinning revision was in effect on {date:%Y-%m-%d}')
+    return current
+
+
+def parameters_for(date: dt.datetime) -> tuple[int, tuple[int, ...]]:
+    ''' (number of frames summed, energy bin edges) in effect on `date` '''
+    rev = revision_for(date)
+    return (
+        constants.fetcher(rev, '_NUM_TIMES_REBIN'),
+        constants.fetcher(rev, '_NEW_ENERGY_EDGES')
+    )
+
+
+def rebin_energy(histograms: np.ndarray, energy_edges: Sequence[int]) -> np.ndarray:
+    '''
+    Sum bins [edges[i], edges[i + 1]) together.
+    The last edge may run past the end of the histogram.
+    '''
+    edges = np.asarray(energy_edges)
+    # Everything from the last left edge to the final edge goes in one bin
+    clipped = histograms[:, edges[0]:edges[-1]]
+    return np.add.reduceat(clipped, edges[:-1] - edges[0], axis=1, dtype=np.uint64)
+
+
+def rebin_time(histograms: np.ndarray, num_times: int) -> np.ndarray:
+    '''
+    Sum every `num_times` frames together.
+    A short group at the end is summed as-is.
+    '''
+    if len(histograms) == 0:
+        return np.zeros((0,) + histograms.shape[1:], dtype=np.uint64)
+    starts = np.arange(0, len(histograms), num_times)
+    return np.add.reduceat(histograms, starts, axis=0, dtype=np.uint64)
+
+
+def rebin(
+    histograms: np.ndarray,
+    num_times: int=constants.NUM_TIMES_REBIN,
+    energy_edges: Sequence[int]=constants.NEW_ENERGY_EDGES
+) -> np.ndarray:
+    return rebin_time(rebin_energy(histograms, energy_edges), num_times)
+
+
+class StreamingRebinner:
+    '''
+    Rebin histograms which arrive in batches of any size.
+    Frames which don't fill a whole time bin yet get carried
+    over to the next batch, so the output is the same as
+    rebinning everything at once.
+    '''
+    def __init__(
+        self,
+        num_times: int=constants.NUM_TIMES_REBIN,
+        energy_edges: Sequence[int]=constants.NEW_ENERGY_EDGES
+    ):
+        self.num_times = num_times
+        self.energy_edges = tuple(energy_edges)
+        self._carry_counts = None
+        self._carry_times = None
+
+    @classmethod
+    def for_date(cls, date: dt.datetime) -> 'StreamingRebinner':
+        return cls(*parameters_for(date))
+
+    def push(
+        self,
+        histograms: np.ndarray,
+        times: np.ndarray | None=None
+    ) -> tuple[np.ndarray, np.ndarray | None]:
+        '''
+        Add a batch of (N, 123) histograms (and optionally their times;
+        pass them either with every batch or never).
+        Returns the completed time bins and their left-edge times.
+        '''
+        # Energy first, so fewer columns get carried around
+        counts = rebin_energy(histograms, self.energy_edges)
+        if self._carry_counts is not None:
+            counts = np.concatenate((self._carry_counts, counts))
+            if times is not None:
+                times = np.concatenate((self._carry_times, times))
+
+        num_full = (len(counts) // self.num_times) * self.num_times
+        # Copy so the carry doesn't keep the whole batch alive
+        self._carry_counts = counts[num_full:].copy()
+        self._carry_times = None if times is None else times[num_full:].copy()
+
+        return (
+            rebin_time(counts[:num_full], self.num_times),
+            None if times is None else times[:num_full:self.num_times]
+        )
+
+    def flush(self) -> tuple[np.ndarray, np.ndarray | None]:
+        ''' Sum up whatever partial time bin is left over '''
+        counts, times = self._carry_counts, self._carry_times
+        self._carry_counts = self._carry_times = None
+        if counts is None or len(counts) == 0:
+            num_bins = len(self.energy_edges) - 1
+            return np.zeros((0, num_bins), dtype=np.uint64), None if times is None else times[:0]
+        return (
+            rebin_time(counts, self.num_times),
+            None if times is None else times[:1]
+        )
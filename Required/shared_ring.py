@@ -0,0 +1,168 @@
+'''
+The last few minutes of HaFX frames in shared memory.
+
+One producer (e.g. `ingest --ring NAME`) decodes frames once and
+writes them into a fixed-size ring laid out as
+NOMINAL_HAFX_DTYPE records; any number of other processes
+(live plot, health monitor, quick-look writer) attach by name
+and read them without decoding anything or taking any lock.
+
+    ring = FrameRing.create('impress', minutes=5)   # producer
+    ring.write(records)
+
+    ring = FrameRing.attach('impress')              # anywhere else
+    seq = 0
+    while True:
+        ring.wait(seq, timeout=1)
+        new, seq, lost = ring.read_since(seq)
+
+Every frame ever written has a sequence number; the header
+holds two of them. The producer bumps `reserved` before it
+overwrites anything and `committed` once the frames are in.
+A reader copies out frames up to `committed`, then throws away
+any which `reserved` says could have been overwritten during
+the copy, so it never hands back a torn frame.
+'''
+from multiprocessing import resource_tracker, shared_memory
+import time
+
+import numpy as np
+
+import frame_times
+import impress_exact_structs as ies
+
+MAGIC = b'IMPRING1'
+_HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('capacity', '<u8'),
+    ('itemsize', '<u8'),
+    ('reserved', '<u8'),
+    ('committed', '<u8'),
+])
+# Frames start on their own cache line
+_HEADER_BYTES = 64
+
+
+def capacity_for(minutes: float, channels: int=len(ies.HAFX_CHANNELS)) -> int:
+    ''' Frames needed to hold `minutes` of data from every channel '''
+    return int(minutes * 60 * frame_times.FRAMES_PER_ANCHOR * channels)
+
+
+class FrameRing:
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), dtype=_HEADER, buffer=shm.buf)
+        if owner:
+            self.header['magic'] = MAGIC
+        elif self.header['magic'] != MAGIC:
+            raise ValueError(f'Shared memory {shm.name} is not a frame ring')
+        if not owner and self.header['itemsize'] != ies.NOMINAL_HAFX_DTYPE.itemsize:
+            raise ValueError(f'Frame ring {shm.name} holds a different record layout')
+        self.capacity = int(self.header['capacity'])
+        self.frames = np.ndarray(
+            (self.capacity,), dtype=ies.NOMINAL_HAFX_DTYPE,
+            buffer=shm.buf, offset=_HEADER_BYTES
+        )
+
+    @classmethod
+    def create(cls, name: str | None=None, minutes: float=5) -> 'FrameRing':
+        capacity = capacity_for(minutes)
+        shm = shared_memory.SharedMemory(
+            name, create=True,
+            size=_HEADER_BYTES + capacity * ies.NOMINAL_HAFX_DTYPE.itemsize
+        )
+        header = np.ndarray((), dtype=_HEADER, buffer=shm.buf)
+        header['capacity'] = capacity
+        header['itemsize'] = ies.NOMINAL_HAFX_DTYPE.itemsize
+        header['reserved'] = header['committed'] = 0
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'FrameRing':
+        shm = shared_memory.SharedMemory(name)
+        # Otherwise the tracker deletes the ring when a *reader* exits
+        # (Python < 3.13 has no track=False)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def committed(self) -> int:
+        return int(self.header['committed'])
+
+    def write(self, records: np.ndarray) -> int:
+        ''' Producer only: add frames, returning the new committed sequence number '''
+        start = self.committed + max(len(records) - self.capacity, 0)
+        records = records[-self.capacity:]
+        end = start + len(records)
+        self.header['reserved'] = end
+
+        pos = start % self.capacity
+        first = min(len(records), self.capacity - pos)
+        self.frames[pos:pos + first] = records[:first]
+        self.frames[:len(records) - first] = records[first:]
+
+        self.header['committed'] = end
+        return end
+
+    def _copy(self, lo: int, hi: int) -> np.ndarray:
+        if hi <= lo:
+            return self.frames[:0].copy()
+        pos = lo % self.capacity
+        n = hi - lo
+        if pos + n <= self.capacity:
+            return self.frames[pos:pos + n].copy()
+        return np.concatenate((self.frames[pos:], self.frames[:pos + n - self.capacity]))
+
+    def read_since(self, seq: int) -> tuple[np.ndarray, int, int]:
+        '''
+        Frames from sequence number `seq` on, as
+        (frames oldest first, sequence number to ask for next,
+        frames lost because the reader fell more than a ring behind).
+        '''
+        committed = self.committed
+        # A producer which restarted begins counting again
+        seq = min(seq, committed)
+        lo = max(seq, committed - self.capacity)
+        frames = self._copy(lo, committed)
+        valid = min(max(lo, int(self.header['reserved']) - self.capacity), committed)
+        return frames[valid - lo:], committed, valid - seq
+
+    def snapshot(self, channel: str | None=None) -> np.ndarray:
+        ''' Every frame still in the ring, optionally just one channel's '''
+        frames, _, _ = self.read_since(0)
+        if channel is not None:
+            frames = frames[frames['ch'] == ies.HAFX_CHANNELS.index(channel)]
+        return frames
+
+    def wait(self, seq: int, timeout: float | None=None) -> int:
+        '''
+        Block until frames past `seq` are committed or `timeout` passes;
+        returns the committed sequence number.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        nap = 0.0005
+        while (committed := self.committed) == seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(nap)
+            nap = min(2 * nap, 0.02)
+        return committed
+
+    def close(self):
+        # Views into the buffer have to go before it can be closed
+        del self.frames, self.header
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self) -> 'FrameRing':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -6,6 +6,7 @@ import random
 import time
 
 import impress_exact_structs as ies
+import ingest
 from constants import DATE_FMT
 
 def main():
@@ -14,7 +15,7 @@ def main():
     p.add_argument(
         'data_dir',
         default='test-data',
-        help='directory to save data to')
+        help='directory to save data to (unused with --send)')
     p.add_argument(
         'num_files',
         type=int,
@@ -25,21 +26,44 @@ def main():
         type=int,
         default=30,
         help='number of seconds per time_slice file')
+    add_send_arguments(p)
     args = p.parse_args()
 
-    os.makedirs(args.data_dir, exist_ok=True)
-
     ts = int(time.time())
+    if args.send:
+        with ingest.IngestClient(args.send, args.udp) as client:
+            for _ in range(args.num_files * args.seconds_per_file):
+                client.send('hafx_sci', simulate_second(ts))
+                ts += 1
+                # Come down as fast as the real thing would
+                time.sleep(max(0, ts - time.time()))
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
     for slice_num in range(args.num_files):
         time_str = dt.datetime.fromtimestamp(ts, dt.timezone.utc).strftime(DATE_FMT)
         output_file = f'{args.data_dir}/sim-hafx-c1-hist_{time_str}_0.bin.gz'
         with gzip.open(output_file, 'wb') as f:
             for sec in range(args.seconds_per_file):
-                for i in range(32):
-                    f.write(simulate_single_slice(i, ts if (i % 32 == 0) else 0))
+                f.write(simulate_second(ts))
                 ts += 1
 
 
+def add_send_arguments(p: argparse.ArgumentParser):
+    p.add_argument(
+        '--send',
+        metavar='HOST:PORT',
+        help='stream records to an ingest service (Required/ingest.py) in real time instead of writing files')
+    p.add_argument(
+        '--udp',
+        action='store_true',
+        help='send over UDP instead of TCP')
+
+
+def simulate_second(ts: int) -> bytes:
+    return b''.join(bytes(simulate_single_slice(i, ts if (i % 32 == 0) else 0)) for i in range(32))
+
+
 def simulate_single_slice(frame_num: int, time_anchor: int=0) -> ies.NominalHafx:
     ret = ies.NominalHafx()
 
@@ -7,7 +7,9 @@ import time
 import struct
 
 import impress_exact_structs as ies
+import ingest
 from constants import DATE_FMT
+from Simulate_HaFX_Slices import add_send_arguments
 
 def main():
     p = argparse.ArgumentParser(
@@ -15,7 +17,7 @@ def main():
     p.add_argument(
         'data_dir',
         default='test-data',
-        help='directory to save data to')
+        help='directory to save data to (unused with --send)')
     p.add_argument(
         'num_files',
         type=int,
@@ -26,11 +28,20 @@ def main():
         type=int,
         default=30,
         help='number of seconds per time_slice file')
+    add_send_arguments(p)
     args = p.parse_args()
 
-    os.makedirs(args.data_dir, exist_ok=True)
-
     ts = int(time.time())
+    if args.send:
+        with ingest.IngestClient(args.send, args.udp) as client:
+            for _ in range(args.num_files * args.seconds_per_file):
+                client.send('x123_sci', simulate_single_slice(ts))
+                ts += 1
+                # Come down as fast as the real thing would
+                time.sleep(max(0, ts - time.time()))
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
     for slice_num in range(args.num_files):
         time_str = dt.datetime.fromtimestamp(ts, dt.timezone.utc).strftime(DATE_FMT)
         output_file = f'{args.data_dir}/sim-x123-hist_{time_str}_0.bin.gz'
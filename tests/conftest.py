@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules import each other by bare name, same as when run from their folders
+HERE = os.path.dirname(__file__)
+for folder in ('Required', 'Decoding'):
+    sys.path.insert(0, os.path.join(HERE, '..', folder))
@@ -0,0 +1,52 @@
+import gzip
+import json
+import sys
+
+import numpy as np
+
+import json_decoders
+import impress_exact_structs as ies
+
+
+class RoundingFloat(float):
+    __repr__ = staticmethod(lambda x: format(x, '.2f'))
+
+
+def test_raw_data_matches_per_record_decoding(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    records = np.frombuffer(
+        rng.integers(0, 256, 20 * ies.DETECTOR_HEALTH_DTYPE.itemsize, dtype=np.uint8).tobytes(),
+        dtype=ies.DETECTOR_HEALTH_DTYPE
+    ).copy()
+    records['timestamp'] = 1_700_000_000 + rng.permutation(len(records))
+    fn = tmp_path / 'health_2023-318-22-13-20_0.bin.gz'
+    with gzip.open(fn, 'wb') as f:
+        f.write(records.tobytes())
+
+    out = tmp_path / 'out.json'
+    monkeypatch.setattr(sys, 'argv', ['decode_health', str(fn), str(out)])
+    json_decoders.decode_health()
+
+    # How the decoder used to do it: one record at a time, then collapse
+    per_record = sorted(
+        (ies.DetectorHealth.from_buffer_copy(r.tobytes()).to_json() for r in records),
+        key=lambda e: e['timestamp']
+    )
+    collapsed = json_decoders.collapse_health(per_record)
+    processed = {'start_time': collapsed['timestamp'][0]}
+    for ch in ies.HAFX_CHANNELS + ('x123',):
+        fields = ('board_temp', 'det_high_voltage', 'det_temp') if ch == 'x123' else \
+            ('arm_temp', 'sipm_temp', 'sipm_operating_voltage')
+        processed[ch] = {}
+        for field in fields:
+            values = collapsed[ch][field]['value']
+            # .item() for plain ints/floats, like the baseline's min() and max()
+            processed[ch][field] = {
+                'avg': np.mean(values), 'min': np.min(values).item(), 'max': np.max(values).item()
+            }
+
+    # With the float monkeypatch the decoders used to apply
+    monkeypatch.setattr(json.encoder, 'c_make_encoder', None)
+    monkeypatch.setattr(json.encoder, 'float', RoundingFloat, raising=False)
+    expected = json.dumps({'processed_data': processed, 'raw_data': collapsed}, indent=1)
+    assert out.read_text() == expected
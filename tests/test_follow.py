@@ -0,0 +1,38 @@
+import gzip
+import os
+import zlib
+
+import numpy as np
+
+import follow
+import impress_exact_structs as ies
+
+
+def _records(first: int, num: int) -> np.ndarray:
+    records = np.zeros(num, dtype=ies.NOMINAL_HAFX_DTYPE)
+    records['buffer_number'] = first + np.arange(num)
+    return records
+
+
+def test_replaced_file_drops_partial_record(tmp_path):
+    fn = str(tmp_path / 'hafx-time-slice_2024-200-00-00-00_0.bin.gz')
+    size = ies.NOMINAL_HAFX_DTYPE.itemsize
+    # Two and a bit records, flushed so they can be read before the file is done
+    deflate = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    with open(fn, 'wb') as f:
+        f.write(deflate.compress(_records(0, 5).tobytes()[:2 * size + 7]) + deflate.flush(zlib.Z_SYNC_FLUSH))
+
+    tail = follow.RecordTail(fn, ies.NOMINAL_HAFX_DTYPE)
+    assert tail.read_new()['buffer_number'].tolist() == [0, 1]
+
+    with gzip.open(fn + '.tmp', 'wb') as f:
+        f.write(_records(100, 3).tobytes())
+    os.replace(fn + '.tmp', fn)
+    assert tail.read_new()['buffer_number'].tolist() == [100, 101, 102]
+
+    # Truncated in place and written again
+    with open(fn, 'r+b') as f:
+        f.truncate(0)
+    with gzip.open(fn, 'ab') as f:
+        f.write(_records(200, 2).tobytes())
+    assert tail.read_new()['buffer_number'].tolist() == [200, 201]
@@ -0,0 +1,43 @@
+import gzip
+
+import numpy as np
+
+import gzip_index
+import impress_exact_structs as ies
+
+FIRST_SECOND = 1_700_000_000
+
+
+def _hafx_file(path, seconds: int=4):
+    frames = seconds * 32
+    records = np.zeros(frames, dtype=ies.NOMINAL_HAFX_DTYPE)
+    records['buffer_number'] = np.arange(frames)
+    records['time_anchor'][::32] = FIRST_SECOND + np.arange(seconds)
+    records['num_evts'] = np.arange(frames)
+    with gzip.open(path, 'wb') as f:
+        f.write(records.tobytes())
+    return records
+
+
+def test_time_range_with_checkpoints_sharing_a_second(tmp_path):
+    records = _hafx_file(tmp_path / 'in.bin.gz')
+    out = str(tmp_path / 'seekable.bin.gz')
+    # About four frames per member, so every second spans several checkpoints
+    index = gzip_index.make_seekable(
+        str(tmp_path / 'in.bin.gz'), out, 'hafx_sci',
+        member_bytes=4 * ies.NOMINAL_HAFX_DTYPE.itemsize
+    )
+    times = [c[4] for c in index['checkpoints']]
+    assert max(times.count(t) for t in set(times)) > 1
+
+    for second in range(4):
+        t = FIRST_SECOND + second
+        got = gzip_index.read_time_range(out, 'hafx_sci', t, t + 1)
+        np.testing.assert_array_equal(got, records[second * 32:(second + 1) * 32])
+
+
+def test_records_match_gzip_open(tmp_path):
+    records = _hafx_file(tmp_path / 'in.bin.gz')
+    out = str(tmp_path / 'seekable.bin.gz')
+    gzip_index.make_seekable(str(tmp_path / 'in.bin.gz'), out, 'hafx_sci', member_bytes=1000)
+    np.testing.assert_array_equal(gzip_index.read_records(out, 'hafx_sci', 10, 50), records[10:50])
@@ -0,0 +1,58 @@
+import gzip
+
+import numpy as np
+
+import frame_times as ft
+import helpers
+import impress_exact_structs as ies
+import live_time
+
+FIRST_SECOND = 1_720_000_000
+
+
+def _write(path, first_frame: int, num: int) -> np.ndarray:
+    ''' `num` frames of every channel, anchored at the start of every second '''
+    frame = first_frame + np.arange(num)
+    records = np.zeros(num * 4, dtype=ies.NOMINAL_HAFX_DTYPE)
+    records['ch'] = np.tile(np.arange(4), num)
+    records['buffer_number'] = np.repeat(frame, 4)
+    records['time_anchor'] = np.repeat(np.where(frame % 32 == 0, FIRST_SECOND + frame // 32, 0), 4)
+    records['num_evts'] = 1000
+    records['num_triggers'] = 1100
+    records['dead_time'] = 5000
+    with gzip.open(path, 'wb') as f:
+        f.write(records.tobytes())
+    return records
+
+
+def test_light_curves_carry_anchors_across_files(tmp_path):
+    # Named so that sorting on the path puts them in the wrong order
+    first = str(tmp_path / 'hafx-time-slice_2024-200-00-00-00_2.bin.gz')
+    second = str(tmp_path / 'hafx-time-slice_2024-200-00-00-00_10.bin.gz')
+    # Both start part way through a second, on zero anchors;
+    # the first one has nothing before it to go by
+    _write(first, 20, 60)
+    _write(second, 80, 100)
+
+    curves = live_time.light_curves([second, first], cadence=1, workers=2)
+
+    expected = live_time.LightCurves(ft.NS_PER_SECOND)
+    fns = helpers.time_order([second, first])
+    assert fns == [first, second]
+    records = [helpers.read_hafx_sci_array(fn, gzip.open) for fn in fns]
+    widths = [helpers.get_proper_timedelta(fn) for fn in fns]
+    for fn, (data, times, _) in zip(fns, ft.frame_info(records, widths)):
+        frames = live_time.frames_from_records(fn, data) | {'time_ns': times}
+        keep = times >= FIRST_SECOND * ft.NS_PER_SECOND
+        expected.add({k: v[keep] for k, v in frames.items()})
+
+    got, want = curves.to_json(), expected.to_json()
+    assert got.keys() == want.keys() == set(ies.HAFX_CHANNELS)
+    for ch in got:
+        # Nothing ends up in 1970
+        assert got[ch]['time']['value'][0].startswith('2024-')
+        assert got[ch]['time']['value'] == want[ch]['time']['value']
+        for field in ('counts', 'frames', 'live_time', 'real_time'):
+            np.testing.assert_array_equal(got[ch][field]['value'], want[ch][field]['value'])
+    # 60 + 100 frames, less the first 12 which have no time
+    assert got['c1']['frames']['value'].sum() == 148
@@ -0,0 +1,71 @@
+import datetime as dt
+import gzip
+import os
+
+import numpy as np
+
+import constants
+import frame_times as ft
+import helpers
+import impress_exact_structs as ies
+import prefix_index
+
+# Files run across a UTC midnight
+MIDNIGHT = 1_720_051_200
+
+
+def _write(folder, start: int, seq: int, rng, name_time: int | None=None) -> str:
+    ''' Three seconds of frames from every channel, named as starting at `name_time` '''
+    os.makedirs(folder, exist_ok=True)
+    num = 3 * 32
+    frame = np.arange(num)
+    records = np.zeros(num * 4, dtype=ies.NOMINAL_HAFX_DTYPE)
+    records['ch'] = np.tile(np.arange(4), num)
+    records['buffer_number'] = np.repeat(frame, 4)
+    records['time_anchor'] = np.repeat(np.where(frame % 32 == 0, start + frame // 32, 0), 4)
+    records['histogram'] = rng.integers(0, 20, (len(records), ies.NUM_HG_BINS))
+    date = dt.datetime.fromtimestamp(start if name_time is None else name_time, dt.timezone.utc).strftime(constants.DATE_FMT)
+    fn = os.path.join(folder, f'hafx-time-slice_{date}_{seq}.bin.gz')
+    with gzip.open(fn, 'wb') as f:
+        f.write(records.tobytes())
+    return fn
+
+
+def test_queries_match_direct_sums(tmp_path):
+    rng = np.random.default_rng(3)
+    # Sorting on the path gets these out of time order twice over:
+    # folder b/ before a/, and _10 before _2 with the same date in the name
+    fns = [
+        _write(tmp_path / 'b', MIDNIGHT - 6, 0, rng),
+        _write(tmp_path / 'a', MIDNIGHT - 3, 2, rng),
+        _write(tmp_path / 'a', MIDNIGHT, 10, rng, name_time=MIDNIGHT - 3),
+        _write(tmp_path / 'a', MIDNIGHT + 3, 0, rng),
+    ]
+    assert sorted(fns) != helpers.time_order(fns)
+
+    root = str(tmp_path / 'index')
+    written = prefix_index.build(sorted(fns), root, workers=2)
+    assert len(written) == 2 * len(ies.HAFX_CHANNELS)
+
+    ordered = helpers.time_order(fns)
+    records = [helpers.read_hafx_sci_array(fn, gzip.open) for fn in ordered]
+    widths = [helpers.get_proper_timedelta(fn) for fn in ordered]
+    info = list(ft.frame_info(records, widths))
+    data = np.concatenate([d for d, _, _ in info])
+    starts = np.concatenate([t for _, t, _ in info])
+
+    idx = prefix_index.PrefixIndex(root)
+    to_dt = lambda s: np.datetime64(int(s * ft.NS_PER_SECOND), 'ns')
+    edges = np.arange(MIDNIGHT - 7, MIDNIGHT + 6, 0.5)
+    for ch, name in enumerate(ies.HAFX_CHANNELS):
+        sel = data['ch'] == ch
+        hist, t = data['histogram'][sel].astype(np.int64), starts[sel]
+        for lo, hi, bins in [(MIDNIGHT - 6, MIDNIGHT + 5, (0, 123)), (MIDNIGHT - 1.5, MIDNIGHT + 0.25, (10, 40))]:
+            inside = (t >= lo * ft.NS_PER_SECOND) & (t < hi * ft.NS_PER_SECOND)
+            assert idx.counts(name, to_dt(lo), to_dt(hi), bins) == hist[inside, bins[0]:bins[1]].sum()
+            np.testing.assert_array_equal(idx.spectrum(name, to_dt(lo), to_dt(hi)), hist[inside].sum(axis=0))
+
+        which = np.searchsorted(edges * ft.NS_PER_SECOND, t, side='right') - 1
+        expected = np.bincount(which, weights=hist[:, 5:50].sum(axis=1), minlength=len(edges))[:len(edges) - 1]
+        got = idx.light_curve(name, [to_dt(e) for e in edges], (5, 50))
+        np.testing.assert_array_equal(got, expected)